@@ -0,0 +1,73 @@
+"""Benchmark building the test tree from a large number of test ids.
+
+Usage:
+    python benchmarks/tree_build.py [--count N]
+
+Builds trees shaped like real projects: one huge parametrized pytest
+module, and a unittest project with many modules and classes. Each
+shape is built with build_from_ids(), and one test at a time with
+put_test() in discovery order.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cricket.pytest.model import PyTestTestSuite  # noqa: E402
+from cricket.unittest.model import UnittestTestSuite  # noqa: E402
+
+
+def parametrized_ids(count):
+    "A single pytest file with `count` parametrized cases."
+    return [
+        'tests/test_params.py::test_value[%d-%s]' % (i, 'abcdef'[i % 6])
+        for i in range(count)
+    ]
+
+
+def project_ids(count):
+    "A unittest project with 10 tests per class and 10 classes per module."
+    return [
+        'project.tests.package%d.test_module%d.Case%d.test_%d' % (
+            i // 10000, i // 100, i // 10, i
+        )
+        for i in range(count)
+    ]
+
+
+def timed(label, suite_class, build):
+    suite = suite_class()
+    start = time.perf_counter()
+    build(suite)
+    elapsed = time.perf_counter() - start
+    count, tests = suite.find_tests(active=False, allow_all=True)
+    print('  %-28s %8d tests %8.3fs' % (label, count, elapsed))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=100000,
+                        help='Number of test ids in each tree')
+    options = parser.parse_args()
+
+    for name, suite_class, ids in [
+        ('pytest parametrized', PyTestTestSuite, parametrized_ids(options.count)),
+        ('unittest project', UnittestTestSuite, project_ids(options.count)),
+    ]:
+        # Discovery output isn't necessarily in sorted order.
+        shuffled = list(ids)
+        random.Random(0).shuffle(shuffled)
+
+        print(name)
+        timed('build_from_ids (shuffled)', suite_class,
+              lambda suite: suite.build_from_ids(shuffled))
+        timed('put_test (discovery order)', suite_class,
+              lambda suite: [suite.put_test(test_id) for test_id in ids])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""A persistent cache of discovered tests.
+
+Discovering tests means starting a subprocess that imports the whole
+project, which can be slow. The cache remembers the tests that were
+found in each file, along with the modification time and size of the
+file, so that only files that have changed need to be collected again.
+"""
+import fnmatch
+import json
+import os
+
+from cricket.events import debug
+
+
+# The cache lives with the test project (the current directory)
+CACHE_PATH = os.path.join('.cricket', 'discovery.json')
+
+# Directories that never contain tests
+SKIP_DIRS = ('__pycache__', 'build', 'dist', 'node_modules', 'venv', 'CVS')
+
+
+def file_stamp(path):
+    """Return a value that changes whenever the file does.
+
+    Returns None if the file doesn't exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def find_files(patterns, top='.', dirs=None):
+    """Walk the directory tree looking for files matching any of the patterns.
+
+    Hidden directories, and directories that hold build products or
+    virtual environments are skipped. If `dirs` is a list, the
+    (normalized) path of every directory walked is appended to it.
+
+    Returns a list of normalized paths, relative to `top`.
+    """
+    found = []
+    for dirpath, dirnames, filenames in os.walk(top):
+        if dirs is not None:
+            dirs.append(os.path.normpath(dirpath))
+        dirnames[:] = [
+            dirname for dirname in dirnames
+            if not dirname.startswith('.')
+            and dirname not in SKIP_DIRS
+            and not dirname.endswith('.egg-info')
+        ]
+        for filename in filenames:
+            if any(fnmatch.fnmatch(filename, pattern) for pattern in patterns):
+                found.append(os.path.normpath(os.path.join(dirpath, filename)))
+    return found
+
+
+class DiscoveryCache:
+    """The tests found in each file by previous discovery runs.
+
+    The cache is only valid for the test system that created it;
+    a cache written by a different TestSuite class is ignored.
+    """
+    VERSION = 1
+
+    def __init__(self, name, path=CACHE_PATH):
+        self.name = name    # Name of the TestSuite class using the cache
+        self.path = path
+        self.files = {}     # { file path : { 'stamp': stamp, 'tests': [test ids] } }
+        self.config = {}    # { config file path : stamp }
+
+    def load(self):
+        """Read the cache from disk.
+
+        Returns True if a usable cache was found.
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            debug("No discovery cache at %r: %s", self.path, e)
+            return False
+
+        if data.get('version') != self.VERSION or data.get('name') != self.name:
+            debug("Discovery cache %r is for %r, ignoring", self.path, data.get('name'))
+            return False
+
+        self.files = data['files']
+        self.config = data['config']
+        debug("Loaded %d files from discovery cache", len(self.files))
+        return True
+
+    def save(self):
+        "Write the cache to disk."
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        # Write then rename, so a crash can't leave a partial cache.
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({
+                'version': self.VERSION,
+                'name': self.name,
+                'files': self.files,
+                'config': self.config,
+            }, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def tests(self):
+        "Return every cached test id."
+        return [
+            test_id
+            for entry in self.files.values()
+            for test_id in entry['tests']
+        ]
+
+    def config_changed(self, config_files):
+        """Has any file that affects discovery of every test changed?
+
+        Arguments:
+          config_files  Paths of the configuration files that exist now.
+        """
+        current = {path: file_stamp(path) for path in config_files}
+        return current != self.config
+
+    def changed_files(self, test_files):
+        """Work out which files need to be collected again.
+
+        Arguments:
+          test_files  Paths of files that may contain tests.
+
+        Returns a list of files that are new or have been modified,
+        and a list of cached files that no longer exist.
+        """
+        changed = []
+        removed = []
+        for path, entry in self.files.items():
+            stamp = file_stamp(path)
+            if stamp is None:
+                removed.append(path)
+            elif stamp != entry['stamp']:
+                changed.append(path)
+
+        for path in test_files:
+            if path not in self.files:
+                changed.append(path)
+
+        return changed, removed
+
+    def update(self, path, tests):
+        "Record the tests that were found in a file."
+        stamp = file_stamp(path)
+        if stamp is None:
+            self.files.pop(path, None)
+        else:
+            self.files[path] = {'stamp': stamp, 'tests': list(tests)}
+
+    def mark_stale(self, path):
+        """Record that a file has to be collected again, whatever its stamp.
+
+        Used for files whose collection failed; they keep the tests
+        recorded for them.
+        """
+        entry = self.files.setdefault(path, {'tests': []})
+        entry['stamp'] = None
+
+    def update_config(self, config_files):
+        "Record the current state of the configuration files."
+        self.config = {path: file_stamp(path) for path in config_files}
+
+    def clear(self):
+        "Forget everything in the cache."
+        self.files = {}
+        self.config = {}
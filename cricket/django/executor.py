@@ -1,18 +1,22 @@
 from __future__ import absolute_import
 
+import unittest
+
 try:
     from coverage import coverage
 except ImportError:
     coverage = None
 
 from django.conf import settings
+from django.db import connections
 try:
     from django.test.simple import DjangoTestSuiteRunner
 except ImportError:
     DjangoTestSuiteRunner = None
 from django.test.utils import get_runner
 
-from cricket.pipes import PipedTestRunner
+from cricket.django.model import write_migrations_hash
+from cricket.pipes import PipedTestRunner, run_forked
 
 # Dynamically retrieve the test runner class for this project.
 TestRunnerClass = get_runner(settings, None)
@@ -23,10 +27,96 @@ class TestExecutor(TestRunnerClass):
 
     Formats output in a machine-readable format.
     """
+    @classmethod
+    def add_arguments(cls, parser):
+        super(TestExecutor, cls).add_arguments(parser)
+        parser.add_argument(
+            '--rebuild-db', action='store_true', dest='rebuild_db',
+            help='With --keepdb, build the test databases again (then keep them)',
+        )
+        parser.add_argument(
+            '--migrations-hash', dest='migrations_hash',
+            help='With --rebuild-db, the hash of the migrations to record once the '
+                 'test databases have been built',
+        )
+
+    def __init__(self, rebuild_db=False, migrations_hash=None, **kwargs):
+        super(TestExecutor, self).__init__(**kwargs)
+        self.rebuild_db = rebuild_db
+        self.migrations_hash = migrations_hash
+
+    def setup_databases(self, **kwargs):
+        if not self.rebuild_db:
+            return super(TestExecutor, self).setup_databases(**kwargs)
+
+        # Replace any kept databases; teardown still keeps the new ones.
+        keepdb, self.keepdb = self.keepdb, False
+        try:
+            old_config = super(TestExecutor, self).setup_databases(**kwargs)
+        finally:
+            self.keepdb = keepdb
+
+        if self.migrations_hash:
+            # Clones are only made for more than one worker.
+            clones = self.parallel if self.parallel > 1 else 0
+            write_migrations_hash(self.migrations_hash, clones=clones)
+        return old_config
+
     def run_suite(self, suite, **kwargs):
         return PipedTestRunner().run(suite)
 
 
+class TestPoolExecutor(TestExecutor):
+    """A Django test runner that runs shards of the test suite in parallel.
+
+    The test databases are set up once, with a clone for each shard.
+    Then a worker is forked to run each shard against its own clone,
+    writing its results to pipes of its own (see cricket.pipes.run_forked).
+    """
+    @classmethod
+    def add_arguments(cls, parser):
+        super(TestPoolExecutor, cls).add_arguments(parser)
+        parser.add_argument(
+            '--shard', action='append', nargs='+', dest='shards', metavar='LABEL',
+            help='Test labels to run in a worker of their own.  May be repeated',
+        )
+
+    def __init__(self, shards=None, **kwargs):
+        super(TestPoolExecutor, self).__init__(**kwargs)
+        self.shards = shards or []
+        self.shard_suites = []
+        # Have setup_databases() make a clone for each worker.
+        self.parallel = len(self.shards)
+
+    def build_suite(self, test_labels=None, *args, **kwargs):
+        # Build each shard on its own, rather than as a ParallelTestSuite.
+        parallel, self.parallel = self.parallel, 1
+        try:
+            self.shard_suites = [
+                super(TestPoolExecutor, self).build_suite(shard, *args, **kwargs)
+                for shard in self.shards
+            ]
+        finally:
+            self.parallel = parallel
+        return unittest.TestSuite(self.shard_suites)
+
+    def setup_worker(self, index):
+        "Switch a worker to the clone of the test databases made for it."
+        for alias in connections:
+            connection = connections[alias]
+            clone = connection.creation.get_test_db_clone_settings(str(index + 1))
+            # Update in place, as django.test.runner does for its workers.
+            connection.settings_dict.update(clone)
+            connection.close()
+
+    def run_suite(self, suite, **kwargs):
+        # The workers mustn't share the connections of this process.
+        connections.close_all()
+        run_forked(self.shard_suites, setup_worker=self.setup_worker)
+        # Results have gone to cricket; there is nothing to count here.
+        return unittest.TestResult()
+
+
 class TestCoverageExecutor(TestExecutor):
     """A Django test runner that runs the test suite with coverage
 
@@ -3,22 +3,86 @@ In general, you would expect that there would only be one project class
 specified in this file. It provides the interface to executing test
 collecetion and execution.
 '''
+import hashlib
+import json
 import os
+import re
 import sys
 
+from cricket.cache import find_files
+from cricket.events import debug
 from cricket.model import TestSuite, TestModule, TestCase, TestMethod
 
 
+# The hash of the migrations each kept test database was built with
+MIGRATIONS_PATH = os.path.join('.cricket', 'django-migrations.json')
+
+
+def migrations_hash(top='.'):
+    """Return a hash of the contents of every migration file in the project.
+
+    A test database that was kept between runs has to be rebuilt
+    whenever this changes.
+    """
+    digest = hashlib.sha1()
+    for path in sorted(find_files(['*.py'], top)):
+        if 'migrations' in path.split(os.sep)[:-1]:
+            digest.update(path.encode('utf-8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def kept_databases(clones=0):
+    """Return the names of the test databases used by a run.
+
+    A run uses the test database, and for a run in parallel workers,
+    a clone of it for each worker.
+    """
+    return ['serial'] + ['clone-%d' % index for index in range(1, clones + 1)]
+
+
+def read_migrations_hashes(path=MIGRATIONS_PATH):
+    "Return { database name : hash } of the migrations each kept test database was built with."
+    try:
+        with open(path) as f:
+            hashes = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return hashes if isinstance(hashes, dict) else {}
+
+
+def write_migrations_hash(current, clones=0, path=MIGRATIONS_PATH):
+    """Record that the test databases of a run were built with the migrations hashed as `current`.
+
+    Only called once the databases have been set up, so a failed
+    rebuild is tried again by the next run.
+    """
+    hashes = read_migrations_hashes(path)
+    hashes.update((name, current) for name in kept_databases(clones))
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with open(path, 'w') as f:
+        json.dump(hashes, f, indent=1, sort_keys=True)
+
+
 class DjangoTestSuite(TestSuite):
     '''
     The Project is a wrapper around the command-line calls to interface
     to test collection and test execution
     '''
+    # Separate `manage.py test` processes would all use the same test database.
+    SEPARATE_WORKERS = False
+
+    # Django's TestCase loads `fixtures`, and runs setUpTestData(), once per class.
+    SHARED_FIXTURES_RE = re.compile(r'\b(setUpModule|setUpClass|setUpTestData)\b|\bfixtures\s*=')
 
     def __init__(self, options=None):
         self.settings = None
         if options and hasattr(options, 'settings'):
             self.settings = options.settings
+        self.keepdb = bool(options and getattr(options, 'keepdb', False))
         super(DjangoTestSuite, self).__init__()
 
     @classmethod
@@ -30,6 +94,9 @@ class DjangoTestSuite(TestSuite):
                          "DJANGO_SETTINGS_MODULE environment variable will be "
                          "used.")
         parser.add_argument('--settings', help=settings_help)
+        parser.add_argument('--keepdb', action='store_true',
+                            help="Keep the test database between runs.  It is only "
+                                 "rebuilt when a migration file changes")
 
     @property
     def script(self):
@@ -46,8 +113,27 @@ class DjangoTestSuite(TestSuite):
             raise Exception("Can't find a Django test suite to execute.")
         return script
 
-    def discover_commandline(self):
-        "Command lineDiscover all available tests in a project."
+    def keepdb_arguments(self, clones=0):
+        """Return the test command options that keep the test databases between runs.
+
+        If the migrations have changed since any of the databases
+        used by the run (see kept_databases) was built, they are all
+        rebuilt (and kept) by this run; the test runner records the
+        new hash once they have been set up.
+        """
+        if not self.keepdb:
+            return []
+
+        current = migrations_hash()
+        built = read_migrations_hashes()
+        if all(built.get(name) == current for name in kept_databases(clones)):
+            return ['--keepdb']
+
+        debug("Migrations have changed; rebuilding the test databases")
+        return ['--keepdb', '--rebuild-db', '--migrations-hash={0}'.format(current)]
+
+    def discover_commandline(self, labels=None):
+        "Command line: Discover all available tests in a project (or just those in labels)."
 
         command = [sys.executable] + self.script
 
@@ -55,12 +141,15 @@ class DjangoTestSuite(TestSuite):
             command.append('--settings={0}'.format(self.settings))
 
         command.append('--testrunner=cricket.django.discoverer.TestDiscoverer')
+        if labels:
+            command.extend(labels)
 
         return command
 
     def execute_commandline(self, labels):
         "Return the command line to execute the specified test labels"
-        command = [sys.executable] + self.script
+        script = self.script
+        command = [sys.executable] + script
 
         if self.settings:
             command.append('--settings={0}'.format(self.settings))
@@ -69,7 +158,33 @@ class DjangoTestSuite(TestSuite):
             command.append('--testrunner=cricket.django.executor.TestCoverageExecutor')
         else:
             command.append('--testrunner=cricket.django.executor.TestExecutor')
-        command.extend(labels)
+
+        if script[0] == 'manage.py':
+            # Django's own test script can't take the runner's options.
+            command.extend(self.keepdb_arguments())
+
+        if labels:
+            command.extend(labels)
+
+        return command
+
+    def pool_commandline(self, shards):
+        "Return the command line to fork a worker for each shard of test labels."
+        script = self.script
+        if not hasattr(os, 'fork') or self.coverage or script[0] != 'manage.py':
+            # Django's own test script can't take the runner's options.
+            return None
+
+        command = [sys.executable] + script
+
+        if self.settings:
+            command.append('--settings={0}'.format(self.settings))
+
+        command.append('--testrunner=cricket.django.executor.TestPoolExecutor')
+        command.extend(self.keepdb_arguments(clones=len(shards)))
+        for shard in shards:
+            command.append('--shard')
+            command.extend(shard)
 
         return command
 
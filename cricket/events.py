@@ -1,7 +1,15 @@
 from __future__ import print_function
 
+import codecs
 import datetime
 import os
+import selectors
+from threading import Thread
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty  # python 3.x
 
 
 class EventSource(object):
@@ -18,20 +26,21 @@ class EventSource(object):
         debug("bind %r:%r to %r", cls, event, handler)
 
     def emit(self, event, **data):
-        try:
-            debug("emit %r:%r to %d", 
-                  self.__class__, event, len(self._events[self.__class__][event]))
-            for handler in self._events[self.__class__][event]:
-                debug("emit %r(%r, **%r)", handler, self, data)
-                handler(self, **data)
-        except KeyError:
+        handlers = self._events.get(self.__class__, {}).get(event)
+        if not handlers:
             # No handler registered for event.
             debug("emit %r:%r no receivers", self.__class__, event)
-            pass
+            return
+
+        debug("emit %r:%r to %d", self.__class__, event, len(handlers))
+        for handler in handlers:
+            debug("emit %r(%r, **%r)", handler, self, data)
+            handler(self, **data)
 
 
 # TODO: debug support should be in it's own file
 _debug_on = False
+_debug_stream = None  # Where debug output goes; None for sys.stdout
 
 def debug(msg, *args, **kwargs):
     """Our simple debug printer.  Styled after log.debug()
@@ -51,7 +60,7 @@ def debug(msg, *args, **kwargs):
         return
     if args:
         msg = msg % args
-    print(msg, end=kwargs.get('end', '\n'), flush=True)
+    print(msg, end=kwargs.get('end', '\n'), file=_debug_stream, flush=True)
 
 
 def set_debug(enable):
@@ -64,11 +73,183 @@ def set_debug(enable):
     return old
 
 
+def set_debug_stream(stream):
+    """Send debug output to stream (None for stdout), and return the old stream."""
+    global _debug_stream
+
+    old = _debug_stream
+    _debug_stream = stream
+
+    return old
+
+
 def is_debug():
     """Return debug enable status."""
     return _debug_on
 
 
+def enqueue_output(out, queue):
+    """A utility method for consuming piped output from a subprocess.
+
+    Run this as a thread to get non-blocking data from out.
+
+    Reads content from `out` one line at a time, strip trailing
+    whitespace, and puts it onto queue for consumption
+    """
+    for line in iter(out.readline, b''):  # read until EOF
+        queue.put(line.rstrip().decode('utf-8'))
+    debug("enqueue_output closing %r", out)
+    out.close()
+
+
+class LineStream(object):
+    """The lines read from one pipe by a PipeReader.
+
+    Bytes are decoded as UTF-8 as they arrive; a character split
+    between two reads is decoded once the rest of it arrives. Lines
+    have trailing whitespace stripped, like enqueue_output.
+    """
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.closed = False     # Saw the end of the pipe
+        self.lines = []         # Complete lines not taken yet
+
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._partial = ''      # Text after the last newline
+
+    def __len__(self):
+        return len(self.lines)
+
+    def feed(self, data):
+        "Add bytes read from the pipe; empty data marks the end of the pipe."
+        final = not data
+        text = self._partial + self._decoder.decode(data, final)
+        lines = text.split('\n')
+        self._partial = lines.pop()
+        if final:
+            if self._partial:
+                lines.append(self._partial)
+                self._partial = ''
+            self.closed = True
+        self.lines.extend(line.rstrip() for line in lines)
+
+    def take(self, limit=None):
+        "Remove and return the complete lines read so far (at most `limit`)."
+        if limit is None or limit >= len(self.lines):
+            lines, self.lines = self.lines, []
+        else:
+            lines = self.lines[:limit]
+            del self.lines[:limit]
+        return lines
+
+
+class PipeReader(object):
+    """Reads the output pipes of subprocesses without blocking.
+
+    Every registered pipe is read a large chunk at a time, whenever
+    read() is called, and split into lines in bulk. This replaces one
+    enqueue_output thread (and a Queue.put for every line) per pipe.
+
+    Where pipes can't be selected (Windows), a thread per pipe reads
+    the chunks instead.
+    """
+    CHUNK_SIZE = 64 * 1024
+    # The longest wait for a reading thread to stop, in seconds
+    JOIN_TIMEOUT = 1.0
+
+    def __init__(self, threaded=None):
+        self._threaded = os.name == 'nt' if threaded is None else threaded
+        if self._threaded:
+            self._chunks = Queue()   # (stream, bytes) read by the threads
+            self._threads = []       # (thread, stream) for each pipe
+        else:
+            self._selector = selectors.DefaultSelector()
+
+    def register(self, pipe, stream=None):
+        """Start reading a pipe.
+
+        Returns the stream the data is fed to; by default, a LineStream.
+        """
+        if stream is None:
+            stream = LineStream(pipe)
+        if self._threaded:
+            thread = Thread(target=self._read_thread, args=(stream, ))
+            thread.daemon = True
+            thread.start()
+            self._threads.append((thread, stream))
+        else:
+            self._selector.register(pipe, selectors.EVENT_READ, stream)
+        return stream
+
+    def read(self, timeout=0):
+        "Read whatever is waiting on the pipes, waiting at most `timeout` seconds."
+        if self._threaded:
+            self._read_chunks(timeout)
+            return
+
+        if self._selector is None or not self._selector.get_map():
+            return
+        for key, mask in self._selector.select(timeout):
+            stream = key.data
+            try:
+                data = os.read(key.fd, self.CHUNK_SIZE)
+            except OSError as e:
+                debug("Error reading %r: %r", stream.pipe, e)
+                data = b''
+            stream.feed(data)
+            if not data:
+                debug("PipeReader closing %r", stream.pipe)
+                self._selector.unregister(stream.pipe)
+                stream.pipe.close()
+
+    def _read_thread(self, stream):
+        "Read chunks from a pipe in a background thread."
+        try:
+            fd = stream.pipe.fileno()
+            while True:
+                data = os.read(fd, self.CHUNK_SIZE)
+                self._chunks.put((stream, data))
+                if not data:
+                    break
+        except (OSError, ValueError) as e:
+            # The pipe was closed by close()
+            debug("Error reading %r: %r", stream.pipe, e)
+            self._chunks.put((stream, b''))
+        debug("PipeReader closing %r", stream.pipe)
+        stream.pipe.close()
+
+    def _read_chunks(self, timeout):
+        "Add the chunks read by the threads to their streams."
+        try:
+            stream, data = self._chunks.get(timeout=timeout) if timeout else self._chunks.get(block=False)
+            while True:
+                stream.feed(data)
+                stream, data = self._chunks.get(block=False)
+        except Empty:
+            pass
+
+    def close(self):
+        "Stop reading every pipe."
+        if self._threaded:
+            # Closing the pipes stops the threads that are still reading.
+            for thread, stream in self._threads:
+                try:
+                    stream.pipe.close()
+                except OSError:
+                    pass
+            for thread, stream in self._threads:
+                thread.join(self.JOIN_TIMEOUT)
+                if thread.is_alive():
+                    debug("PipeReader thread for %r didn't stop", stream.pipe)
+            self._threads = []
+        elif self._selector is not None:
+            for key in list(self._selector.get_map().values()):
+                self._selector.unregister(key.fileobj)
+                key.fileobj.close()
+            self._selector.close()
+            self._selector = None
+
+
 def fix_file_path(path):
     """Turn a configuration file path into one suitable for the local OS."""
 
@@ -1,31 +1,18 @@
+from argparse import ArgumentTypeError
+import heapq
 import json
+import math
 import os
 import subprocess
 import sys
-from threading import Thread
 
-try:
-    from Queue import Queue, Empty
-except ImportError:
-    from queue import Queue, Empty  # python 3.x
-
-from cricket.events import EventSource, debug
+from cricket.cache import find_files
+from cricket.events import EventSource, PipeReader, debug, is_debug
 from cricket.model import TestMethod
-from cricket.pipes import PipedTestResult, PipedTestRunner
-
-
-def enqueue_output(out, queue):
-    """A utility method for consuming piped output from a subprocess.
-
-    Run this as a thread to get non-blocking data from out.
-
-    Reads content from `out` one line at a time, strip trailing
-    whitespace, and puts it onto queue for consumption
-    """
-    for line in iter(out.readline, b''):  # read until EOF
-        queue.put(line.rstrip().decode('utf-8'))
-    debug("enqueue_output closing %r", out)
-    out.close()
+from cricket.protocol import (
+    END_TEST_RESULTS, OUTPUT, POOL_FDS_ENV, RESULT_FD_ENV, RESULT_SEPARATOR, START_TEST_RESULTS,
+    FrameStream
+)
 
 
 def parse_status_and_error(post):
@@ -70,51 +57,586 @@ def format_time(duration):
     return ret
 
 
-class Executor(EventSource):
-    SEPARATOR_LINES = (PipedTestResult.RESULT_SEPARATOR,
-                       PipedTestRunner.START_TEST_RESULTS,
-                       PipedTestRunner.END_TEST_RESULTS)
+def parse_workers(value):
+    """Convert a --workers command line value into a worker count.
+
+    'auto' starts one worker per CPU.
+    """
+    if value == 'auto':
+        return os.cpu_count() or 1
+    try:
+        workers = int(value)
+    except ValueError:
+        raise ArgumentTypeError("expected a number or 'auto', got %r" % value)
+    if workers < 1:
+        raise ArgumentTypeError("must run at least 1 worker, got %r" % value)
+    return workers
+
+
+# Tests without shared fixtures are split into pieces this much smaller
+# than a worker's share, so the workers can be balanced closely.
+CHUNKS_PER_WORKER = 4
 
-    "A wrapper around the subprocess that executes tests."
-    def __init__(self, test_suite, count, labels):
-        self.test_suite = test_suite  # The test tree
-        self.total_count = count  # The total count of tests under execution
-        self.completed_count = 0  # The count of tests that have been executed.
-        self.result_count = {}    # The count of specific test results { status : count }
-        self.error_buffer = []    # An accumulator for error output from all the tests.
-        self.current_test = None  # The TestMethod object currently under execution.
-        self.test_start = None    # Info from test start {path : "", start_time : seconds}
-        self.start_time = None    # The timestamp when current_test started
 
-        cmd = self.test_suite.execute_commandline(labels)
-        debug("Running(%r): %r", os.getcwd(), cmd)
-        self.proc = subprocess.Popen(
+def split_group(paths, costs, size):
+    """Split a group of tests into consecutive chunks costing no more than about `size`.
+
+    Arguments:
+      paths  List of test paths, in execution order
+      costs  List of the cost of each test
+      size   The most each chunk should cost
+
+    Returns a list of (cost, [test paths]).
+    """
+    total = sum(costs)
+    count = math.ceil(total / size) if size > 0 else 1
+    if count <= 1:
+        return [(total, paths)]
+
+    target = total / count
+    chunks = []
+    chunk, chunk_cost = [], 0.0
+    for path, cost in zip(paths, costs):
+        chunk.append(path)
+        chunk_cost += cost
+        if chunk_cost >= target and len(chunks) < count - 1:
+            chunks.append((chunk_cost, chunk))
+            chunk, chunk_cost = [], 0.0
+    if chunk:
+        chunks.append((chunk_cost, chunk))
+    return chunks
+
+
+def balance_shards(groups, workers):
+    """Distribute groups of tests across workers.
+
+    Uses the longest-processing-time-first rule: the most expensive
+    group is always given to the worker with the least work so far.
+
+    Arguments:
+      groups   List of (cost, [test paths]), in execution order
+      workers  Maximum number of shards to create
+
+    Returns a list of shards (each a list of test paths, in their
+    original order) and a list of the total cost of each shard.
+    """
+    workers = min(workers, len(groups))
+    if workers < 1:
+        return [], []
+
+    order = sorted(range(len(groups)), key=lambda index: -groups[index][0])
+    heap = [(0.0, worker) for worker in range(workers)]
+    assigned = [[] for worker in range(workers)]
+    loads = [0.0] * workers
+    for index in order:
+        load, worker = heapq.heappop(heap)
+        assigned[worker].append(index)
+        loads[worker] = load + groups[index][0]
+        heapq.heappush(heap, (loads[worker], worker))
+
+    shards = [
+        [path for index in sorted(indices) for path in groups[index][1]]
+        for indices in assigned
+    ]
+    return shards, loads
+
+
+class ProgressBatch:
+    """The changes to the test run seen since the display last caught up.
+
+    Only the latest state of each test is kept: a test that starts and
+    ends between two updates is only reported as ended. Batches can be
+    merged, so work the display doesn't get to can wait for the next one.
+    """
+    def __init__(self):
+        self.tests = {}         # Tests that changed { path : TestMethod }, in order of change
+        self.running = set()    # Paths of tests that have started, but not ended
+        self.ended = []         # Paths of tests that ended, in order
+        self.output = set()     # Paths of tests that got output
+        self.last_started = None  # Path of the most recently started test
+        self.status_update = None  # The latest output that wasn't from a test
+        self.remaining_time = None  # The latest estimate of the time left
+
+    def __bool__(self):
+        return bool(
+            self.tests or self.ended or self.output
+            or self.status_update is not None
+        )
+
+    def test_start(self, test):
+        self.tests.pop(test.path, None)
+        self.tests[test.path] = test
+        self.running.add(test.path)
+        self.last_started = test.path
+
+    def test_end(self, test, remaining_time):
+        self.tests.pop(test.path, None)
+        self.tests[test.path] = test
+        self.running.discard(test.path)
+        self.ended.append(test.path)
+        self.remaining_time = remaining_time
+
+    def merge(self, other):
+        "Add the changes in a later batch to this one."
+        for path, test in other.tests.items():
+            self.tests.pop(path, None)
+            self.tests[path] = test
+            if path in other.running:
+                self.running.add(path)
+            else:
+                self.running.discard(path)
+        self.ended.extend(other.ended)
+        self.output.update(other.output)
+        if other.last_started is not None:
+            self.last_started = other.last_started
+        if other.status_update is not None:
+            self.status_update = other.status_update
+        if other.remaining_time is not None:
+            self.remaining_time = other.remaining_time
+
+
+def start_process(cmd, reader, framed=True, stdin=None):
+    """Start a test subprocess, and register its pipes with `reader`.
+
+    If `framed` is True (and the platform can pass it a descriptor),
+    the subprocess is given a pipe of its own for results (see
+    cricket.protocol.FramedResultWriter). Test processes that don't
+    use it write their results to stdout, as JSON lines.
+
+    Returns the process, the LineStreams of its stdout and stderr, and
+    the FrameStream of its results (or None).
+    """
+    # Passing a descriptor to the subprocess needs POSIX.
+    framed = framed and 'posix' in sys.builtin_module_names
+    env = None
+    pass_fds = ()
+    if framed:
+        results_fd, write_fd = os.pipe()
+        env = dict(os.environ)
+        env[RESULT_FD_ENV] = str(write_fd)
+        pass_fds = (write_fd, )
+
+    debug("Running(%r): %r", os.getcwd(), cmd)
+    try:
+        proc = subprocess.Popen(
             cmd,
-            stdin=None,
+            stdin=stdin,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             shell=False,
-            bufsize=1,
+            bufsize=0,
+            env=env,
+            pass_fds=pass_fds,
             close_fds='posix' in sys.builtin_module_names
         )
+    finally:
+        if framed:
+            os.close(write_fd)  # Only the subprocess writes results.
+
+    # The reader collects the output of all the pipes when polled.
+    stdout = reader.register(proc.stdout)
+    stderr = reader.register(proc.stderr)
+    if framed:
+        pipe = os.fdopen(results_fd, 'rb', 0)
+        results = reader.register(pipe, FrameStream(pipe))
+    else:
+        results = None
+    return proc, stdout, stderr, results
+
+
+def start_pool(cmd, reader, count):
+    """Start a test subprocess that forks `count` workers, and register their pipes with `reader`.
+
+    Every worker gets a pipe of its own for results. The first worker
+    writes its output to the stdout and stderr of the subprocess; the
+    others get pipes of their own for those too. The descriptors are
+    passed in POOL_FDS_ENV, as a JSON list of [stdout, stderr, results]
+    for each worker, with nulls for the first worker's stdout and stderr.
 
-        # Piped stdout/stderr reads are blocking; therefore, we need to
-        # do all our readline calls in a background thread, and use a
-        # queue object to store lines that have been read.
-        self.stdout = Queue()
-        t = Thread(target=enqueue_output, args=(self.proc.stdout, self.stdout))
-        t.daemon = True
-        t.start()
+    Returns a (process, stdout, stderr, results) for each worker, as
+    start_process() does; the workers share the process.
+    """
+    read_fds = []               # [stdout, stderr, results] read by each worker
+    write_fds = []              # [stdout, stderr, results] written by each worker
+    for index in range(count):
+        worker_read, worker_write = [], []
+        for stream in ('stdout', 'stderr', 'results'):
+            if index == 0 and stream != 'results':
+                worker_read.append(None)
+                worker_write.append(None)
+            else:
+                read_fd, write_fd = os.pipe()
+                worker_read.append(read_fd)
+                worker_write.append(write_fd)
+        read_fds.append(worker_read)
+        write_fds.append(worker_write)
+    pass_fds = [fd for fds in write_fds for fd in fds if fd is not None]
+
+    env = dict(os.environ)
+    env[POOL_FDS_ENV] = json.dumps(write_fds)
+    debug("Running pool of %d(%r): %r", count, os.getcwd(), cmd)
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            stdin=None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=False,
+            bufsize=0,
+            env=env,
+            pass_fds=pass_fds,
+            close_fds=True
+        )
+    except Exception:
+        for fds in read_fds:
+            for fd in fds:
+                if fd is not None:
+                    os.close(fd)
+        raise
+    finally:
+        for fd in pass_fds:
+            os.close(fd)  # Only the subprocess writes to the pipes.
+
+    processes = []
+    for index, (stdout_fd, stderr_fd, results_fd) in enumerate(read_fds):
+        if index == 0:
+            stdout = reader.register(proc.stdout)
+            stderr = reader.register(proc.stderr)
+        else:
+            stdout = reader.register(os.fdopen(stdout_fd, 'rb', 0))
+            stderr = reader.register(os.fdopen(stderr_fd, 'rb', 0))
+        pipe = os.fdopen(results_fd, 'rb', 0)
+        results = reader.register(pipe, FrameStream(pipe))
+        processes.append((proc, stdout, stderr, results))
+    return processes
+
+
+class TestServer:
+    """A test process that is kept running between test runs.
+
+    The test process collects the tests once, then runs the labels it
+    is sent on stdin (see TestSuite.serve_commandline), so a run
+    doesn't wait for the interpreter to start and the tests to be
+    imported. If any of the files matching `patterns` has changed
+    since the process started, it would run stale code, so it is
+    restarted before the next run.
+    """
+    def __init__(self, cmd, patterns, framed=True):
+        self.cmd = cmd
+        self.patterns = patterns
+        self.framed = framed
+        self.reader = None      # Reads the pipes of the current process
+        self.proc = None        # The current process, if one has been started
+        self.stdout = None
+        self.stderr = None
+        self.results = None
+        self.starts = 0         # The number of processes started
+        self._mtimes = None     # { path : mtime } of the files when the process started
+        self._paths = None      # The files and directories found by the last walk
+
+    def snapshot(self, rescan=True):
+        """Return the modification time of every watched file.
+
+        The times of the directories walked are included too; adding
+        or removing a file changes the time of its directory. So
+        unless `rescan` is set, the paths found by the last walk are
+        just looked at again, rather than walking the whole tree.
+        """
+        if rescan or self._paths is None:
+            dirs = []
+            self._paths = find_files(self.patterns, dirs=dirs) + dirs
+        mtimes = {}
+        for path in self._paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                pass
+        return mtimes
 
-        self.stderr = Queue()
-        t = Thread(target=enqueue_output, args=(self.proc.stderr, self.stderr))
-        t.daemon = True
-        t.start()
+    @property
+    def is_running(self):
+        "Return True if the server process is running."
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        "Start a new server process, stopping any current one."
+        self.stop()
+        # Look at the files first, so changes made while starting are noticed.
+        self._mtimes = self.snapshot()
+        self.reader = PipeReader()
+        debug("Starting test server(%r): %r", os.getcwd(), self.cmd)
+        self.proc, self.stdout, self.stderr, self.results = start_process(
+            self.cmd, self.reader, self.framed, stdin=subprocess.PIPE)
+        self.starts += 1
+
+    def run(self, labels):
+        """Ask the server to run the tests in labels (all of them, if empty).
+
+        Returns the process, and the streams its output is read into,
+        as start_process() does.
+        """
+        if not self.is_running or self.snapshot(rescan=False) != self._mtimes:
+            self.start()
+        else:
+            # Anything left over from the last run isn't part of this one.
+            self.reader.read()
+            for stream in (self.stdout, self.stderr, self.results):
+                if stream is not None:
+                    stream.take()
+
+        request = ''.join('%s\n' % label for label in labels or []) + '\n'
+        try:
+            self.proc.stdin.write(request.encode('utf-8'))
+        except OSError as e:
+            # The process has died; the worker will see it stop.
+            debug("Test server didn't take request: %r", e)
+        return self.proc, self.stdout, self.stderr, self.results
+
+    def stop(self):
+        "Stop the server process."
+        if self.proc is not None:
+            debug("Stopping test server")
+            try:
+                self.proc.stdin.close()
+            except OSError:
+                pass
+            if self.proc.poll() is None:
+                self.proc.terminate()
+            self.proc.wait()
+            self.proc = None
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+
+class ExecutorWorker:
+    """One subprocess running a shard of the selected tests.
+
+    Holds the process, the streams of lines read from its pipes,
+    and the parse state for its result stream.
+
+    `process` is the (process, stdout, stderr, results) of the
+    subprocess, as returned by start_process(). Workers forked by
+    one subprocess (see start_pool) share the process, but each has
+    pipes of its own. If a `server` is given, the tests are run by
+    that (already running) TestServer.
+    """
+    def __init__(self, process, tests, durations, name="", server=None):
+        self.name = name          # Prefix for debug output
+        self.durations = durations  # Expected test durations { path : seconds }
+        self.pending = set(tests) # Paths of the tests this worker hasn't finished yet
+        self.expected_remaining = sum(durations.get(path, 0.0) for path in self.pending)
+        self.unknown_remaining = sum(1 for path in self.pending if path not in durations)
+        self.current_test = None  # The TestMethod object currently under execution.
+        self.test_start = None    # Info from test start {path : "", start_time : seconds}
+        self.result = None        # (path, status, duration, end time) of the current test, for history
+        self.finished = False     # Saw the suite end marker
+        self.stopped = False      # Process exited, and all its output was read
+        self.framed = False       # Has the subprocess sent framed results?
+        self.end_waited = False   # Waited for stdout after the process exited
+        self.server = server      # The TestServer running the tests, if any
+
+        self.proc, self.stdout, self.stderr, self.results = process
+
+    def test_finished(self, path):
+        "Stop counting a test towards the time this worker has left."
+        if path in self.pending:
+            self.pending.remove(path)
+            if path in self.durations:
+                self.expected_remaining -= self.durations[path]
+            else:
+                self.unknown_remaining -= 1
 
     @property
     def is_running(self):
-        "Return True if this runner currently running."
-        return self.proc.poll() is None
+        "Return True if this worker's subprocess is currently running its tests."
+        return not self.finished and self.proc.poll() is None
+
+    @property
+    def is_done(self):
+        "Return True if this worker will produce no more results."
+        return self.finished or self.stopped
+
+    def check_stopped(self):
+        """Note if the subprocess has exited.
+
+        A worker only counts as stopped once its stdout (and results
+        pipe) have been read to the end, and everything read has been
+        processed; there may still be results in the pipes after the
+        process exits.
+        """
+        if self.results is not None and not (self.results.closed and not self.results.frames):
+            return
+        if self.proc.poll() is not None and self.stdout.closed and not self.stdout.lines:
+            debug("Process%s exited with %d", self.name, self.proc.poll())
+            self.stopped = True
+
+    @property
+    def queue_depth(self):
+        "The number of lines read from the subprocess, but not processed yet."
+        depth = len(self.stdout) + len(self.stderr)
+        if self.results is not None:
+            depth += len(self.results)
+        return depth
+
+    def terminate(self):
+        "Stop the worker's subprocess."
+        if self.is_running:
+            if self.server is not None:
+                # There's no way to stop part way through a run.
+                self.server.stop()
+            else:
+                self.proc.terminate()
+
+
+class Executor(EventSource):
+    SEPARATOR_LINES = (RESULT_SEPARATOR, START_TEST_RESULTS, END_TEST_RESULTS)
+
+    "A wrapper around the subprocesses that execute tests."
+    def __init__(self, test_suite, count, labels, workers=1, framed=True):
+        self.test_suite = test_suite  # The test tree
+        self.total_count = count  # The total count of tests under execution
+        self.completed_count = 0  # The count of tests that have been executed.
+        self.result_count = {}    # The count of specific test results { status : count }
+        self.error_buffer = []    # An accumulator for error output from all the tests.
+        self.start_time = None    # The timestamp when the first test started
+        self.history = test_suite.history  # Durations of previous runs (may be None)
+        self.batch = ProgressBatch()  # Changes seen in the current poll
+        self.lines_read = 0       # The number of lines processed by the last poll
+
+        self.server = None        # The TestServer running the tests, if any
+
+        count, tests = self.test_suite.find_tests(labels=labels, allow_all=True)
+        durations = self.expected_durations(tests)
+        shards, self.planned_durations = self.split_tests(tests, workers, durations)
+
+        # A label for each test could make a command line too long to run;
+        # name whole modules and classes where a shard has all their tests.
+        shard_labels = [self.test_suite.collapse_labels(shard) for shard in shards]
+
+        # Fork the workers from one process that imports the tests, if the test system can.
+        cmd = None
+        if len(shards) > 1 and framed:
+            cmd = self.test_suite.pool_commandline(shard_labels)
+        if len(shards) > 1 and cmd is None and not test_suite.SEPARATE_WORKERS:
+            debug("Test system can't run separate workers; running the tests in one process")
+            shards = [tests]
+            self.planned_durations = [sum(self.planned_durations)]
+
+        if len(shards) == 1 and test_suite.test_server is not None:
+            # Run the tests in the process kept warm from the last run.
+            self.server = test_suite.test_server
+            self.workers = [
+                ExecutorWorker(self.server.run(labels), tests, durations, server=self.server)
+            ]
+            self.reader = self.server.reader
+            return
+
+        self.reader = PipeReader()  # Reads the output of every worker
+        if len(shards) == 1:
+            # A single worker can use the (shorter) labels as given.
+            self.workers = [
+                ExecutorWorker(
+                    start_process(self.test_suite.execute_commandline(labels), self.reader, framed),
+                    tests, durations
+                )
+            ]
+            return
+
+        processes = []
+        try:
+            if cmd is not None:
+                processes = start_pool(cmd, self.reader, len(shards))
+            else:
+                for shard in shard_labels:
+                    processes.append(
+                        start_process(self.test_suite.execute_commandline(shard), self.reader, framed)
+                    )
+        except OSError:
+            # Don't leave the workers that did start running.
+            for process in processes:
+                process[0].terminate()
+                process[0].wait()
+            self.reader.close()
+            raise
+        self.workers = [
+            ExecutorWorker(process, shard, durations, name='[%d]' % index)
+            for index, (process, shard) in enumerate(zip(processes, shards))
+        ]
+
+    def expected_durations(self, tests):
+        """Predict how long each test will take.
+
+        Uses the median duration from the test history if there is
+        one, otherwise the duration of the last run of the test.
+
+        Returns a dictionary of { path : seconds } for the tests that
+        have a prediction.
+        """
+        medians = self.history.median_durations() if self.history is not None else {}
+
+        durations = {}
+        for path in tests:
+            if path in medians:
+                durations[path] = medians[path]
+            else:
+                try:
+                    duration = self.test_suite.get_node_from_label(path).duration
+                except KeyError:
+                    duration = None
+                if duration is not None:
+                    durations[path] = duration
+        return durations
+
+    def split_tests(self, tests, workers, durations):
+        """Split the tests to execute into one shard per worker.
+
+        Tests are grouped by module (see TestSuite.shard_group), and
+        the groups are spread across the workers so that they all
+        finish at about the same time. A module that shares fixtures
+        between its tests is only split if it would take more than a
+        worker's share of the time; the others are split into small
+        pieces, so one big module doesn't hold up the run.
+        Tests with no expected duration are assumed to take the
+        average time of those that have one.
+
+        Returns a list of test path lists, and a list with the
+        planned run time (in seconds) of each shard.
+        """
+        if durations:
+            default = sum(durations.values()) / len(durations)
+        else:
+            default = 1.0
+
+        groups = {}
+        for path in tests:
+            groups.setdefault(self.test_suite.shard_group(path), []).append(path)
+
+        share = sum(durations.get(path, default) for path in tests) / workers
+        chunks = []
+        for paths in groups.values():
+            costs = [durations.get(path, default) for path in paths]
+            if workers == 1:
+                chunks.append((sum(costs), paths))
+            elif self.test_suite.shares_fixtures(paths[0]):
+                chunks.extend(split_group(paths, costs, share))
+            else:
+                chunks.extend(split_group(paths, costs, share / CHUNKS_PER_WORKER))
+
+        shards, loads = balance_shards(chunks, workers)
+        if not shards:
+            return [tests], [0.0]
+        return shards, loads
+
+    @property
+    def is_running(self):
+        "Return True if any of this runner's subprocesses are currently running."
+        return any(worker.is_running for worker in self.workers)
+
+    @property
+    def queue_depth(self):
+        "The number of lines from the workers waiting to be processed."
+        return sum(worker.queue_depth for worker in self.workers)
 
     @property
     def any_failed(self):
@@ -122,54 +644,140 @@ class Executor(EventSource):
 
     def terminate(self):
         "Stop the executor."
-        self.proc.terminate()
-
-    def _read_all_lines(self, q, name=""):
-        """Read all the lines in the queue and return as a list."""
-        lines = []
-        try:
-            while True:
-                line = q.get(block=False)
-                lines.append(line)
+        for worker in self.workers:
+            worker.terminate()
+        if self.server is None:
+            self.reader.close()
+
+        # Keep the results of the tests that did run.
+        if self.history is not None:
+            for worker in self.workers:
+                self._record_result(worker)
+            self.history.commit()
+
+    def _read_all_lines(self, stream, name="", limit=None):
+        """Take all the lines read from a stream (or the first `limit`) and return as a list."""
+        lines = stream.take(limit)
+        if is_debug():
+            for line in lines:
                 debug("%s%r", name, line)
-        except Empty:           # queue is empty
-            pass
-
         return lines
 
-    def poll(self):
-        """Poll the runner looking for new test output
+    def poll(self, limit=None):
+        """Poll the runners looking for new test output
+
+        Arguments:
+          limit  The most lines of output to process, shared between
+                 the workers.  Any more are left for the next poll.
 
         Returns:
           True if polling should continue
           False otherwise
         """
+        running = [worker for worker in self.workers if not worker.is_done]
+        if limit is not None and running:
+            limit = max(1, limit // len(running))
 
-        finished = False  # saw suite end marker
-        stopped = False   # process exited (which is bad if not finished)
+        self.reader.read()
+
+        self.lines_read = 0
+        for worker in running:
+            self._poll_worker(worker, limit)
+
+        # Report everything seen in this poll at once.
+        if self.batch:
+            batch, self.batch = self.batch, ProgressBatch()
+            self.emit('test_batch', batch=batch)
+
+        if not all(worker.is_done for worker in self.workers):
+            return True           # Still running - requeue polling event.
+
+        if self.server is None:  # The server's pipes stay open for the next run
+            self.reader.close()
+        if self.history is not None:
+            for worker in self.workers:
+                self._record_result(worker)
+            self.history.commit()
+
+        if all(worker.finished for worker in self.workers):  # saw every suite end
+            debug("Finished. %d in error buffer", len(self.error_buffer))
+            if self.error_buffer:
+                # YUCK:  This puts all stderr output into a popup
+                self.emit('suite_end', error='\n'.join(self.error_buffer))
+            else:
+                self.emit('suite_end')
+
+        else:  # a subprocess has stopped before we saw finished
+            debug("Process stopped. %d in error buffer", len(self.error_buffer))
+            if self.error_buffer:
+                # YUCK?:  This puts all stderr output into a popup ???
+                self.emit('suite_error', error='\n'.join(self.error_buffer))
+            else:
+                self.emit('suite_error', error='Test output ended unexpectedly')
 
+        return False
+
+    def _poll_worker(self, worker, limit=None):
+        """Process the output a single worker has produced so far (up to `limit` lines).
+
+        Output sent with framed results is kept in order with them.
+        Lines of stdout are processed after the frames read in the same
+        poll, so output written straight to stdout while a test runs is
+        attributed to the test running when it is read. Stdout is read
+        to the end before the end of the results is handled, so none of
+        it is lost.
+        """
         # Check to see if the subprocess is still running.
-        if self.proc is None:   # process never started (should never happen)
-            stopped = True
-            debug("Process never started")
-        elif self.proc.poll() is not None:  # process has exited
-            stopped = True
-            debug("Process exited with %d", self.proc.poll())
-            # there still might be output in the pipes
+        # Do this before reading, so no output is left behind.
+        worker.check_stopped()
 
         # grab all complete lines so far
-        self.error_buffer.extend(self._read_all_lines(self.stderr, name="Stderr: "))
-        for line in self._read_all_lines(self.stdout, name="Stdout: "):
-            # Start of suite or new test. Next line will be test start
-            if line in (PipedTestRunner.START_TEST_RESULTS, PipedTestResult.RESULT_SEPARATOR):
-                debug("Test (or suite) start")
-                self.current_test = None
+        self.error_buffer.extend(self._read_all_lines(worker.stderr, name="Stderr%s: " % worker.name))
+
+        if worker.results is not None:
+            frames = worker.results.take(limit)
+            if frames and not worker.framed:
+                debug("Process%s is sending framed results", worker.name)
+                worker.framed = True
+            self.lines_read += len(frames)
+            for index, (marker, post) in enumerate(frames):
+                if marker == OUTPUT:
+                    for line in post.rstrip('\n').split('\n'):
+                        self._handle_output(worker, line)
+                elif marker == END_TEST_RESULTS:
+                    if worker.server is None and not worker.stdout.closed and not worker.end_waited:
+                        # Output written before the end may still be on its way. Once the
+                        # process has exited, only wait one more poll (a process it
+                        # started could keep stdout open).
+                        worker.end_waited = worker.proc.poll() is not None
+                        worker.results.frames[:0] = frames[index:]
+                        break
+                    # Anything else on stdout came before the end.
+                    for line in self._read_all_lines(worker.stdout, name="Stdout%s: " % worker.name):
+                        self._handle_output(worker, line)
+                    self._handle_marker(worker, marker)
+                    return
+                elif marker is not None:
+                    self._handle_marker(worker, marker)
+                else:
+                    self._handle_record(worker, post)
+            if limit is not None:
+                limit = max(limit - len(frames), 0)
+
+        lines = self._read_all_lines(worker.stdout, name="Stdout%s: " % worker.name, limit=limit)
+        self.lines_read += len(lines)
+        for line in lines:
+            if worker.framed:
+                # Results have a pipe of their own; this can only be output.
+                self._handle_output(worker, line)
                 continue
 
-            elif line == PipedTestRunner.END_TEST_RESULTS: # End of test suite execution.
-                debug("Test suite finished")
-                finished = True
-                break
+            # Start of suite or new test. Next line will be test start
+            if line in self.SEPARATOR_LINES:
+                self._handle_marker(worker, line)
+                if worker.finished:
+                    break
+                continue
 
             if line.startswith('\x1b'):  # Some tools insert escape sequences, strip that
                 nn = line.find('{')
@@ -185,67 +793,76 @@ class Executor(EventSource):
                     debug("Wasn't really Json: %r", line)
                     pass
 
-                if post is not None:
-                    if ('start_time' in post) and ('path' in post):  # start of a test
-                        if self.current_test is not None:
-                            debug("test start didn't follow a test end")
-                        self.test_start = post  # save test start info for later
-                        self._handle_test_start(post)  # find test and set current_test
-                        continue
-
-                    elif ('end_time' in post) and ('status' in post):  # test end
-                        # sub test may have multiple results for one start (unittest)
-                        if self.current_test is None:
-                            debug("test result didn't follow a test start")
-
-                        else:
-                            status, error = parse_status_and_error(post)
-                            self._handle_test_end(status, error, self.test_start, post)
-                            # TODO: aggregate sub test status
-                            # we can't clear current_test if there are sub-tests
-                        continue
+                if post is not None and self._handle_record(worker, post):
+                    continue
             # if that wasn't json, or json that we recognized, fall through to output capture
 
-            if self.current_test is None: # A test isn't running - send to status update line
-                line = line.strip()
-                debug("Between test input: %r", line)
-                self.emit('test_status_update', update=line)
-                continue
+            self._handle_output(worker, line)
 
-            else:
-                was_empty = self.current_test.output == ""
-                self.current_test.add_output((line, ))
-                # prepend newline if adding to existing text
-                new_text = ("" if was_empty else '\n') + line
-                self.emit('test_output_update',
-                          test_path=self.current_test.path, new_text=new_text, was_empty=was_empty)
-                continue
+    def _handle_marker(self, worker, marker):
+        "Saw the start or end of the results, or the separator between tests."
+        # Whatever test was running has sent all its results.
+        self._record_result(worker)
 
-        if finished:            # saw suite end
-            debug("Finished. %d in error buffer", len(self.error_buffer))
-            if self.error_buffer:
-                # YUCK:  This puts all stderr output into a popup
-                self.emit('suite_end', error='\n'.join(self.error_buffer))
-            else:
-                self.emit('suite_end')
-            return False
+        if marker in (START_TEST_RESULTS, RESULT_SEPARATOR):
+            # Start of suite or new test. Next record will be test start
+            debug("Test (or suite) start")
+            worker.current_test = None
+
+        elif marker == END_TEST_RESULTS:  # End of test suite execution.
+            debug("Test suite%s finished", worker.name)
+            worker.finished = True
+
+    def _handle_record(self, worker, post):
+        """Saw a test start or result.
+
+        Returns False if the record wasn't recognized.
+        """
+        if ('start_time' in post) and ('path' in post):  # start of a test
+            if worker.current_test is not None:
+                debug("test start didn't follow a test end")
+            self._record_result(worker)
+            worker.test_start = post  # save test start info for later
+            self._handle_test_start(worker, post)  # find test and set current_test
+            return True
+
+        elif ('end_time' in post) and ('status' in post):  # test end
+            # sub test may have multiple results for one start (unittest)
+            if worker.current_test is None:
+                debug("test result didn't follow a test start")
 
-        elif stopped:  # subprocess has stopped before we saw finished
-            debug("Process stopped. %d in error buffer", len(self.error_buffer))
-            if self.error_buffer:
-                # YUCK?:  This puts all stderr output into a popup ???
-                self.emit('suite_error', error='\n'.join(self.error_buffer))
             else:
-                self.emit('suite_error', error='Test output ended unexpectedly')
-            return False
+                status, error = parse_status_and_error(post)
+                self._handle_test_end(worker, status, error, worker.test_start, post)
+                # TODO: aggregate sub test status
+                # we can't clear current_test if there are sub-tests
+            return True
 
-        return True           # Still running - requeue polling event.
+        return False
 
-    def _handle_test_start(self, pre):
+    def _handle_output(self, worker, line):
+        "Saw a line of output that isn't a result."
+        if worker.current_test is None: # A test isn't running - send to status update line
+            line = line.strip()
+            debug("Between test input: %r", line)
+            self.batch.status_update = line
+            self.emit('test_status_update', update=line)
+
+        else:
+            was_empty = worker.current_test.output_length == 0
+            worker.current_test.add_output((line, ))
+            # prepend newline if adding to existing text
+            new_text = ("" if was_empty else '\n') + line
+            self.batch.output.add(worker.current_test.path)
+            self.emit('test_output_update',
+                      test_path=worker.current_test.path, new_text=new_text, was_empty=was_empty)
+
+    def _handle_test_start(self, worker, pre):
         """Saw input with no current test.
 
         Arguments:
-          pre  Dictionary with parsed json output from plugin
+          worker  The ExecutorWorker that produced the input
+          pre     Dictionary with parsed json output from plugin
 
         Returns True if polling should continue
         """
@@ -260,34 +877,35 @@ class Executor(EventSource):
 
             if path is None:
                 debug("Could not find path: %r", pre)
-                self.current_test = None
+                worker.current_test = None
                 return True
 
             try:
-                self.current_test = self.test_suite.get_node_from_label(path)
+                worker.current_test = self.test_suite.get_node_from_label(path)
             except KeyError:
                 # pytest likes to return just the last bit, search for it
                 debug("Straight lookup of %r failed", path)
-                matches = self.test_suite.find_tests_substring(path)
+                matches = self.test_suite.find_tests_suffix(path)
                 if len(matches) == 1:
-                    self.current_test = self.test_suite.get_node_from_label(
+                    worker.current_test = self.test_suite.get_node_from_label(
                         matches[0])
                 else:
                     debug("Could not resolve path %r: %r", path, matches)
-                    self.current_test = None
+                    worker.current_test = None
                     return True
 
-            self.emit('test_start', test_path=self.current_test.path)
+            self.batch.test_start(worker.current_test)
+            self.emit('test_start', test_path=worker.current_test.path)
 
         except ValueError as e:
             debug("ValueError: %r", e)
-            self.current_test = None
+            worker.current_test = None
             self.emit('suite_end')
             return True
 
         return False
 
-    def _handle_test_end(self, status, error, pre, post):
+    def _handle_test_end(self, worker, status, error, pre, post):
         """Saw test end, update state."""
         # Increase the count of executed tests
         self.completed_count = self.completed_count + 1
@@ -296,7 +914,7 @@ class Executor(EventSource):
         start_time = float(pre['start_time'])
         end_time = float(post['end_time'])
 
-        self.current_test.set_result(
+        worker.current_test.set_result(
             description=post['description'],
             status=status,
             output=post.get('output'),
@@ -304,19 +922,52 @@ class Executor(EventSource):
             duration=end_time - start_time,
         )
 
-        # Work out how long the suite has left to run (approximately)
-        if self.start_time is None:
+        # A test with subtests sends a result for each of them; the
+        # history gets one result for the whole test once it is over.
+        path = worker.current_test.path
+        overall = status
+        if worker.result is not None and worker.result[0] == path:
+            overall = max(status, worker.result[1])
+        else:
+            self._record_result(worker)
+        worker.result = (path, overall, end_time - start_time, end_time)
+        worker.test_finished(path)
+
+        if self.start_time is None or start_time < self.start_time:
             self.start_time = start_time
-        total_duration = end_time - self.start_time
-        time_per_test = total_duration / self.completed_count
-        remaining_time = (self.total_count - self.completed_count) * time_per_test
-        remaining = format_time(remaining_time)
+        remaining = format_time(self.estimate_remaining(end_time))
 
         # Update test result counts
         self.result_count.setdefault(status, 0)
         self.result_count[status] = self.result_count[status] + 1
 
         # Notify the display to update.
-        self.current_test.emit('status_update', node=self.current_test)
-        self.emit('test_end', test_path=self.current_test.path,
+        self.batch.test_end(worker.current_test, remaining)
+        worker.current_test.emit('status_update', node=worker.current_test)
+        self.emit('test_end', test_path=worker.current_test.path,
                   result=status, remaining_time=remaining)
+
+    def _record_result(self, worker):
+        "Add the result of the last test a worker finished to the history."
+        if worker.result is not None and self.history is not None:
+            self.history.record(*worker.result)
+        worker.result = None
+
+    def estimate_remaining(self, now):
+        """Work out how long the suite has left to run (approximately).
+
+        Tests that have run before are expected to take their median
+        recorded duration (or the time they took last run). Any other
+        test is expected to take the average time of the tests that
+        have run so far.  Workers run in parallel, so the suite
+        finishes when the slowest one does.
+        """
+        # Wall clock time per test, scaled up to the time a test
+        # takes within a single worker.
+        total_duration = now - self.start_time
+        time_per_test = total_duration * len(self.workers) / self.completed_count
+
+        return max(
+            max(0.0, worker.expected_remaining) + worker.unknown_remaining * time_per_test
+            for worker in self.workers
+        )
@@ -0,0 +1,189 @@
+'''
+Run a test suite without a GUI.
+
+This uses the same discovery, selection and (parallel) execution as
+the GUI, and writes progress to stdout as it happens: either a compact
+line of result characters, or one JSON object per event (NDJSON).
+'''
+import json
+import sys
+import time
+
+from cricket.executor import Executor, format_time
+from cricket.model import TestMethod
+
+
+# The character shown for each result in progress mode
+STATUS_CHARS = {
+    TestMethod.STATUS_PASS: '.',
+    TestMethod.STATUS_SKIP: 's',
+    TestMethod.STATUS_EXPECTED_FAIL: 'x',
+    TestMethod.STATUS_UNEXPECTED_SUCCESS: 'u',
+    TestMethod.STATUS_FAIL: 'F',
+    TestMethod.STATUS_ERROR: 'E',
+}
+
+# The name of each result in NDJSON mode
+STATUS_NAMES = {
+    TestMethod.STATUS_PASS: 'pass',
+    TestMethod.STATUS_SKIP: 'skip',
+    TestMethod.STATUS_EXPECTED_FAIL: 'expected_fail',
+    TestMethod.STATUS_UNEXPECTED_SUCCESS: 'unexpected_success',
+    TestMethod.STATUS_FAIL: 'fail',
+    TestMethod.STATUS_ERROR: 'error',
+}
+
+
+class HeadlessRunner:
+    """Discovers and runs tests, reporting to a stream instead of a window.
+
+    `mode` is 'progress' for a human readable report, or 'ndjson' for
+    one JSON object per line.
+    """
+    # The longest wait for output from the tests, in seconds
+    POLL_TIMEOUT = 0.1
+    # Characters of progress on each line
+    LINE_WIDTH = 70
+
+    def __init__(self, test_suite, mode='progress', workers=1, stream=None):
+        self.test_suite = test_suite
+        self.mode = mode
+        self.workers = workers
+        self.stream = stream if stream is not None else sys.stdout
+
+        self.executor = None
+        self.error = None       # Error output from the test processes
+        self.failed = False     # Did the test processes stop unexpectedly?
+        self._column = 0        # Characters on the current line of progress
+
+        Executor.bind('test_start', self.on_testStart)
+        Executor.bind('test_end', self.on_testEnd)
+        Executor.bind('suite_end', self.on_suiteEnd)
+        Executor.bind('suite_error', self.on_suiteError)
+
+    def report(self, event, **data):
+        "Write an event, if reporting NDJSON"
+        if self.mode == 'ndjson':
+            data['event'] = event
+            self.stream.write(json.dumps(data) + '\n')
+            self.stream.flush()
+
+    def write(self, text):
+        "Write text, if reporting progress"
+        if self.mode == 'progress':
+            self.stream.write(text)
+            self.stream.flush()
+
+    def discover(self, discovery):
+        """Wait for a discovery to complete.
+
+        Returns False if nothing could be discovered.
+        """
+        start = time.perf_counter()
+        if discovery is not None:
+            discovery.wait()
+            if discovery.failed:
+                self.report('discovery_error', error='\n'.join(discovery.errors))
+                self.write('Discovery failed:\n%s\n' % '\n'.join(discovery.errors))
+                return False
+
+        count, tests = self.test_suite.find_tests(active=False, allow_all=True)
+        self.report('discovered', count=count, duration=time.perf_counter() - start)
+        self.write('Discovered %d tests\n' % count)
+        if self.test_suite.errors:
+            self.report('discovery_error', error='\n'.join(self.test_suite.errors))
+            self.write('Discovery errors:\n%s\n' % '\n'.join(self.test_suite.errors))
+        return True
+
+    def run(self, labels=None):
+        """Run the tests (or just those in labels), and wait for them to finish.
+
+        Returns an exit status: 0 if every test passed, 1 if any
+        failed, and 2 if the test processes stopped unexpectedly.
+        """
+        # Like the GUI: labels are None to run every test, or collapsed to modules and classes.
+        count, labels = self.test_suite.find_tests(labels=labels)
+        try:
+            self.executor = Executor(self.test_suite, count, labels, workers=self.workers)
+        except OSError as e:
+            # e.g., the command line was too long for the OS.
+            self.on_suiteError(None, 'Unable to start the tests: %s' % e)
+            return 2
+        planned = self.executor.planned_durations
+        self.report('suite_start', count=count, workers=len(self.executor.workers),
+                    planned=planned)
+        self.write('Running %d tests on %d workers\n' % (count, len(self.executor.workers)))
+
+        start = time.perf_counter()
+        try:
+            # Wait for output, instead of polling on a timer.
+            while self.executor.poll():
+                self.executor.reader.read(timeout=self.POLL_TIMEOUT)
+        finally:
+            self.executor.terminate()
+        self._summarize(time.perf_counter() - start)
+
+        if self.failed:
+            return 2
+        return 1 if self.executor.any_failed else 0
+
+    def _summarize(self, duration):
+        result_count = self.executor.result_count
+        self.report(
+            'summary',
+            duration=duration,
+            results={STATUS_NAMES.get(status, str(status)): count for status, count in result_count.items()},
+        )
+        if self._column:
+            self.write('\n')
+
+        # Show what went wrong, then the totals.
+        count, failing = self.test_suite.find_tests(
+            active=False, status=set(TestMethod.FAILING_STATES), allow_all=True)
+        for path in failing:
+            test = self.test_suite.get_node_from_label(path)
+            self.write('\n%s: %s\n' % (STATUS_NAMES[test.status].upper(), path))
+            if test.error:
+                self.write('%s\n' % test.error)
+        if self.error:
+            self.write('\n%s\n' % self.error)
+
+        message = ', '.join(
+            '%d %s' % (count, TestMethod.STATUS_LABELS[state])
+            for state, count in sorted(result_count.items()))
+        self.write('\n%s in %s\n' % (message or 'No tests were run', format_time(duration)))
+
+    def on_testStart(self, event, test_path):
+        "The executor has started running a test.  Handles test_start"
+        self.report('test_start', path=test_path)
+
+    def on_testEnd(self, event, test_path, result, remaining_time):
+        "The executor has finished running a test.  Handles test_end"
+        test = self.test_suite.get_node_from_label(test_path)
+        self.report(
+            'test_end',
+            path=test_path,
+            status=STATUS_NAMES.get(result),
+            duration=test.duration,
+            error=test.error or None,
+            remaining=remaining_time,
+        )
+        char = STATUS_CHARS.get(result)
+        if char is not None:
+            self.write(char)
+            self._column += 1
+            if self._column >= self.LINE_WIDTH:
+                self.write(' %d/%d, ~%s remaining\n' % (
+                    self.executor.completed_count, self.executor.total_count, remaining_time))
+                self._column = 0
+
+    def on_suiteEnd(self, event, error=None):
+        "The test suite finished running.  Handles suite_end"
+        self.error = error
+        self.report('suite_end', error=error)
+
+    def on_suiteError(self, event, error):
+        "An error occurred running the test suite.  Handles suite_error"
+        self.error = error
+        self.failed = True
+        self.report('suite_error', error=error)
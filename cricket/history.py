@@ -0,0 +1,106 @@
+"""A persistent record of past test results.
+
+Every completed test records its status, duration and the time it ran
+in a small SQLite database. The history is used to predict how long
+tests will take to run.
+"""
+import os
+import sqlite3
+import statistics
+import time
+
+from cricket.events import debug
+
+
+# The history lives with the test project (the current directory)
+HISTORY_PATH = os.path.join('.cricket', 'history.sqlite3')
+
+
+class TestHistory:
+    """Durations and results of previous test runs, keyed by test path."""
+    # How many results are kept for each test
+    KEEP_RESULTS = 10
+
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+        if path != ':memory:':
+            dirname = os.path.dirname(path)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+
+        debug("Opening test history %r", path)
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            ' path TEXT NOT NULL,'
+            ' status INTEGER,'
+            ' duration REAL NOT NULL,'
+            ' timestamp REAL NOT NULL)'
+        )
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS results_path ON results (path, timestamp)'
+        )
+        self._db.commit()
+
+        self._medians = None  # Cache of {path : median duration}
+
+    def record(self, path, status, duration, timestamp=None):
+        """Record the result of a single test.
+
+        Results aren't visible to readers until commit() is called.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        self._db.execute(
+            'INSERT INTO results (path, status, duration, timestamp) VALUES (?, ?, ?, ?)',
+            (path, status, duration, timestamp)
+        )
+
+    def commit(self):
+        "Save recorded results, discarding all but the most recent few for each test."
+        self._db.execute(
+            'DELETE FROM results WHERE rowid IN ('
+            ' SELECT rowid FROM ('
+            '  SELECT rowid, ROW_NUMBER() OVER ('
+            '   PARTITION BY path ORDER BY timestamp DESC) AS age'
+            '  FROM results)'
+            ' WHERE age > ?)',
+            (self.KEEP_RESULTS, )
+        )
+        self._db.commit()
+        self._medians = None
+
+    def median_durations(self):
+        """Return the median recorded duration of every test.
+
+        Returns a dictionary of {path : seconds}
+        """
+        if self._medians is None:
+            durations = {}
+            for path, duration in self._db.execute('SELECT path, duration FROM results'):
+                durations.setdefault(path, []).append(duration)
+            self._medians = {
+                path: statistics.median(values)
+                for path, values in durations.items()
+            }
+        return self._medians
+
+    def median_duration(self, path):
+        "Return the median duration of a test, or None if it has never run."
+        return self.median_durations().get(path)
+
+    def results(self, path):
+        """Return the recorded results for a test, most recent first.
+
+        Returns a list of (status, duration, timestamp)
+        """
+        return list(self._db.execute(
+            'SELECT status, duration, timestamp FROM results'
+            ' WHERE path = ? ORDER BY timestamp DESC',
+            (path, )
+        ))
+
+    def close(self):
+        "Save any recorded results, and close the database."
+        self.commit()
+        self._db.close()
@@ -2,24 +2,50 @@
 The purpose of this module is to set up the Cricket GUI,
 load a "project" for discovering and executing tests, and
 to initiate the GUI main loop.
+
+The GUI (and everything else that is only needed by some of the
+options) is imported when it is needed, so --version and --headless
+never load tkinter.
 '''
+import time
+
+_IMPORT_START = time.perf_counter()
+
 from argparse import ArgumentParser
 import os
-import subprocess
 import sys
-from cricket.events import debug, set_debug, is_debug
+from cricket.events import debug, set_debug, set_debug_stream
+
+from cricket.executor import TestServer, parse_workers
+from cricket.cache import DiscoveryCache
+from cricket.output import OutputStore
+
+
+class StartupProfile:
+    """Times the phases of starting up, for --profile-startup.
 
-try:
-    from Tkinter import *
-except ImportError:
-    from tkinter import *
+    Each call to mark() ends a phase, which started when the previous
+    one ended. The first phase starts when this module was imported.
+    """
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.phases = []        # [(name, seconds)]
+        self._last = _IMPORT_START
+
+    def mark(self, name):
+        "End a phase of startup."
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
 
-from cricket.view import (
-    MainWindow,
-    TestLoadErrorDialog,
-    IgnorableTestLoadErrorDialog
-)
-from cricket.model import ModelLoadError
+    def report(self):
+        "Print the time taken by each phase to stderr."
+        if not self.enabled:
+            return
+        for name, duration in self.phases:
+            print('%-12s %7.1f ms' % (name, duration * 1000), file=sys.stderr)
+        total = sum(duration for name, duration in self.phases)
+        print('%-12s %7.1f ms' % ('total', total * 1000), file=sys.stderr)
 
 
 def main(Model):
@@ -36,11 +62,32 @@ def main(Model):
                         help="Turn on debug prints (to console).  Also pass python '-u'")
     parser.add_argument("--save",
                         help="Set path to save test output.  <TESTNAME> and <DATETIME> are replaced")
+    parser.add_argument("--workers", type=parse_workers, default=1,
+                        help="Number of test processes to run in parallel, or 'auto' for one per CPU")
+    parser.add_argument("--no-history", action="store_true",
+                        help="Don't record test durations in .cricket/ to estimate run times")
+    parser.add_argument("--rediscover", action="store_true",
+                        help="Ignore the discovery cache in .cricket/ and collect every test again")
+    parser.add_argument("--output-memory", type=int, default=256, metavar="MB",
+                        help="Memory for test output before it is moved to a temporary file.  Default 256")
+    parser.add_argument("--no-warm-worker", action="store_true",
+                        help="Start a new test process for every run, instead of keeping one running")
+    parser.add_argument("--headless", nargs="?", const="progress", choices=["progress", "ndjson"],
+                        help="Run the tests without a GUI, reporting progress (or NDJSON events) to stdout")
+    parser.add_argument("--label", "-l", action="append", dest="labels", metavar="LABEL",
+                        help="With --headless, run only the tests matching LABEL.  May be repeated")
     parser.add_argument("testdir", action="store", default="", nargs='?',
                         help="Test root directory.  Default is current directory")
 
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Report the time taken by each phase of starting up, to stderr")
+
+    profile = StartupProfile(enabled=False)
+    profile.mark('imports')
+
     Model.add_arguments(parser)
     options = parser.parse_args()
+    profile.enabled = options.profile_startup
 
     # Check the shortcut options
     if options.version:
@@ -50,46 +97,61 @@ def main(Model):
 
     if options.debug:
         set_debug(True)
+        if options.headless:
+            # stdout is the report; keep debug output out of it.
+            set_debug_stream(sys.stderr)
 
     if options.testdir:
         os.chdir(options.testdir)
 
+    Model.setup_environment(options)
+    profile.mark('arguments')
+
+    if options.headless:
+        return run_headless(Model, options, profile)
+
+    try:
+        from Tkinter import Tk
+    except ImportError:
+        from tkinter import Tk
+    from cricket.view import MainWindow
+    profile.mark('GUI imports')
+
     # Set up the root Tk context
     debug("Starting GUI init")
     root = Tk()
 
     # Construct an empty window
     view = MainWindow(root, options=options)
+    profile.mark('window')
 
-    # Try to load the test_suite. If any error occurs during
-    # test_suite load, show an error dialog
-    test_suite = None
-    while test_suite is None:
-        try:
-            debug("Discovering initial test_suite")
-            test_suite = Model(options)
-            test_suite.refresh()
-        except ModelLoadError as e:
-            # Load failed; destroy the test_suite and show an error dialog.
-            # If the user selects cancel, quit.
-            debug("Test_Suite initial failed.  Find error dialog and click on quit")
-            test_suite = None
-            dialog = TestLoadErrorDialog(root, e.trace)
-            if dialog.status == dialog.CANCEL:
-                sys.exit(1)
-    if test_suite.errors:
-        dialog = IgnorableTestLoadErrorDialog(root, '\n'.join(test_suite.errors))
-        if dialog.status == dialog.CANCEL:
-            sys.exit(1)
+    # Load the test_suite. Tests known to the discovery cache are
+    # available straight away; anything else is discovered in the
+    # background once the GUI is running.
+    debug("Discovering initial test_suite")
+    test_suite = load_test_suite(Model, options)
+    if not options.no_warm_worker:
+        # Keep a test process running between runs, if the test system can.
+        cmd = test_suite.serve_commandline()
+        if cmd is not None:
+            test_suite.test_server = TestServer(
+                cmd, ('*.py', ) + test_suite.CONFIG_FILE_PATTERNS)
+    discovery = test_suite.start_refresh(rediscover=options.rediscover)
+    profile.mark('discovery')
 
     # Set the test_suite for the main window.
     # This populates the tree, and sets listeners for
     # future tree modifications.
     view.test_suite = test_suite
-    if is_debug():
-        count, labels = test_suite.find_tests(allow_all=True)
-        debug("Found %d tests:", count)
-        debug("%s", '\n'.join(labels))
+    view.discover(discovery)
+    profile.mark('tree')
+
+    if profile.enabled:
+        # Idle callbacks run in order, so this runs after the first redraw.
+        def first_paint():
+            profile.mark('first paint')
+            profile.report()
+        root.after_idle(first_paint)
 
     # Run the main loop
     try:
@@ -97,3 +159,51 @@ def main(Model):
         view.mainloop()
     except KeyboardInterrupt:
         view.on_quit()
+    finally:
+        if test_suite.test_server is not None:
+            test_suite.test_server.stop()
+        test_suite.output_store.close()
+
+
+def load_test_suite(Model, options):
+    "Create the test suite, with the history, cache and output storage the options ask for."
+    test_suite = Model(options)
+    test_suite.discovery_cache = DiscoveryCache(Model.__name__)
+    if not options.no_history:
+        from cricket.history import TestHistory
+        test_suite.history = TestHistory()
+    test_suite.output_store = OutputStore(memory_limit=options.output_memory * 1024 * 1024)
+    return test_suite
+
+
+def run_headless(Model, options, profile):
+    """Discover and run the tests without a GUI.
+
+    Exits with 0 if all the tests passed, 1 if any failed, and 2 if the
+    tests couldn't be discovered or run.
+    """
+    from cricket.headless import HeadlessRunner
+
+    test_suite = load_test_suite(Model, options)
+    runner = HeadlessRunner(test_suite, mode=options.headless, workers=options.workers)
+    try:
+        discovered = runner.discover(test_suite.start_refresh(rediscover=options.rediscover))
+        profile.mark('discovery')
+        profile.report()
+        if not discovered:
+            sys.exit(2)
+        labels = None
+        if options.labels:
+            # Accept partial test ids, as pytest reports them.
+            labels = []
+            for label in options.labels:
+                try:
+                    labels.append(test_suite.get_node_from_label(label).path)
+                except KeyError:
+                    labels.extend(test_suite.find_tests_suffix(label))
+            if not labels:
+                print("No tests match %s" % ', '.join(options.labels), file=sys.stderr)
+                sys.exit(2)
+        sys.exit(runner.run(labels))
+    finally:
+        test_suite.output_store.close()
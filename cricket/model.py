@@ -5,11 +5,24 @@ This is the "Model" of the MVC world.
 Each object in the model is an event source; views/controllers
 can bind to events on the model to be notified of changes.
 """
+import bisect
+import gc
+import os
+import re
 import subprocess
 import sys
 from datetime import datetime
+from operator import itemgetter
+from threading import Thread
 
-from cricket.events import EventSource, debug
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty  # python 3.x
+
+from cricket.cache import file_stamp, find_files
+from cricket.events import EventSource, debug, enqueue_output
+from cricket.output import OutputBuffer
 
 
 class ModelLoadError(Exception):
@@ -24,11 +37,17 @@ class TestNode:
         self._child_labels = []
         self._child_nodes = {}  # {label : node }
 
-        self._source = source   # AKA parent
+        self._source = source   # The test suite
+        self._parent = None     # Set when the node is added to the tree
 
         self._path = path
         self._name = name
         self._active = True
+
+        # Aggregates over the test methods below this node
+        self._test_count = 0
+        self._active_count = 0
+        self._status_counts = {}  # { status : count }
         debug("%r (source=%r, path=%r, name=%r)", self, source, path, name)
 
     ######################################################################
@@ -52,11 +71,10 @@ class TestNode:
     ######################################################################
 
     def __setitem__(self, label, child):
-        # Insert the item, sort the list,
-        # and find out where the item was inserted.
-        self._child_labels.append(label)
-        self._child_labels.sort()
-        index = self._child_labels.index(label)
+        # Keep the labels sorted; bisect finds the insertion point
+        # without re-sorting, and appending in order is cheap.
+        if label not in self._child_nodes:
+            bisect.insort(self._child_labels, label)
 
         self._child_nodes[label] = child
 
@@ -64,8 +82,9 @@ class TestNode:
 
     def __delitem__(self, label):
         # Find the label in the list of children, and remove it.
-        index = self._child_labels.index(label)
-        self._child_nodes[label] = child
+        index = bisect.bisect_left(self._child_labels, label)
+        if index == len(self._child_labels) or self._child_labels[index] != label:
+            raise KeyError(label)
 
         #self._source._notify('remove', item=child)
         del self._child_labels[index]
@@ -83,28 +102,79 @@ class TestNode:
 
     @property
     def active(self):
-        "Is this test method currently active?"
+        "Is any test below this node currently active?"
         return self._active
 
-    def set_active(self, value):
-        """Set active state
-        Sub-classes will usually override this."""
-        self._active = value
+    @property
+    def test_count(self):
+        "The number of test methods below this node"
+        return self._test_count
+
+    @property
+    def active_count(self):
+        "The number of active test methods below this node"
+        return self._active_count
+
+    def status_count(self, statuses):
+        "The number of test methods below this node whose last status is in `statuses`"
+        return sum(self._status_counts.get(status, 0) for status in statuses)
+
+    def set_active(self, is_active, cascade=True):
+        """Explicitly set the active state of every test below this node.
+
+        If cascade is True, this node is the top of the change: the
+        counts held by its parents are updated to match, and it emits
+        a single 'active' or 'inactive' event covering the whole subtree.
+
+        Returns True if anything changed.
+        """
+        target = self._test_count if is_active else 0
+        if self._active == is_active and self._active_count == target:
+            return False
+
+        for child in self._child_nodes.values():
+            child.set_active(is_active, cascade=False)
+
+        change = target - self._active_count
+        self._active_count = target
+        self._active = is_active
+        if cascade:
+            if self._parent is not None:
+                self._parent._add_counts(active=change)
+            self.emit('active' if is_active else 'inactive')
+        return True
 
     def toggle_active(self):
         "Toggle the current active status of this test case"
         self.set_active(not self.active)
 
     def _update_active(self):
-        "Check the active status of all child nodes, and update the status of this node accordingly"
-        for testMethod_name, testMethod in self._child_nodes.items():
-            if testMethod.active:
-                # As soon as we find an active child, this node
-                # must be marked active, and no other checks are
-                # required.
-                self.set_active(True)
-                return
-        self.set_active(False)
+        "Update the active status of this node from the count of active tests below it"
+        if self._test_count:
+            self._active = self._active_count > 0
+
+    def _add_counts(self, tests=0, active=0, statuses=None):
+        """Adjust the aggregate counts of this node and all of its parents.
+
+        Arguments:
+          tests     Change in the number of test methods
+          active    Change in the number of active test methods
+          statuses  Change in the number of methods with each status,
+                    as { status : change }
+        """
+        node = self
+        while node is not None:
+            node._test_count += tests
+            node._active_count += active
+            if statuses:
+                for status, change in statuses.items():
+                    node._status_counts[status] = node._status_counts.get(status, 0) + change
+            node._update_active()
+            node = node._parent
+
+    def _counts(self):
+        "Return the (tests, active, statuses) aggregated at this node."
+        return self._test_count, self._active_count, dict(self._status_counts)
 
     def find_tests(self, active=True, status=None, labels=None, allow_all=False):
         """Find the test labels matching the search criteria.
@@ -134,6 +204,17 @@ class TestNode:
                 subcount = 0
                 subtests = []
                 found_partial = True
+            elif status is not None and not child_node.status_count(status):
+                # Nothing below this child has a requested status,
+                # so there's no need to look any further.
+                subcount = 0
+                subtests = []
+                found_partial = True
+            elif (not labels and status is None and not allow_all
+                    and (not active or child_node.active_count == child_node.test_count)):
+                # Every test below this child is selected.
+                subcount = child_node.test_count
+                subtests = [child_node.path]
             elif status is not None:
                 # Search children of this child for the provided labels.
                 subcount, subtests = child_node.find_tests(
@@ -277,6 +358,7 @@ class TestMethod(EventSource):
 
     def __init__(self, source, path, name):
         self._source = source
+        self._parent = None     # Set when the node is added to the tree
 
         self._path = path
         self._name = name
@@ -285,8 +367,10 @@ class TestMethod(EventSource):
         # Test status
         self._description = ''             # test description (string)
         self._status = self.STATUS_UNKNOWN  # test status (see STATUS_* codes above)
-        self._output = ''       # captured output text (string)
-        self._error = ''        # captured stderr text (string)
+        # Large outputs are spilled to the test suite's output store, if it has one.
+        store = getattr(source, 'output_store', None)
+        self._output = OutputBuffer(store=store)  # captured output text
+        self._error = OutputBuffer(store=store)   # captured stderr text
         self._duration = None   # run time in seconds
         #debug("%r (source=%r, path=%r, name=%r)", self, source, path, name)
 
@@ -327,20 +411,35 @@ class TestMethod(EventSource):
 
     @property
     def output(self):
-        return self._output
+        return self._output.getvalue()
+
+    @property
+    def output_length(self):
+        "The length of the captured output, without joining it together"
+        return len(self._output)
+
+    def output_tail(self, size):
+        "Return the last `size` characters of the captured output."
+        return self._output.tail(size)
+
+    def read_output(self, start=0, end=None):
+        "Return the captured output between two character offsets."
+        return self._output.read(start, end)
+
+    def find_output(self, text, start=0):
+        "Return the offset of `text` in the captured output at or after `start`, or -1."
+        return self._output.find(text, start)
 
     def add_output(self, new_lines):
         """Add lines of output.
 
         Adds to the output field and tracks new lines for the GUI
         """
-        if self._output:
-            self._output += '\n'
-        self._output += '\n'.join(new_lines)
+        self._output.add_lines(new_lines)
 
     @property
     def error(self):
-        return self._error
+        return self._error.getvalue()
 
     @property
     def duration(self):
@@ -351,32 +450,64 @@ class TestMethod(EventSource):
         "Is this test method currently active?"
         return self._active
 
+    @property
+    def test_count(self):
+        return 1
+
+    @property
+    def active_count(self):
+        return 1 if self._active else 0
+
+    def status_count(self, statuses):
+        return 1 if self._status in statuses else 0
+
+    def _counts(self):
+        "Return the (tests, active, statuses) aggregated at this node."
+        statuses = {} if self._status is None else {self._status: 1}
+        return 1, self.active_count, statuses
+
     def set_result(self, description, status, output, error, duration):
+        if status != self._status and self._parent is not None:
+            changes = {}
+            if self._status is not None:
+                changes[self._status] = -1
+            if status is not None:
+                changes[status] = 1
+            self._parent._add_counts(statuses=changes)
+
         self._description = description
         self._status = status
         self.add_output(output.splitlines())
-        self._error = error
+        self._error.clear()
+        self._error.append(error)
         self._duration = duration
 
+        # Passing tests are the least interesting; their output goes to disk first.
+        evict_first = status not in self.FAILING_STATES
+        self._output.evict_first = evict_first
+        self._error.evict_first = evict_first
+
         #self._source._notify('change', item=self)
 
     def set_active(self, is_active, cascade=True):
         """Explicitly set the active state of the test method
 
-        If cascade is True, the parent testCase will be prompted
-        to check it's current active status.
+        If cascade is True, the counts of active tests held by the
+        parents of this method are updated, and an 'active' or
+        'inactive' event is emitted.
+
+        Returns True if the active state changed.
         """
         debug("%r set_active", self)
-        if self._active:
-            if not is_active:
-                self._active = False
-                if cascade:
-                    self._source._update_active()
-        else:
-            if is_active:
-                self._active = True
-                if cascade:
-                    self._source._update_active()
+        if self._active == is_active:
+            return False
+
+        self._active = is_active
+        if cascade:
+            if self._parent is not None:
+                self._parent._add_counts(active=1 if is_active else -1)
+            self.emit('active' if is_active else 'inactive')
+        return True
 
     def toggle_active(self):
         "Toggle the current active status of this test method"
@@ -417,26 +548,12 @@ class TestCase(TestNode, EventSource):
         Forces all methods on this test case to set to the same
         active status.
 
-        If cascade is True, the parent test module will be prompted
-        to check it's current active status.
+        If cascade is True, the counts of active tests held by the
+        parents of this test case are updated, and one event is
+        emitted for the test case and all of its methods.
         """
         debug("%r set_active", self)
-        if self._active:
-            if not is_active:
-                self._active = False
-                self.emit('inactive')
-                if cascade:
-                    self._source._update_active()
-                for testMethod in self._child_nodes.values():
-                    testMethod.set_active(False, cascade=False)
-        else:
-            if is_active:
-                self._active = True
-                self.emit('active')
-                if cascade:
-                    self._source._update_active()
-                for testMethod in self._child_nodes.values():
-                    testMethod.set_active(True, cascade=False)
+        return TestNode.set_active(self, is_active, cascade)
 
 
 class TestModule(TestNode, EventSource):
@@ -458,26 +575,12 @@ class TestModule(TestNode, EventSource):
         Forces all test cases and test modules held by this test module
         to be set to the same active status
 
-        If cascade is True, the parent test module will be prompted
-        to check it's current active status.
+        If cascade is True, the counts of active tests held by the
+        parents of this test module are updated, and one event is
+        emitted for everything in the module.
         """
         debug("%r set_active", self)
-        if self._active:
-            if not is_active:
-                self._active = False
-                # self.emit('inactive')
-                if cascade:
-                    self._source._update_active()
-                for testModule in self._child_nodes.values():
-                    testModule.set_active(False, cascade=False)
-        else:
-            if is_active:
-                self._active = True
-                # self.emit('active')
-                if cascade:
-                    self._source._update_active()
-                for testModule in self._child_nodes.values():
-                    testModule.set_active(True, cascade=False)
+        return TestNode.set_active(self, is_active, cascade)
 
     def toggle_active(self):
         "Toggle the current active status of this test case"
@@ -495,15 +598,148 @@ class TestModule(TestNode, EventSource):
                 self.pop(testModule_name)
 
 
+class SuffixIndex:
+    """The paths of test methods, indexed by their trailing labels.
+
+    Test runners sometimes report a test by a shorter id than the one
+    it was discovered with (e.g., pytest nodeids relative to a different
+    rootdir). The index is a trie of labels, last label first, so the
+    tests whose ids end with a given run of labels can be found in time
+    proportional to the length of that run.
+
+    A branch that leads to a single test isn't expanded until a second
+    test needs it; the node just holds the remaining labels.
+    """
+    class Node:
+        __slots__ = ('count', 'path', 'rest', 'children')
+
+        def __init__(self, path=None, rest=None):
+            self.count = 0      # Number of paths at or below this node
+            self.path = path    # Path of the test ending here, if any
+            self.rest = rest    # Remaining labels of an unexpanded branch
+            self.children = {}  # { preceding label : Node }
+
+        def expand(self):
+            "Turn an unexpanded branch into a regular node."
+            rest, path = self.rest, self.path
+            self.rest = self.path = None
+            if rest:
+                child = self.children[rest[0]] = SuffixIndex.Node(path, rest[1:])
+                child.count = 1
+            else:
+                self.path = path
+
+    def __init__(self):
+        self._root = self.Node()
+
+    def __len__(self):
+        return self._root.count
+
+    def add(self, parts, path):
+        "Add a test, given the parts from split_test_id() and its path."
+        labels = [label for NodeClass, label in reversed(parts)]
+        node = self._root
+        node.count += 1
+        for i, label in enumerate(labels):
+            if node.rest is not None:
+                node.expand()
+            child = node.children.get(label)
+            if child is None:
+                child = node.children[label] = self.Node(path, tuple(labels[i + 1:]))
+                child.count = 1
+                return
+            node = child
+            node.count += 1
+
+        if node.rest is not None:
+            node.expand()
+        node.path = path
+
+    def remove(self, parts, path):
+        "Remove a test that was added with add()."
+        labels = [label for NodeClass, label in reversed(parts)]
+        trail = []      # (parent, label, node) along the way
+        node = self._root
+        for i, label in enumerate(labels):
+            if node.rest is not None:
+                if node.rest != tuple(labels[i:]):
+                    return
+                break
+            child = node.children.get(label)
+            if child is None:
+                return
+            trail.append((node, label, child))
+            node = child
+        if node.path != path:
+            return
+
+        node.path = node.rest = None
+        self._root.count -= 1
+        for parent, label, node in trail:
+            node.count -= 1
+        # Prune the branch that no longer leads to any test.
+        for parent, label, node in trail:
+            if node.count == 0:
+                del parent.children[label]
+                break
+
+    def find(self, parts):
+        """Find the tests whose ids end with the given parts.
+
+        Returns a sorted list of matching paths.
+        """
+        labels = [label for NodeClass, label in reversed(parts)]
+        node = self._root
+        for i, label in enumerate(labels):
+            if node.rest is not None:
+                # Only one test down here; does it end the right way?
+                if node.rest[:len(labels) - i] == tuple(labels[i:]):
+                    return [node.path]
+                return []
+            node = node.children.get(label)
+            if node is None:
+                return []
+
+        paths = []
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            if node.path is not None:
+                paths.append(node.path)
+            pending.extend(node.children.values())
+        return sorted(paths)
+
+
 class TestSuite(TestNode, EventSource):
     """A data representation of a test suite, containing 1+ test cases.
     This is the top of the tree
     """
+    # Files that may contain tests.
+    TEST_FILE_PATTERNS = ('test*.py', )
+
+    # Files that can change the tests found in every other file.
+    CONFIG_FILE_PATTERNS = ()
+
+    # Source that sets up fixtures shared by the tests of a module (or class).
+    SHARED_FIXTURES_RE = re.compile(r'\b(setUpModule|setUpClass)\b')
+
+    # Can shards run in separate test processes at the same time?  Not
+    # if they would share state (like a test database) that only a
+    # process from pool_commandline() knows how to divide up.
+    SEPARATE_WORKERS = True
+
     def __init__(self):
         debug("TestSuite()")
         TestNode.__init__(self, None, None, None)
         self.errors = []
         self.coverage = False
+        self.history = None     # TestHistory of previous runs, if any
+        self.discovery_cache = None  # DiscoveryCache of previous discovery, if any
+        self.output_store = None  # OutputStore for large test output, if any
+        self.test_server = None   # TestServer that keeps a test process warm, if any
+        self._nodes = {}        # { path : node } for every node in the tree
+        self._suffixes = None   # SuffixIndex of test methods, built on first use
+        self._fixture_files = {}  # { path : (stamp, shares fixtures) } of the files looked at
 
     def __repr__(self):
         return '<TestSuite>'
@@ -514,42 +750,238 @@ class TestSuite(TestNode, EventSource):
         """
         pass
 
-    def refresh(self, test_list=None, errors=None):
-        """Rediscover the tests in the test suite.
+    @classmethod
+    def setup_environment(cls, options):
+        """Prepare the environment the test subprocesses will run in.
+
+        Called once the command line has been parsed (so not for --version).
         """
-        if test_list is None:
-            debug("Running %s to discover tests", self.discover_commandline())
-            runner = subprocess.Popen(
-                self.discover_commandline(),
-                stdin=None,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                shell=False,
-            )
+        pass
 
-            test_list = []
-            for line in runner.stdout:
-                line = line.strip().decode('utf-8')
-                #debug("Got line %r", line)
-                test_list.append(line)
+    def serve_commandline(self):
+        """Return the command line of a test process that is kept running.
 
-            errors = []
-            for line in runner.stderr:
-                line = line.strip().decode('utf-8')
-                debug("Got error %r", line)
-                errors.append(line)
+        The process reads the labels of the tests to run from stdin,
+        one per line, with a blank line after each run (no labels
+        runs every test). It reports each run's results like
+        execute_commandline() does, and exits at the end of stdin.
+
+        Returns None if the test system can't run tests this way.
+        """
+        return None
 
-            if errors and not test_list:
-                raise ModelLoadError('\n'.join(errors))
+    def pool_commandline(self, shards):
+        """Return the command line of a test process that forks a worker for each shard.
+
+        The process imports the tests once, then runs each shard of
+        test labels in a worker of its own, writing to the pipes given
+        in POOL_FDS_ENV (see cricket.executor.start_pool).
+
+        Returns None if the test system can't run tests this way.
+        """
+        return None
+
+    def shard_group(self, test_id):
+        """Return the name of the group of tests that `test_id` should run with.
+
+        Tests that share module level fixtures (setUpModule, module
+        scoped pytest fixtures) are best run in the same process, so
+        tests are grouped by the module that contains them. Groups
+        are still split when that balances the workers better (see
+        shares_fixtures and Executor.split_tests).
+        """
+        modules = [
+            part
+            for NodeClass, part in self.split_test_id(test_id)
+            if NodeClass == TestModule
+        ]
+        return self.join_path(modules, None)
+
+    def shares_fixtures(self, test_id):
+        """Return True if the tests in the module of `test_id` share fixtures.
+
+        The tests of a module without shared fixtures can be spread
+        across workers, rather than all run by one (see shard_group).
+        """
+        return self._file_shares_fixtures(self.test_file(test_id))
+
+    def _file_shares_fixtures(self, path):
+        """Return True if the source file at `path` sets up shared fixtures.
+
+        A file that can't be read is assumed to.
+        """
+        stamp = file_stamp(path)
+        cached = self._fixture_files.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        try:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                shares = self.SHARED_FIXTURES_RE.search(f.read()) is not None
+        except OSError:
+            shares = True
+        self._fixture_files[path] = (stamp, shares)
+        return shares
+
+    def test_file(self, test_id):
+        """Return the path of the source file that defines a test.
+
+        By default, test ids are dotted module paths.
+        """
+        modules = [
+            part
+            for NodeClass, part in self.split_test_id(test_id)
+            if NodeClass == TestModule
+        ]
+        path = os.path.join(*modules)
+        if os.path.isdir(path):
+            return os.path.join(path, '__init__.py')
+        return path + '.py'
+
+    def file_label(self, path):
+        """Return the label that selects all the tests in a source file.
+
+        This is the inverse of test_file().
+        """
+        path = os.path.normpath(path)
+        if os.path.basename(path) == '__init__.py':
+            path = os.path.dirname(path)
+        elif path.endswith('.py'):
+            path = path[:-3]
+        return '.'.join(path.split(os.sep))
+
+    def discover(self, labels=None, on_finish=None):
+        """Start a discovery subprocess.
+
+        If labels are given, only the tests they select are collected.
+        Tests are added to the tree as they are found; see Discovery.
+        """
+        return Discovery(self, labels, on_finish=on_finish)
+
+    def refresh(self, test_list=None, errors=None, rediscover=False):
+        """Rediscover the tests in the test suite.
+
+        If there is a discovery cache, only files that have changed
+        are collected again, unless rediscover is set.
+        """
+        if test_list is None:
+            discovery = self.start_refresh(rediscover=rediscover)
+            if discovery is not None:
+                discovery.wait()
+                if discovery.failed:
+                    raise ModelLoadError('\n'.join(discovery.errors))
+            return
 
         timestamp = datetime.now()
 
         # Make sure there is a data representation for every test in the list.
-        for test_id in test_list:
-            self.put_test(test_id)
+        self.build_from_ids(test_list)
 
         self.errors = errors if errors is not None else []
 
+    def start_refresh(self, rediscover=False):
+        """Start bringing the test suite up to date, without waiting.
+
+        Tests known to the discovery cache are added straight away.
+        Returns the Discovery that is collecting everything else, or
+        None if the cache was already up to date.
+        """
+        cache = self.discovery_cache
+        if cache is None or rediscover or not cache.load():
+            return self.discover(on_finish=self._full_discovery_finished)
+
+        # Show what we knew last time straight away...
+        self.build_from_ids(cache.tests())
+
+        if cache.config_changed(find_files(self.CONFIG_FILE_PATTERNS)):
+            debug("Discovery configuration changed; discovering all tests")
+            return self.discover(on_finish=self._full_discovery_finished)
+
+        # ... then bring the files that changed up to date.
+        changed, removed = cache.changed_files(find_files(self.TEST_FILE_PATTERNS))
+        debug("Discovery cache: %d changed, %d removed files", len(changed), len(removed))
+
+        for path in removed:
+            for test_id in cache.files[path]['tests']:
+                self.del_test(test_id)
+            cache.update(path, [])
+
+        self.errors = []
+        if changed:
+            return self.discover(
+                [self.file_label(path) for path in changed],
+                on_finish=lambda discovery: self._changed_files_discovered(changed, discovery)
+            )
+
+        if removed:
+            cache.save()
+        return None
+
+    def _full_discovery_finished(self, discovery):
+        "Remove tests that weren't found, and replace the discovery cache."
+        self.errors = discovery.errors
+        if discovery.failed:
+            return
+
+        count, known = self.find_tests(active=False, allow_all=True)
+        for test_id in set(known) - set(discovery.found):
+            self.del_test(test_id)
+
+        if self.discovery_cache is not None:
+            self._rebuild_cache(discovery.found, discovery.errors)
+
+    def _changed_files_discovered(self, changed, discovery):
+        "Remove tests that are no longer in the changed files, and update the cache."
+        self.errors = discovery.errors
+
+        cache = self.discovery_cache
+        found = self._group_by_file(discovery.found)
+        paths = set(changed) | set(found)
+        for path in paths:
+            tests = found.get(path, [])
+            old_tests = cache.files.get(path, {'tests': []})['tests']
+            for test_id in set(old_tests) - set(tests):
+                self.del_test(test_id)
+            cache.update(path, tests)
+        for path in self._error_files(paths, discovery.errors):
+            cache.mark_stale(path)
+        cache.save()
+
+    def _rebuild_cache(self, test_list, errors=()):
+        "Replace the contents of the discovery cache with a full discovery run."
+        cache = self.discovery_cache
+        cache.clear()
+        for path, tests in self._group_by_file(test_list).items():
+            cache.update(path, tests)
+        # Remember candidate files without tests, so they aren't collected every time.
+        for path in find_files(self.TEST_FILE_PATTERNS):
+            if path not in cache.files:
+                cache.update(path, [])
+        for path in self._error_files(list(cache.files), errors):
+            cache.mark_stale(path)
+        cache.update_config(find_files(self.CONFIG_FILE_PATTERNS))
+        cache.save()
+
+    def _error_files(self, paths, errors):
+        """Return the paths that are named in the discovery errors.
+
+        Their collection failed, so they have to be collected again
+        (and their errors shown) next time.
+        """
+        if not errors:
+            return []
+        text = '\n'.join(errors)
+        return [
+            path for path in paths
+            if '"%s"' % path in text or '"%s"' % os.path.abspath(path) in text
+        ]
+
+    def _group_by_file(self, test_list):
+        "Sort test ids into { file path : [test ids] }"
+        by_file = {}
+        for test_id in test_list:
+            by_file.setdefault(os.path.normpath(self.test_file(test_id)), []).append(test_id)
+        return by_file
+
     def put_test(self, test_id):
         """An idempotent insert method for tests.
         Ensures that a test identified as `test_id` exists in the test tree.
@@ -557,38 +989,182 @@ class TestSuite(TestNode, EventSource):
 
         Returns found or created node
         """
-        parent = self
+        node = self._nodes.get(test_id)
+        if node is not None:
+            return node
+        return self._put_parts(self.split_test_id(test_id))
 
-        parts = self.split_test_id(test_id)
-        part_paths = [ d[1] for d in parts ]  # just the path strings
-        #debug("put_test(%r) splits to: %r", test_id, parts)
+    def build_from_ids(self, test_ids):
+        """Add many tests to the tree at once.
 
-        count = 0
+        The ids are split and sorted once up front, so every node that
+        is created lands at the end of its parent's children, and the
+        parent of each test only has to be found once.
+
+        Returns the number of test ids added.
+        """
+        # Building a big tree allocates a lot of long lived objects;
+        # don't let the cyclic garbage collector rescan them as it goes.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            # Sort on the labels joined with NUL; that orders the same
+            # as comparing the labels one by one, but much faster.
+            entries = sorted(
+                (
+                    ('\0'.join([part for NodeClass, part in parts]), parts)
+                    for parts in map(self.split_test_id, test_ids)
+                ),
+                key=itemgetter(0)
+            )
+
+            parents = {}  # { joined labels of a parent node : node }
+            added = {}    # { parent node : test methods added to it }
+            for key, parts in entries:
+                parent_key = key.rpartition('\0')[0]
+                parent = parents.get(parent_key)
+                if parent is None:
+                    parent = self._put_parts(parts[:-1])
+                    parents[parent_key] = parent
+
+                NodeClass, part = parts[-1]
+                if part not in parent._child_nodes:
+                    child = self._new_child(parent, NodeClass, part, count=False)
+                    if NodeClass is TestMethod:
+                        added[parent] = added.get(parent, 0) + 1
+                        if self._suffixes is not None:
+                            self._suffixes.add(parts, child.path)
+
+            # Walk up from each parent once, rather than once per test.
+            for parent, tests in added.items():
+                parent._add_counts(tests=tests, active=tests)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return len(entries)
+
+    def _put_parts(self, parts):
+        """Ensure a node identified by its split parts exists in the tree.
+
+        Returns found or created node
+        """
+        child = self
         for NodeClass, part in parts:
-            try:
-                child = parent[part]  # already exists
-                #debug("put_test found %r", child)
-            except KeyError:          # create and insert
-                # need path to this point
-                if parent is None or parent.path is None:
-                    path = self.join_path(None, part)
-                elif NodeClass == TestModule:
-                    path = self.join_path((parent.path, part), None)
-                else:           # TestMethod
-                    path = self.join_path(parent.path, part)
-
-                child = NodeClass(
-                    source=self,
-                    path=path,
-                    name=part
-                )
-                parent[part] = child
-                debug("put_test created %r", child)
             parent = child
-            count += 1
+            child = parent._child_nodes.get(part)  # already exists?
+            if child is None:
+                child = self._new_child(parent, NodeClass, part)
+                if self._suffixes is not None and NodeClass is TestMethod:
+                    self._suffixes.add(parts, child.path)
 
         return child
 
+    def _new_child(self, parent, NodeClass, part, count=True):
+        """Create a node and insert it under `parent`.
+
+        If `count` is False, the caller adds a new test method to the
+        counts of its parents.
+        """
+        # need path to this point
+        if parent.path is None:
+            path = self.join_path(None, part)
+        elif NodeClass == TestModule:
+            path = self.join_path((parent.path, part), None)
+        else:           # TestMethod
+            path = self.join_path(parent.path, part)
+
+        child = NodeClass(
+            source=self,
+            path=path,
+            name=part
+        )
+        # The same as parent[part] = child, keeping the index for the event.
+        index = bisect.bisect_left(parent._child_labels, part)
+        parent._child_labels.insert(index, part)
+        parent._child_nodes[part] = child
+        child._parent = parent
+        self._nodes[path] = child
+        if count and NodeClass is TestMethod:
+            parent._add_counts(tests=1, active=1)
+        child.emit('new', parent=parent, index=index)
+        return child
+
+    def get_node_from_label(self, label):
+        """Return the node with the given label.
+
+        Labels are looked up in the index of node paths; a label that
+        isn't spelled exactly like a node path falls back to walking
+        the tree.
+
+        Raises KeyError if not found
+        """
+        try:
+            return self._nodes[label]
+        except KeyError:
+            return TestNode.get_node_from_label(self, label)
+
+    def find_tests_suffix(self, label):
+        """Find the tests whose paths end with the labels in `label`.
+
+        Only whole labels match: 'test_gui.py::test_good' finds
+        'top_dir/test_gui.py::test_good', but 'gui.py::test_good'
+        does not.
+
+        Returns a sorted list of paths.
+        """
+        if self._suffixes is None:
+            # Most runs never need the index; only build it when they do.
+            self._suffixes = SuffixIndex()
+            for path, node in self._nodes.items():
+                if isinstance(node, TestMethod):
+                    self._suffixes.add(self.split_test_id(path), path)
+        return self._suffixes.find(self.split_test_id(label))
+
+    def collapse_labels(self, paths):
+        """Return the fewest labels that select the tests in `paths`.
+
+        Where every test below a node is in `paths`, the node's label
+        is used in place of the labels of all those tests, so a test
+        command line doesn't need a label for each test. Paths that
+        aren't in the tree are kept as they are.
+
+        Returns a list of labels, in the order of `paths`.
+        """
+        selected = {}           # { node : the number of its tests in paths }
+        for path in paths:
+            node = self._nodes.get(path)
+            if node is not None:
+                node = node._parent
+                while node is not self:
+                    selected[node] = selected.get(node, 0) + 1
+                    node = node._parent
+
+        labels = []
+        seen = set()
+        for path in paths:
+            node = self._nodes.get(path)
+            if node is not None:
+                # Use the highest node whose tests are all selected.
+                parent = node._parent
+                while parent is not self and selected[parent] == parent.test_count:
+                    node = parent
+                    parent = node._parent
+                path = node.path
+            if path not in seen:
+                seen.add(path)
+                labels.append(path)
+        return labels
+
+    def _unindex(self, node):
+        "Remove a node, and everything below it, from the index of node paths."
+        if self._nodes.get(node.path) is node:
+            del self._nodes[node.path]
+        if self._suffixes is not None and isinstance(node, TestMethod):
+            self._suffixes.remove(self.split_test_id(node.path), node.path)
+        if node.can_have_children():
+            for child in node._child_nodes.values():
+                self._unindex(child)
+
     def del_test(self, test_id):
         parent = self
         parents = []
@@ -604,24 +1180,138 @@ class TestSuite(TestNode, EventSource):
  
         # If we complete iterating, we've found a test with this id.
         # So, we can delete the child...
+        tests, active, statuses = child._counts()
+        parents[-1]._add_counts(
+            -tests, -active, {status: -count for status, count in statuses.items()})
         del parents[-1][child.name]
+        self._unindex(child)
+        child.emit('deleted')
 
         # ... then we can walk back up the list of parents,
         # deleting any parent that has no children.
         # If at any point we find a parent with children,
         # we can bail (as the parent of a node with children
         # must also have children)
-        while parents:
+        while len(parents) > 1:
             child = parents.pop()
             if len(child) == 0:
                 del parents[-1][child.name]
+                self._unindex(child)
+                child.emit('deleted')
             else:
                 return
 
+class Discovery:
+    """A discovery subprocess, streaming test ids into a test suite.
+
+    stdout and stderr are read concurrently by background threads, so
+    the subprocess can't stall on a full pipe. Call poll() regularly
+    to add the tests found so far to the test suite, or wait() to
+    block until discovery is complete.
+    """
+    def __init__(self, test_suite, labels=None, on_finish=None):
+        self.test_suite = test_suite
+        self.labels = labels        # What to discover (None for everything)
+        self.on_finish = on_finish  # Called with this discovery once it completes
+        self.found = []             # Test ids found so far
+        self.errors = []            # Error output so far
+        self.finished = False
+
+        cmd = self.test_suite.discover_commandline(labels)
+        debug("Running %s to discover tests", cmd)
+        self.proc = subprocess.Popen(
+            cmd,
+            stdin=None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=False,
+        )
+
+        self.stdout = Queue()
+        self._stdout_thread = Thread(target=enqueue_output, args=(self.proc.stdout, self.stdout))
+        self._stdout_thread.daemon = True
+        self._stdout_thread.start()
+
+        self.stderr = Queue()
+        self._stderr_thread = Thread(target=enqueue_output, args=(self.proc.stderr, self.stderr))
+        self._stderr_thread.daemon = True
+        self._stderr_thread.start()
+
+    @property
+    def count(self):
+        "The number of tests found so far."
+        return len(self.found)
+
+    @property
+    def failed(self):
+        "Did a full discovery find nothing but errors?"
+        return self.finished and self.labels is None and bool(self.errors) and not self.found
+
+    def poll(self, limit=None):
+        """Add tests that have been found since the last poll.
+
+        At most `limit` tests are added by each call.
+
+        Returns True while there is more to come.
+        """
+        if self.finished:
+            return False
+
+        # Check if the subprocess is done before reading, so nothing is left behind.
+        done = (self.proc.poll() is not None
+                and not self._stdout_thread.is_alive()
+                and not self._stderr_thread.is_alive())
+
+        try:
+            while True:
+                line = self.stderr.get(block=False).strip()
+                debug("Got error %r", line)
+                self.errors.append(line)
+        except Empty:
+            pass
+
+        batch = []
+        drained = False
+        try:
+            while limit is None or len(batch) < limit:
+                test_id = self.stdout.get(block=False).strip()
+                if test_id:
+                    batch.append(test_id)
+        except Empty:
+            drained = True
+
+        self.found.extend(batch)
+        self.test_suite.build_from_ids(batch)
+
+        if drained and done:
+            self._finish()
+            return False
+        return True
+
+    def wait(self):
+        "Block until discovery is complete, adding all the tests found."
+        self.proc.wait()
+        self._stdout_thread.join()
+        self._stderr_thread.join()
+        self.poll()
+
+    def terminate(self):
+        "Stop the discovery subprocess."
+        if self.proc.poll() is None:
+            self.proc.terminate()
+
+    def _finish(self):
+        debug("Discovery finished: %d tests, %d error lines", len(self.found), len(self.errors))
+        self.finished = True
+        if self.on_finish is not None:
+            self.on_finish(self)
+
+
 class TestSuiteProblems(TestSuite):
     def __init__(self, suite):
         super().__init__()
         self.suite = suite
+        self.output_store = suite.output_store
         # Listen to any changes on the test suite
         self.suite.add_listener(self)
 
@@ -631,7 +1321,7 @@ class TestSuiteProblems(TestSuite):
     def change(self, item):
         if item.status in TestMethod.FAILING_STATES:
             # Test didn't pass. Make sure it exists in the problem tree.
-            failing_item = self.get_node_from_label(item.path)
+            failing_item = self.put_test(item.path)
 
             failing_item.set_result(
                 description=item.description,
@@ -0,0 +1,248 @@
+"""Storage for the output captured from a test.
+
+A chatty test can produce hundreds of thousands of lines, one at a
+time. Rebuilding a string for every line is quadratic, so output is
+kept as a list of chunks that is only joined when the whole thing is
+asked for. Parts of the output can be read without joining it.
+
+In a long session, the output of every test adds up. An OutputStore
+moves large outputs, and the outputs of passing tests once memory
+gets tight, into a temporary file; they are read back through mmap.
+"""
+import bisect
+import mmap
+import tempfile
+import weakref
+
+from cricket.events import debug
+
+
+class OutputStore:
+    """Disk storage, shared by the output buffers of a session.
+
+    Text is only written to disk when a buffer holds more than
+    `spill_size` characters, or when all the buffers together hold more
+    than `memory_limit` characters. In the second case, buffers that
+    are marked evict_first (the output of tests that passed) go first.
+    """
+    SPILL_SIZE = 256 * 1024
+    MEMORY_LIMIT = 256 * 1024 * 1024
+
+    def __init__(self, spill_size=SPILL_SIZE, memory_limit=MEMORY_LIMIT, directory=None):
+        self.spill_size = spill_size
+        self.memory_limit = memory_limit
+        self.directory = directory      # Where to put the file; None for the system default
+        self.memory = 0                 # Characters held in memory by buffers using this store
+
+        self._buffers = weakref.WeakSet()  # Buffers holding text in memory
+        self._file = None
+        self._size = 0                  # Bytes written to the file
+        self._mmap = None
+        self._mapped = 0                # Bytes covered by the mmap
+
+    @property
+    def size(self):
+        "The number of bytes written to disk."
+        return self._size
+
+    def write(self, data):
+        "Append bytes to the file, returning the offset they were written at."
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='cricket-output-', dir=self.directory)
+            debug("Spilling test output to %r", self._file.name)
+        offset = self._size
+        self._file.write(data)
+        self._size += len(data)
+        return offset
+
+    def read(self, start, end):
+        "Return the bytes between two offsets in the file."
+        if end > self._mapped:
+            # The file has grown since it was mapped.
+            self._file.flush()
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped = self._size
+        return self._mmap[start:end]
+
+    def added(self, buffer, count):
+        "Account for `count` characters added to a buffer."
+        self.memory += count
+        self._buffers.add(buffer)
+        if buffer.memory > self.spill_size:
+            buffer.spill()
+        elif self.memory > self.memory_limit:
+            self.evict()
+
+    def removed(self, buffer, count):
+        "Account for `count` characters a buffer no longer holds in memory."
+        self.memory -= count
+        if not buffer.memory:
+            self._buffers.discard(buffer)
+
+    def evict(self):
+        """Move buffers to disk until they use well under the memory limit.
+
+        Buffers marked evict_first go first; then the largest.
+        """
+        # Buffers that have been thrown away don't free their count.
+        self.memory = sum(buffer.memory for buffer in self._buffers)
+        target = self.memory_limit * 3 // 4
+        candidates = sorted(
+            self._buffers,
+            key=lambda buffer: (not buffer.evict_first, -buffer.memory)
+        )
+        for buffer in candidates:
+            if self.memory <= target:
+                break
+            buffer.spill()
+
+    def close(self):
+        "Release the file, which deletes it."
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._mapped = self._size = 0
+
+
+class OutputBuffer:
+    """Append-only text, stored as a list of chunks.
+
+    If the buffer has a store, the start of the text may have been
+    spilled to disk; that is transparent to readers.
+
+    Offsets and lengths are measured in characters.
+    """
+    def __init__(self, text='', store=None):
+        self.store = store
+        self.evict_first = False    # Spill this before other buffers?
+
+        self._chunks = []       # Text held in memory, in the order it was added
+        self._offsets = []      # Offset of the start of each chunk
+        self._length = 0
+
+        self._segments = []         # (byte start, byte end) of each spilled segment
+        self._segment_offsets = []  # Offset of the start of each spilled segment
+        self._spilled = 0           # Characters on disk; the start of the text
+
+        if text:
+            self.append(text)
+
+    def __len__(self):
+        return self._length
+
+    def __bool__(self):
+        return self._length > 0
+
+    def __str__(self):
+        return self.getvalue()
+
+    @property
+    def memory(self):
+        "The number of characters held in memory."
+        return self._length - self._spilled
+
+    def append(self, text):
+        "Add text to the end of the buffer."
+        if text:
+            self._chunks.append(text)
+            self._offsets.append(self._length)
+            self._length += len(text)
+            if self.store is not None:
+                self.store.added(self, len(text))
+
+    def add_lines(self, lines):
+        "Add lines of output, separated from any existing output by a newline."
+        if self._length:
+            self.append('\n')
+        self.append('\n'.join(lines))
+
+    def spill(self):
+        "Move the text held in memory to the store's file."
+        if not self._chunks:
+            return
+        text = ''.join(self._chunks)
+        data = text.encode('utf-8', 'surrogateescape')
+        start = self.store.write(data)
+        self._segments.append((start, start + len(data)))
+        self._segment_offsets.append(self._spilled)
+
+        self._chunks = []
+        self._offsets = []
+        self._spilled = self._length
+        self.store.removed(self, len(text))
+
+    def getvalue(self):
+        "Return all of the text in the buffer."
+        if self._spilled:
+            return self.read()
+        if len(self._chunks) > 1:
+            # Keep the joined text, so reading again is cheap.
+            self._chunks = [''.join(self._chunks)]
+            self._offsets = [0]
+        return self._chunks[0] if self._chunks else ''
+
+    def read(self, start=0, end=None):
+        "Return the text from offset `start` up to (but not including) `end`."
+        if end is None or end > self._length:
+            end = self._length
+        start = max(start, 0)
+        if start >= end:
+            return ''
+
+        parts = []
+        if start < self._spilled:
+            index = bisect.bisect_right(self._segment_offsets, start) - 1
+            while index < len(self._segments) and self._segment_offsets[index] < end:
+                text = self.store.read(*self._segments[index]).decode('utf-8', 'surrogateescape')
+                offset = self._segment_offsets[index]
+                parts.append(text[max(start - offset, 0):end - offset])
+                index += 1
+
+        if end > self._spilled and self._chunks:
+            index = max(bisect.bisect_right(self._offsets, start) - 1, 0)
+            while index < len(self._chunks) and self._offsets[index] < end:
+                chunk = self._chunks[index]
+                offset = self._offsets[index]
+                parts.append(chunk[max(start - offset, 0):end - offset])
+                index += 1
+        return ''.join(parts)
+
+    def tail(self, size):
+        "Return the last `size` characters of the buffer."
+        return self.read(self._length - size)
+
+    def find(self, text, start=0, block_size=1024 * 1024):
+        """Return the offset of the first `text` at or after `start`, or -1.
+
+        The buffer is searched a block at a time, so spilled output is
+        never read back all at once.
+        """
+        if not text:
+            return -1
+        overlap = len(text) - 1
+        offset = max(start, 0)
+        while offset < self._length:
+            end = min(offset + block_size, self._length)
+            # Overlap the next block, so matches across the boundary are found.
+            found = self.read(offset, end + overlap).find(text)
+            if found >= 0:
+                return offset + found
+            offset = end
+        return -1
+
+    def clear(self):
+        "Discard all of the text in the buffer."
+        memory = self.memory
+        self._chunks = []
+        self._offsets = []
+        self._length = 0
+        self._segments = []
+        self._segment_offsets = []
+        self._spilled = 0
+        if self.store is not None and memory:
+            self.store.removed(self, memory)
@@ -1,10 +1,12 @@
 from __future__ import absolute_import
 
-import json
 try:
     from StringIO import StringIO
 except ImportError:
     from io import StringIO
+import json
+import os
+import signal
 import sys
 import time
 import traceback
@@ -14,6 +16,11 @@ if sys.version_info < (2, 7):
 else:
     import unittest
 
+from cricket.protocol import (
+    END_TEST_RESULTS, POOL_FDS_ENV, RESULT_FD_ENV, RESULT_SEPARATOR, START_TEST_RESULTS,
+    ResultWriter, result_writer
+)
+
 
 def trim_docstring(docstring):
     """Trim leading spaces in docstring indentation.
@@ -49,11 +56,12 @@ class PipedTestResult(unittest.result.TestResult):
 
     Used by PipedTestRunner.
     """
-    RESULT_SEPARATOR = '\x1f'  # ASCII US (Unit Separator)
+    RESULT_SEPARATOR = RESULT_SEPARATOR
 
-    def __init__(self, stream):
+    def __init__(self, stream, writer=None):
         super(PipedTestResult, self).__init__()
         self.stream = stream
+        self.writer = writer if writer is not None else ResultWriter(stream)
         self._first = True
 
         # Create a clean buffer for stdout content.
@@ -91,12 +99,11 @@ class PipedTestResult(unittest.result.TestResult):
             'start_time': time.time()
         }
         if self._first:
-            self.stream.write(PipedTestRunner.START_TEST_RESULTS + '\n')
+            self.writer.marker(START_TEST_RESULTS)
             self._first = False
         else:
-            self.stream.write(self.RESULT_SEPARATOR + '\n')
-        self.stream.write('%s\n' % json.dumps(body))
-        self.stream.flush()
+            self.writer.marker(RESULT_SEPARATOR)
+        self.writer.record(body)
 
     def addSuccess(self, test):
         super(PipedTestResult, self).addSuccess(test)
@@ -106,8 +113,7 @@ class PipedTestResult(unittest.result.TestResult):
             'description': self.description(test),
             'output': self._stdout.getvalue(),
         }
-        self.stream.write('%s\n' % json.dumps(body))
-        self.stream.flush()
+        self.writer.record(body)
         self._current_test = None
 
     def addError(self, test, err):
@@ -124,8 +130,7 @@ class PipedTestResult(unittest.result.TestResult):
             'error': '\n'.join(traceback.format_exception(*err)),
             'output': self._stdout.getvalue(),
         }
-        self.stream.write('%s\n' % json.dumps(body))
-        self.stream.flush()
+        self.writer.record(body)
         self._current_test = None
 
     def addFailure(self, test, err):
@@ -137,8 +142,7 @@ class PipedTestResult(unittest.result.TestResult):
             'error': '\n'.join(traceback.format_exception(*err)),
             'output': self._stdout.getvalue(),
         }
-        self.stream.write('%s\n' % json.dumps(body))
-        self.stream.flush()
+        self.writer.record(body)
         self._current_test = None
 
     def addSubTest(self, test, subtest, err):
@@ -150,8 +154,7 @@ class PipedTestResult(unittest.result.TestResult):
                 'description': self.description(test),
                 'output': self._stdout.getvalue(),
             }
-            self.stream.write('%s\n' % json.dumps(body))
-            self.stream.flush()
+            self.writer.record(body)
         elif issubclass(err[0], test.failureException):
             body = {
                 'status': 'F',
@@ -160,8 +163,7 @@ class PipedTestResult(unittest.result.TestResult):
                 'error': '\n'.join(traceback.format_exception(*err)),
                 'output': self._stdout.getvalue(),
             }
-            self.stream.write('%s\n' % json.dumps(body))
-            self.stream.flush()
+            self.writer.record(body)
         else:
             body = {
                 'status': 'E',
@@ -170,8 +172,7 @@ class PipedTestResult(unittest.result.TestResult):
                 'error': '\n'.join(traceback.format_exception(*err)),
                 'output': self._stdout.getvalue(),
             }
-            self.stream.write('%s\n' % json.dumps(body))
-            self.stream.flush()
+            self.writer.record(body)
 
     def addSkip(self, test, reason):
         super(PipedTestResult, self).addSkip(test, reason)
@@ -182,8 +183,7 @@ class PipedTestResult(unittest.result.TestResult):
             'error': reason,
             'output': self._stdout.getvalue(),
         }
-        self.stream.write('%s\n' % json.dumps(body))
-        self.stream.flush()
+        self.writer.record(body)
         self._current_test = None
 
     def addExpectedFailure(self, test, err):
@@ -195,8 +195,7 @@ class PipedTestResult(unittest.result.TestResult):
             'error': '\n'.join(traceback.format_exception(*err)),
             'output': self._stdout.getvalue(),
         }
-        self.stream.write('%s\n' % json.dumps(body))
-        self.stream.flush()
+        self.writer.record(body)
         self._current_test = None
 
     def addUnexpectedSuccess(self, test):
@@ -207,8 +206,7 @@ class PipedTestResult(unittest.result.TestResult):
             'description': self.description(test),
             'output': self._stdout.getvalue(),
         }
-        self.stream.write('%s\n' % json.dumps(body))
-        self.stream.flush()
+        self.writer.record(body)
         self._current_test = None
 
 
@@ -218,8 +216,8 @@ class PipedTestRunner(unittest.TextTestRunner):
     It prints out the names of tests as they are run, errors as they
     occur, and a summary of the results at the end of the test run.
     """
-    START_TEST_RESULTS = '\x02'  # ASCII STX (Start of Text)
-    END_TEST_RESULTS = '\x03'    # ASCII ETX (End of Text)
+    START_TEST_RESULTS = START_TEST_RESULTS
+    END_TEST_RESULTS = END_TEST_RESULTS
 
     def __init__(self, stream=sys.stdout):
         self.stream = stream
@@ -230,14 +228,99 @@ class PipedTestRunner(unittest.TextTestRunner):
         old_stdout = sys.stdout
 
         # Create the result pipe, and run the tests with it.
-        result = PipedTestResult(self.stream)
+        writer = result_writer(self.stream)
+        result = PipedTestResult(self.stream, writer)
         test(result)
 
         # Report end of test run
-        self.stream.write(self.END_TEST_RESULTS + '\n')
-        self.stream.flush()
+        writer.marker(END_TEST_RESULTS)
 
         # Restore the stdout reference
         sys.stdout = old_stdout
 
         return result
+
+
+def run_forked(suites, run_suite=None, setup_worker=None):
+    """Run each suite in a worker forked from this process.
+
+    Anything imported before this is called is shared with every
+    worker. Each worker writes to the pipes given for it in
+    POOL_FDS_ENV (see cricket.executor.start_pool).
+
+    Arguments:
+      suites        The suite for each worker to run
+      run_suite     Runs a suite in a worker; by default, with a PipedTestRunner
+      setup_worker  If given, called with the index of the worker in
+                    each worker, before its suite is run
+
+    Returns once every worker has exited.
+    """
+    if run_suite is None:
+        run_suite = PipedTestRunner().run
+    pool_fds = json.loads(os.environ.pop(POOL_FDS_ENV))
+
+    # Don't let the workers inherit (and repeat) buffered output.
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    # Stopping this process stops every worker started so far,
+    # so none are left behind if it is stopped while forking.
+    pids = []
+
+    def stop(signum, frame):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        sys.exit(1)
+    signal.signal(signal.SIGTERM, stop)
+
+    for index, (suite, fds) in enumerate(zip(suites, pool_fds)):
+        # Hold off the signal until the new worker is in pids.
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(index, suite, fds, pool_fds, run_suite, setup_worker)
+        pids.append(pid)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+
+    # Only the workers write to their pipes.
+    for fds in pool_fds:
+        for fd in fds:
+            if fd is not None:
+                os.close(fd)
+
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+
+def _run_worker(index, suite, fds, pool_fds, run_suite, setup_worker):
+    "Run a suite in a forked worker, then exit the worker."
+    status = 1
+    try:
+        # The worker is stopped like any other process, not like the pool.
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+        stdout_fd, stderr_fd, results_fd = fds
+        if stdout_fd is not None:
+            os.dup2(stdout_fd, 1)
+            os.dup2(stderr_fd, 2)
+        # Close the pipes of the other workers, so they see the end of them.
+        for worker_fds in pool_fds:
+            for fd in worker_fds:
+                if fd is not None and fd != results_fd:
+                    os.close(fd)
+
+        os.environ[RESULT_FD_ENV] = str(results_fd)
+        if setup_worker is not None:
+            setup_worker(index)
+        run_suite(suite)
+        status = 0
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
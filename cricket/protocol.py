@@ -0,0 +1,176 @@
+'''
+The protocol test processes use to send their results to the Executor.
+
+Kept apart from cricket.pipes, so the executor can read results
+without importing unittest.
+'''
+from __future__ import absolute_import
+
+import io
+import json
+import os
+import struct
+
+
+# The environment variable that gives a test process the file
+# descriptor to write framed results to.
+RESULT_FD_ENV = 'CRICKET_RESULT_FD'
+
+# The environment variable that gives a forking test process the file
+# descriptors of each of its workers, as JSON (see cricket.executor.start_pool).
+POOL_FDS_ENV = 'CRICKET_POOL_FDS'
+
+# Markers in the stream of results
+START_TEST_RESULTS = '\x02'  # ASCII STX (Start of Text)
+RESULT_SEPARATOR = '\x1f'    # ASCII US (Unit Separator)
+END_TEST_RESULTS = '\x03'    # ASCII ETX (End of Text)
+
+# The kind of frame holding output from the tests (see FrameStream)
+OUTPUT = 'o'
+
+
+class ResultWriter(object):
+    """Writes test results to stdout, as lines of JSON between marker lines.
+
+    This is the fallback protocol; any output from the tests is mixed
+    in with the results.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def marker(self, marker):
+        "Write one of START_TEST_RESULTS, RESULT_SEPARATOR or END_TEST_RESULTS."
+        self.stream.write(marker + '\n')
+        self.stream.flush()
+
+    def record(self, body):
+        "Write a test start or test result."
+        self.stream.write('%s\n' % json.dumps(body))
+        self.stream.flush()
+
+    def output(self, text):
+        "Write output from the tests, in order with the results."
+        self.stream.write(text)
+        self.stream.flush()
+
+
+class FramedResultWriter(ResultWriter):
+    """Writes test results to a file descriptor of their own.
+
+    Every frame is a header (the kind of frame, and the length of the
+    body) followed by the body. Markers have an empty body; records
+    have a JSON body, and output has a UTF-8 body of whole lines.
+    Output written to stdout goes down another pipe, so can't be kept
+    in order with the results; output sent here is.
+    """
+    HEADER = struct.Struct('!BI')
+    RECORD = ord('{')  # The kind of frame holding a record
+
+    def __init__(self, fd):
+        self.file = os.fdopen(fd, 'wb', 0)
+        self._partial = ''      # Output after the last newline
+
+    def _write(self, kind, body=b''):
+        if self._partial and kind != ord(OUTPUT):
+            # Output written before a result belongs before it.
+            partial, self._partial = self._partial, ''
+            self._write(ord(OUTPUT), (partial + '\n').encode('utf-8', 'replace'))
+        self.file.write(self.HEADER.pack(kind, len(body)) + body)
+
+    def marker(self, marker):
+        self._write(ord(marker))
+
+    def record(self, body):
+        self._write(self.RECORD, json.dumps(body).encode('utf-8'))
+
+    def output(self, text):
+        lines, newline, self._partial = (self._partial + text).rpartition('\n')
+        if newline:
+            self._write(ord(OUTPUT), (lines + newline).encode('utf-8', 'replace'))
+
+
+class OutputStream(io.TextIOBase):
+    """A text stream that writes to a result writer's output.
+
+    Used in place of sys.stdout, so what the tests print is kept in
+    order with their results.
+    """
+    encoding = 'utf-8'
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.writer.output(text)
+        return len(text)
+
+
+def result_writer(stream):
+    """Return the writer for the results of this test process.
+
+    If the executor has provided a file descriptor for results, they
+    are framed on that; otherwise they are JSON lines on `stream`.
+    """
+    # Only this process writes to the descriptor, not any subprocess of the tests.
+    fd = os.environ.pop(RESULT_FD_ENV, None)
+    if fd is not None:
+        try:
+            return FramedResultWriter(int(fd))
+        except (ValueError, OSError):
+            pass
+    return ResultWriter(stream)
+
+
+class FrameStream(object):
+    """The frames read from a FramedResultWriter's pipe.
+
+    Fed by a cricket.events.PipeReader. Each complete frame is added
+    to `frames` as (marker, None), (None, record), or (OUTPUT, text).
+    """
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.closed = False     # Saw the end of the pipe
+        self.frames = []        # Complete frames not taken yet
+
+        self._buffer = bytearray()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def feed(self, data):
+        "Add bytes read from the pipe; empty data marks the end of the pipe."
+        if not data:
+            self.closed = True
+            return
+
+        buffer = self._buffer
+        buffer.extend(data)
+        header_size = FramedResultWriter.HEADER.size
+        offset = 0
+        while len(buffer) - offset >= header_size:
+            kind, length = FramedResultWriter.HEADER.unpack_from(buffer, offset)
+            end = offset + header_size + length
+            if end > len(buffer):
+                break
+            if kind == FramedResultWriter.RECORD:
+                body = bytes(buffer[offset + header_size:end]).decode('utf-8')
+                self.frames.append((None, json.loads(body)))
+            elif kind == ord(OUTPUT):
+                body = bytes(buffer[offset + header_size:end]).decode('utf-8', 'replace')
+                self.frames.append((OUTPUT, body))
+            else:
+                self.frames.append((chr(kind), None))
+            offset = end
+        del buffer[:offset]
+
+    def take(self, limit=None):
+        "Remove and return the complete frames read so far (at most `limit`)."
+        if limit is None or limit >= len(self.frames):
+            frames, self.frames = self.frames, []
+        else:
+            frames = self.frames[:limit]
+            del self.frames[:limit]
+        return frames
@@ -6,13 +6,7 @@ from __future__ import print_function
 
 from cricket.main import main as cricket_main
 from cricket.pytest.model import PyTestTestSuite
-from cricket.events import debug
-import os, sys
 
-# If pytest_cricket isn't on path, thing will fail later
-sys.path.append(os.path.dirname(os.path.realpath(__file__)))
-os.environ['PYTHONPATH'] = os.pathsep.join(sys.path)  # export
-#print("PYTHONPATH=%r" % os.environ['PYTHONPATH'])
 
 def main():
     return cricket_main(PyTestTestSuite)
@@ -11,6 +11,16 @@ class PyTestTestSuite(TestSuite):
     # on Windows, pytest discover returns unix style paths.  Match either for split
     SPLIT_RE = re.compile(r'[/\\]')
 
+    # pytest's default python_files, and the files that configure collection
+    TEST_FILE_PATTERNS = ('test_*.py', '*_test.py')
+    CONFIG_FILE_PATTERNS = ('conftest.py', 'pytest.ini', 'tox.ini', 'setup.cfg', 'pyproject.toml')
+
+    # xunit style setup, and fixtures that are set up once per module or class
+    SHARED_FIXTURES_RE = re.compile(
+        r'\b(setUpModule|setUpClass|setup_module|setup_class)\b'
+        r'|\bscope\s*=\s*[\'"](module|class)[\'"]'
+    )
+
     def __init__(self, options=None):
         super(PyTestTestSuite, self).__init__() 
         if options:
@@ -36,14 +46,28 @@ class PyTestTestSuite(TestSuite):
         parser.add_argument('--junit-xml', default="", action="store",
                             help="Create junit-xml style report file at given path.")
 
-    def discover_commandline(self):
-        "Command line: Discover all available tests in a project."
-        return self._pytest_exec + ['--cricket', 'discover']
+    @classmethod
+    def setup_environment(cls, options):
+        """Make sure the pytest subprocesses can load our plugin.
 
-    def execute_commandline(self, labels):
-        "Return the command line to execute the specified test labels"
-        args = self._pytest_exec + ['--cricket', 'execute']
+        pytest_cricket is alongside this module; if it isn't on the
+        path of the subprocesses, they will fail.
+        """
+        plugin_dir = os.path.dirname(os.path.realpath(__file__))
+        if plugin_dir not in sys.path:
+            sys.path.append(plugin_dir)
+        os.environ['PYTHONPATH'] = os.pathsep.join(sys.path)  # export
+
+    def discover_commandline(self, labels=None):
+        "Command line: Discover all available tests in a project (or just those in labels)."
+        args = self._pytest_exec + ['--cricket', 'discover']
+        if labels:
+            args.extend(labels)
+        return args
 
+    def _option_arguments(self):
+        "Return the pytest options given to cricket, for the command lines that run tests."
+        args = []
         debug("cli_args: %r", self.cli_args)
         for aa in self.cli_args:
             value = self.cli_args[aa]
@@ -56,6 +80,11 @@ class PyTestTestSuite(TestSuite):
                     value = jpath
 
                 args.extend(['--'+aa, value])
+        return args
+
+    def execute_commandline(self, labels):
+        "Return the command line to execute the specified test labels"
+        args = self._pytest_exec + ['--cricket', 'execute'] + self._option_arguments()
 
         # TODO: need way to configure directories to run coverage against and other arguments
         # Breaks executor parsing
@@ -67,6 +96,38 @@ class PyTestTestSuite(TestSuite):
 
         return args
 
+    def serve_commandline(self):
+        "Return the command line of a pytest process that runs the labels it reads from stdin."
+        if self.cli_args.get("junit-xml"):
+            # The report is only written when the process exits.
+            return None
+        return self._pytest_exec + ['--cricket', 'serve'] + self._option_arguments()
+
+    def shares_fixtures(self, test_id):
+        """Return True if the tests in the module of `test_id` share fixtures.
+
+        Module and class scoped fixtures can also come from the
+        conftest.py files in the directories above the module.
+        """
+        path = self.test_file(test_id)
+        if self._file_shares_fixtures(path):
+            return True
+        directory = path
+        while directory:
+            directory = os.path.dirname(directory)
+            conftest = os.path.join(directory, 'conftest.py')
+            if os.path.exists(conftest) and self._file_shares_fixtures(conftest):
+                return True
+        return False
+
+    def test_file(self, test_id):
+        "Return the path of the source file that defines a test."
+        return os.path.normpath(test_id.split('::')[0])
+
+    def file_label(self, path):
+        "Return the label that selects all the tests in a source file."
+        return '/'.join(self.SPLIT_RE.split(os.path.normpath(path)))
+
     def split_test_id(self, test_id):
         """Split label string into levels.
 
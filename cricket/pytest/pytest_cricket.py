@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
-import json
+import io
+import logging
 import os
 import sys
 import time
@@ -8,12 +9,17 @@ import pluggy
 import py
 import pytest
 
+from cricket.protocol import (
+    END_TEST_RESULTS, RESULT_SEPARATOR, START_TEST_RESULTS, FramedResultWriter, OutputStream,
+    result_writer
+)
+
 
 def pytest_addoption(parser):
     group = parser.getgroup("cricket", "BeeWare Cricket integration")
     group.addoption(
         '--cricket', dest="cricket_mode", metavar="cricket_mode",
-        action="store", choices=["discover", "execute", "off"], default="off",
+        action="store", choices=["discover", "execute", "serve", "off"], default="off",
         help="Cricket output mode")
 
 
@@ -37,6 +43,10 @@ def pytest_configure(config):
         reporter = CricketExecuteReporter(config, file=sys.stdout)
         config.pluginmanager.register(reporter, "terminalreporter")
 
+    elif config.option.cricket_mode == 'serve':
+        reporter = CricketServeReporter(config, file=sys.stdout)
+        config.pluginmanager.register(reporter, "terminalreporter")
+
 
 class CricketReporter:
     def __init__(self, config, file=None):
@@ -54,18 +64,14 @@ class CricketReporter:
     def print(self, *args, **kwargs):
         print(*args, **kwargs, file=self.file)
 
-    # This doesn't error, but the output is lost. executor can't
-    # handle output while the test is running
+    # Live logging writes here while a test runs
     def write(self, arg):
         """Logging wants to call write()."""
-        self.print(arg, flush=True)
+        self.print(arg, end='', flush=True)
 
-    # This doesn't error, but the output is lost. executor can't
-    # handle output while the test is running
     def section(self, arg, sep='-', bold=False):
         """Pytest Logging wants to call section()."""
-        # I can't find the source to emulate.  Just don't throw an error
-        self.print("Section: ", arg, flush=True)
+        self.print((' %s ' % arg).center(80, sep), flush=True)
 
     def pytest_internalerror(self, excrepr):
         for line in str(excrepr).split("\n"):
@@ -79,18 +85,41 @@ class CricketDiscoverReporter(CricketReporter):
 
 
 class CricketExecuteReporter(CricketReporter):
+    def __init__(self, config, file=None):
+        super().__init__(config, file=file)
+        # Results go to their own descriptor, if cricket provided one.
+        self.writer = result_writer(self.file)
+
     def report(self, **kwargs):
-        self.print(json.dumps(kwargs), flush=True)
+        self.writer.record(kwargs)
+
+    def print(self, *args, **kwargs):
+        # Output (like live logging) is kept in order with the results.
+        kwargs.pop('flush', None)
+        text = io.StringIO()
+        print(*args, **kwargs, file=text)
+        self.writer.output(text.getvalue())
 
     def pytest_sessionstart(self, session):
         self._started = False
+        self._stdout = None
+
+        # Live logging may have been set up to write to the terminal
+        # reporter this one replaced.
+        handler = getattr(self.config.pluginmanager.get_plugin('logging-plugin'), 'log_cli_handler', None)
+        if isinstance(handler, logging.StreamHandler):
+            handler.setStream(self)
+        if isinstance(self.writer, FramedResultWriter):
+            # Tests print straight to stdout (--capture=no), which is a
+            # pipe of its own; send what they print with the results.
+            self._stdout, sys.stdout = sys.stdout, OutputStream(self.writer)
 
     def pytest_runtest_logstart(self, nodeid, location):
         if not self._started:
-            self.print('\x02')  # ASCII STX (Start of Text)
+            self.writer.marker(START_TEST_RESULTS)
             self._started = True
         else:
-            self.print('\x1f')  # ASCII US (Unit Separator)
+            self.writer.marker(RESULT_SEPARATOR)
 
         self.report(
             path=nodeid,
@@ -183,4 +212,79 @@ class CricketExecuteReporter(CricketReporter):
                     self.report_expected_failure(report)
 
     def pytest_sessionfinish(self, exitstatus):
-        self.print('\x03')  # ASCII ETX (End of Text)
+        self.writer.marker(END_TEST_RESULTS)
+        self.restore_stdout()
+
+    def restore_stdout(self):
+        if self._stdout is not None:
+            sys.stdout, self._stdout = self._stdout, None
+
+
+def select_items(items, labels):
+    """Return the collected items that match any of the labels, in collection order.
+
+    A label matches an item with that node id, and every item in the
+    file, class or directory it names. No labels selects every item.
+    """
+    if not labels:
+        return list(items)
+    exact = set(labels)
+    prefixes = tuple(label + '::' for label in labels) \
+        + tuple(label.rstrip('/') + '/' for label in labels)
+    return [
+        item for item in items
+        if item.nodeid in exact or item.nodeid.startswith(prefixes)
+    ]
+
+
+class CricketServeReporter(CricketExecuteReporter):
+    """Collects the tests once, then runs them as often as cricket asks.
+
+    Cricket writes the labels of the tests to run on stdin, one per
+    line, followed by a blank line. Each batch gets its own start and
+    end of results markers. An empty batch runs every test; the end
+    of stdin stops the server.
+    """
+    def __init__(self, config, file=None):
+        super().__init__(config, file=file)
+        # Keep stdin for commands; tests that read stdin see its end.
+        self.commands = os.fdopen(os.dup(0), 'r')
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+
+    def read_labels(self):
+        "Wait for the next batch of labels; returns None at the end of stdin."
+        labels = []
+        for line in self.commands:
+            line = line.strip()
+            if not line:
+                return labels
+            labels.append(line)
+        return labels or None
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session):
+        while True:
+            labels = self.read_labels()
+            if labels is None:
+                break
+            items = select_items(session.items, labels)
+            if len(items) < len(labels):
+                known = {item.nodeid for item in items}
+                for label in labels:
+                    if label in known:
+                        continue
+                    if not select_items(items, [label]):
+                        self.print("No tests match %s" % label, flush=True)
+
+            self._started = False
+            for index, item in enumerate(items):
+                nextitem = items[index + 1] if index + 1 < len(items) else None
+                item.config.hook.pytest_runtest_protocol(item=item, nextitem=nextitem)
+            self.writer.marker(END_TEST_RESULTS)
+        return True
+
+    def pytest_sessionfinish(self, exitstatus):
+        # Every batch has already been ended.
+        self.restore_stdout()
@@ -1,29 +1,102 @@
-import json
+import argparse
+import sys
+import time
+import traceback
 import unittest
 
 
 def consume(iterable):
-    input = list(iterable)
-    while input:
-        item = input.pop(0)
+    """Yield every test in a (possibly nested) suite, in order.
+
+    Nested suites are walked with a stack of iterators, so each
+    suite is only visited once.
+    """
+    stack = [iter(iterable)]
+    while stack:
+        try:
+            item = next(stack[-1])
+        except StopIteration:
+            stack.pop()
+            continue
         try:
-            data = iter(item)
-            input = list(data) + input
-        except:
+            stack.append(iter(item))
+        except TypeError:
             yield item
 
 
-def discover_tests():
+class StreamingTestLoader(unittest.TestLoader):
+    """A test loader that prints the id of each test as soon as it is loaded.
+
+    Discovery imports one module at a time; the tests in each module
+    are printed (and flushed) before the next is imported, so cricket
+    can show them while discovery carries on.
+
+    If `import_times` is a stream, the time taken to import each
+    module is written to it.
+    """
+    def __init__(self, stream=None, import_times=None):
+        super(StreamingTestLoader, self).__init__()
+        self.stream = stream if stream is not None else sys.stdout
+        self.import_times = import_times
+        self.seen = set()       # Ids of the tests printed so far
+
+    def report(self, suite):
+        "Print the ids of the tests in suite that haven't been printed yet."
+        for test in consume(suite):
+            test_id = test.id()
+            if test_id not in self.seen:
+                self.seen.add(test_id)
+                self.stream.write(test_id + '\n')
+        self.stream.flush()
+
+    def report_time(self, name, start):
+        "Report how long it took to import (or load) name."
+        if self.import_times is not None:
+            self.import_times.write('%8.1f ms  %s\n' % ((time.perf_counter() - start) * 1000, name))
+            self.import_times.flush()
+
+    def _get_module_from_name(self, name):
+        start = time.perf_counter()
+        module = super(StreamingTestLoader, self)._get_module_from_name(name)
+        self.report_time(name, start)
+        return module
+
+    def loadTestsFromModule(self, module, *args, **kwargs):
+        suite = super(StreamingTestLoader, self).loadTestsFromModule(module, *args, **kwargs)
+        self.report(suite)
+        return suite
+
+
+def discover_tests(labels=None, import_times=None):
     '''
     Collect a list of potentially runnable tests
-    '''
 
-    loader = unittest.TestLoader()
-    suite = loader.discover('.')
+    If labels (dotted module names) are given, only the tests
+    in those modules are collected.
+    '''
 
-    for test in list(consume(suite)):
-        print(test.id())
+    loader = StreamingTestLoader(import_times=import_times)
+    if labels:
+        for label in labels:
+            start = time.perf_counter()
+            try:
+                loader.report(loader.loadTestsFromName(label))
+            except Exception:
+                # Report the error, and carry on with the other labels.
+                traceback.print_exc()
+            loader.report_time(label, start)
+    else:
+        # Tests that failed to import are only in the complete suite.
+        loader.report(loader.discover('.'))
 
 
 if __name__ == '__main__':
-    discover_tests()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--import-times", action="store_true",
+        help="Report the time taken to import each module, to stderr"
+    )
+    parser.add_argument('labels', nargs='*', help='Test modules to discover.')
+    options = parser.parse_args()
+
+    discover_tests(options.labels, import_times=sys.stderr if options.import_times else None)
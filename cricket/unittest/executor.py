@@ -18,21 +18,45 @@ except ImportError:
 from cricket import pipes
 
 
-def unroll_test_suite(suite):
-    """Convert a (possibly heirarchical) test suite into a flat set of tests.
+def unroll_test_suite(suite, seen=None):
+    """Convert a (possibly heirarchical) test suite into a flat list of tests.
 
     This is used to ensure that the suite only executes any
-    individual test once.
+    individual test once. Tests are kept in the order they were
+    found; tests already in `seen` are left out.
     """
-    flat = set()
+    if seen is None:
+        seen = set()
+    flat = []
     for test in suite:
         if isinstance(test, unittest.TestSuite):
-            flat.update(unroll_test_suite(test))
-        else:
-            flat.add(test)
+            flat.extend(unroll_test_suite(test, seen))
+        elif test not in seen:
+            seen.add(test)
+            flat.append(test)
     return flat
 
 
+def group_tests(tests):
+    """Order a flat list of tests so each module, and each class, runs together.
+
+    unittest sets up (and tears down) class and module fixtures
+    whenever the class or module of the next test changes, so
+    interleaved tests would set them up again. Modules and classes
+    are kept in the order they were first found.
+    """
+    modules = {}                # { module : { class : [tests] } }
+    for test in tests:
+        cls = type(test)
+        modules.setdefault(cls.__module__, {}).setdefault(cls, []).append(test)
+    return [
+        test
+        for classes in modules.values()
+        for class_tests in classes.values()
+        for test in class_tests
+    ]
+
+
 class UnittestExecutor:
     '''
     This is a thing which, when run, produces a stream
@@ -50,28 +74,54 @@ class UnittestExecutor:
     def stream_suite(self, suite):
         pipes.PipedTestRunner().run(suite)
 
-    def stream_results(self):
-        """Build a suite matching the requested test list, and stream it."""
+    def load_suite(self, labels):
+        """Build a suite matching the test labels (or every test, if there are none)."""
 
         loader = unittest.TestLoader()
 
-        if not self.specified_list:
+        if not labels:
             suite = loader.discover('.')
         else:
-            all_tests = set()
+            all_tests = []
+            seen = set()
 
-            for module in self.specified_list:
+            for module in labels:
                 file_path = module.replace('.', os.sep)
                 if os.path.isdir(file_path):
                     subsuite = loader.discover(file_path, top_level_dir='.')
                 else:
                     subsuite = loader.loadTestsFromName(module)
 
-                all_tests.update(unroll_test_suite(subsuite))
+                all_tests.extend(unroll_test_suite(subsuite, seen))
+
+            suite = unittest.TestSuite(group_tests(all_tests))
 
-            suite = unittest.TestSuite(list(all_tests))
+        return suite
 
-        self.stream_suite(suite)
+    def stream_results(self):
+        """Build a suite matching the requested test list, and stream it."""
+        self.stream_suite(self.load_suite(self.specified_list))
+
+
+class UnittestForkExecutor(UnittestExecutor):
+    '''
+    A version of UnittestExecutor that runs shards of the tests in
+    parallel. The test modules are imported once, then a worker is
+    forked to run each shard, sharing the imported modules.
+
+    Each worker writes to the pipes given for it in POOL_FDS_ENV
+    (see cricket.executor.start_pool).
+    '''
+    def __init__(self, shards):
+        super(UnittestForkExecutor, self).__init__()
+        self.shards = shards
+
+    def stream_results(self):
+        """Build a suite for each shard, and stream each one from a worker."""
+        pipes.run_forked(
+            [self.load_suite(shard) for shard in self.shards],
+            run_suite=self.stream_suite,
+        )
 
 
 class UnittestCoverageExecutor(UnittestExecutor):
@@ -90,6 +140,10 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--coverage", help="Generate coverage data for the test run", action="store_true")
+    parser.add_argument(
+        "--shard", action="append", nargs="+", dest="shards", metavar="LABEL",
+        help="Test labels to run in a worker of their own.  May be repeated"
+    )
     parser.add_argument(
         'labels', nargs=argparse.REMAINDER,
         help='Test labels to run.'
@@ -97,7 +151,9 @@ if __name__ == '__main__':
 
     options = parser.parse_args()
 
-    if options.coverage:
+    if options.shards:
+        executor = UnittestForkExecutor(options.shards)
+    elif options.coverage:
         executor = UnittestCoverageExecutor()
     else:
         executor = UnittestExecutor()
@@ -1,3 +1,4 @@
+import os
 import sys
 
 from cricket.model import TestSuite, TestModule, TestCase, TestMethod
@@ -7,9 +8,12 @@ class UnittestTestSuite(TestSuite):
     def __init__(self, options=None):
         super(UnittestTestSuite, self).__init__()
 
-    def discover_commandline(self):
-        "Command line: Discover all available tests in a project."
-        return [sys.executable, '-m', 'cricket.unittest.discoverer']
+    def discover_commandline(self, labels=None):
+        "Command line: Discover all available tests in a project (or just those in labels)."
+        args = [sys.executable, '-m', 'cricket.unittest.discoverer']
+        if labels:
+            args.extend(labels)
+        return args
 
     def execute_commandline(self, labels):
         "Return the command line to execute the specified test labels"
@@ -23,6 +27,18 @@ class UnittestTestSuite(TestSuite):
 
         return args
 
+    def pool_commandline(self, shards):
+        "Return the command line to fork a worker for each shard of test labels."
+        if not hasattr(os, 'fork') or self.coverage:
+            # Coverage is only saved by the process that collected it.
+            return None
+
+        args = [sys.executable, '-m', 'cricket.unittest.executor']
+        for shard in shards:
+            args.append('--shard')
+            args.extend(shard)
+        return args
+
     def split_test_id(self, test_id):
         pathparts = test_id.split('.')
 
@@ -2,36 +2,32 @@
 
 This is the "View" of the MVC world.
 """
+from importlib.util import find_spec
 import os
 import subprocess
+import time
 try:
     from Tkinter import *
     from tkFont import *
     from ttk import *
     import tkMessageBox
+    import tkSimpleDialog as simpledialog
 except ImportError:
     from tkinter import *
     from tkinter.font import *
     from tkinter.ttk import *
     from tkinter import messagebox as tkMessageBox
-import webbrowser
-from cricket.events import debug, fix_file_path
+    from tkinter import simpledialog
+from cricket.events import debug, fix_file_path, is_debug
 
-# Check for the existence of coverage and duvet
-try:
-    import coverage
-    try:
-        import duvet
-    except ImportError:
-        duvet = None
-except ImportError:
-    coverage = None
-    duvet = None
+# Check for the existence of coverage and duvet, without the cost of importing them
+coverage = find_spec('coverage')
+duvet = find_spec('duvet') if coverage else None
 
 from tkreadonly import ReadOnlyText
 
 from cricket.model import TestMethod, TestCase, TestModule
-from cricket.executor import Executor
+from cricket.executor import Executor, format_time
 
 
 # Display constants for test status
@@ -83,6 +79,16 @@ STATUS_DEFAULT = {
 
 
 class MainWindow(object):
+    # The most tests to add to the tree in one GUI update
+    DISCOVERY_BATCH = 500
+    # Seconds to spend showing test results in one GUI update
+    FRAME_BUDGET = 0.02
+    # Milliseconds between polls of a busy and an idle test run
+    POLL_BUSY = 5
+    POLL_IDLE = 150
+    # The most lines of test output to process in one GUI update
+    POLL_LINES = 2000
+
     def __init__(self, root, options=None):
         '''
         -----------------------------------------------------
@@ -102,12 +108,14 @@ class MainWindow(object):
 
         self.options = options  # command line options
         self.executor = None    # Executor object for currently running tests
+        self.discovery = None   # Discovery object for tests being collected
         self._test_suite = None  # top of test tree
         self._save_selection = None  # save selected test list (tree, selection_list)
 
         # Root window
         self.root = root
-        self._need_update = False  # Set when we want to force a refresh
+        self._progress = None   # ProgressBatch of run changes not yet shown
+        self._poll_interval = self.POLL_BUSY  # Milliseconds until the executor is polled
         self.root.title('Cricket')
         self.root.geometry('1024x768')
 
@@ -133,10 +141,7 @@ class MainWindow(object):
         self.root.rowconfigure(2, weight=0)
 
         # Set up listeners for runner events.
-        Executor.bind('test_status_update', self.on_executorStatusUpdate)
-        Executor.bind('test_start', self.on_executorTestStart)
-        Executor.bind('test_output_update', self.on_testOutputUpdate)
-        Executor.bind('test_end', self.on_executorTestEnd)
+        Executor.bind('test_batch', self.on_executorBatch)
         Executor.bind('suite_end', self.on_executorSuiteEnd)
         Executor.bind('suite_error', self.on_executorSuiteError)
 
@@ -178,6 +183,11 @@ class MainWindow(object):
         self.menu_test.add_command(label='Run all', command=self.cmd_run_all)
         self.menu_test.add_command(label='Run selected tests', command=self.cmd_run_selected)
         self.menu_test.add_command(label='Re-run failed tests', command=self.cmd_rerun)
+        self.menu_test.add_separator()
+        self.menu_test.add_command(label='Find in output...', command=self.cmd_find_output,
+                                   accelerator='Ctrl-F')
+        self.menu_test.add_command(label='Find next', command=self.cmd_find_next_output,
+                                   accelerator='F3')
 
         #self.menu_beeware.add_command(label='Open Duvet...', 
         # command=self.cmd_open_duvet, state=DISABLED if duvet is None else ACTIVE)
@@ -295,6 +305,9 @@ class MainWindow(object):
         self.all_tests_tree.tag_bind('TestCase', '<<TreeviewSelect>>', self.on_testCaseSelected)
         self.all_tests_tree.tag_bind('TestMethod', '<<TreeviewSelect>>', self.on_testMethodSelected)
 
+        # Rows inside collapsed items are brought up to date when they are shown
+        self.all_tests_tree.bind('<<TreeviewOpen>>', self.on_nodeOpened)
+
         # The tree's vertical scrollbar
         self.all_tests_tree_scrollbar = Scrollbar(self.all_tests_tree_frame, orient=VERTICAL)
         self.all_tests_tree_scrollbar.grid(column=1, row=0, sticky=(N, S))
@@ -400,9 +413,13 @@ class MainWindow(object):
 
         self.output_scrollbar = Scrollbar(self.details_frame, orient=VERTICAL)
         self.output_scrollbar.grid(column=3, row=3, pady=5, sticky=(N, S))
-        self.output.config(yscrollcommand=self.output_scrollbar.set)
         self.output_scrollbar.config(command=self.output.yview)
 
+        # Only a window of the output is loaded; the pager handles scrolling.
+        self.output_pager = OutputPager(self.output, self.output_scrollbar)
+        self.output.bind('<Control-f>', self.cmd_find_output)
+        self.output.bind('<F3>', self.cmd_find_next_output)
+
         # Error message
         self.error_label = Label(self.details_frame, text='Error:')
         self.error_label.grid(column=0, row=4, pady=5, sticky=(N, E,))
@@ -513,8 +530,7 @@ class MainWindow(object):
         debug("view test_suite = %r", test_suite)
 
         # Get a count of active tests to display in the status bar.
-        count, labels = self.test_suite.find_tests(active=True)
-        self.run_summary.set('T:%s P:0 F:0 E:0 X:0 U:0 S:0' % count)
+        self.run_summary.set('T:%s P:0 F:0 E:0 X:0 U:0 S:0' % test_suite.active_count)
 
         # Populate the initial tree nodes. This is recursive, because
         # the tree could be of arbitrary depth.
@@ -530,17 +546,35 @@ class MainWindow(object):
         TestCase.bind('inactive', self.on_nodeInactive)
         TestMethod.bind('inactive', self.on_nodeInactive)
 
-        # Listen for new nodes added to the tree
+        # Listen for nodes added to, or removed from the tree
         TestModule.bind('new', self.on_nodeAdded)
         TestCase.bind('new', self.on_nodeAdded)
         TestMethod.bind('new', self.on_nodeAdded)
 
-        # Listen for any status updates on nodes in the tree.
-        TestMethod.bind('status_update', self.on_nodeStatusUpdate)
+        TestModule.bind('deleted', self.on_nodeDeleted)
+        TestCase.bind('deleted', self.on_nodeDeleted)
+        TestMethod.bind('deleted', self.on_nodeDeleted)
 
         # Update the test_suite to make sure coverage status matches the GUI
         self.on_coverageChange()
 
+    def discover(self, discovery):
+        """Add the tests found by a Discovery to the tree as they arrive.
+
+        If discovery is None, the test suite is already up to date.
+        """
+        self.discovery = discovery
+        if discovery is None:
+            self._set_discovered()
+            return
+
+        self.run_status.set('Discovering tests...')
+        self.run_all_button.configure(state=DISABLED)
+        self.run_selected_button.configure(state=DISABLED)
+        self.rerun_button.configure(state=DISABLED)
+
+        self.root.after(0, self.on_discoveryProgress)
+
     ######################################################
     # TK Main loop
     ######################################################
@@ -556,6 +590,8 @@ class MainWindow(object):
         "Command: Quit"
         # If the runner is currently running, kill it.
         self.stop()
+        if self.discovery:
+            self.discovery.terminate()
 
         self.root.quit()
 
@@ -587,6 +623,24 @@ class MainWindow(object):
         if not self.executor or not self.executor.is_running:
             self.run(status=set(TestMethod.FAILING_STATES))
 
+    def cmd_find_output(self, event=None):
+        "Command: Search the output of the selected test"
+        text = simpledialog.askstring(
+            'Find in output', 'Find:',
+            initialvalue=self.output_pager.search_text or '',
+            parent=self.root
+        )
+        if text:
+            self.output_pager.search_text = text
+            self.cmd_find_next_output()
+        return 'break'
+
+    def cmd_find_next_output(self, event=None):
+        "Command: Find the next match in the output of the selected test"
+        if self.output_pager.search_text and not self.output_pager.find_next():
+            self.run_status.set('%r not found in output.' % self.output_pager.search_text)
+        return 'break'
+
     def cmd_show_cov(self, event=None):
         pass
 
@@ -599,19 +653,23 @@ class MainWindow(object):
 
     def cmd_cricket_page(self):
         "Show the Cricket project page"
+        import webbrowser
         webbrowser.open_new('http://pybee.org/cricket/')
 
     def cmd_beeware_page(self):
         "Show the Beeware project page"
+        import webbrowser
         webbrowser.open_new('http://pybee.org/')
 
     def cmd_cricket_github(self):
         "Show the Cricket GitHub repo"
+        import webbrowser
         #webbrowser.open_new('http://github.com/pybee/cricket')
         webbrowser.open_new('http://github.com/Daniel-Christian-CardinalPeak/cricket')
 
     def cmd_cricket_docs(self):
         "Show the Cricket documentation"
+        import webbrowser
         webbrowser.open_new('https://cricket.readthedocs.io/')
 
     ######################################################
@@ -690,15 +748,15 @@ class MainWindow(object):
 
             # Show output as test is running
             if ((testMethod.status != testMethod.STATUS_UNKNOWN)
-                or testMethod.output or testMethod.error):
+                or testMethod.output_length or testMethod.error):
                 # Test has been executed, so show status windows
                 if testMethod._duration is not None:
                     self.duration.set('%0.3fs' % testMethod._duration)
                 else:
                     self.duration.set('')
 
-                if testMethod.output:
-                    self._show_test_output(testMethod.output)
+                if testMethod.output_length:
+                    self._show_test_output(testMethod)
                 else:
                     self._hide_test_output()
 
@@ -727,28 +785,40 @@ class MainWindow(object):
         # update "run selected" button enabled state
         self.set_selected_button_state()
 
-    def on_nodeAdded(self, node):
+    def on_nodeAdded(self, node, parent, index):
         "Event handler: a new node has been added to the tree"
-        self.all_tests_tree.insert(
-            node.parent.path, 'end', node.path,
-            text=node.name,
-            tags=[node.__class__.__name__, 'active'],
-            open=True
-        )
+        if not self.all_tests_tree.exists(node.path):
+            self.all_tests_tree.insert(
+                parent.path or '', index, node.path,
+                text=node.name,
+                tags=[node.__class__.__name__, 'active'],
+                open=True
+            )
+
+    def on_nodeDeleted(self, node):
+        "Event handler: a node has been removed from the tree"
+        for tree in (self.all_tests_tree, self.problem_tests_tree):
+            if tree.exists(node.path):
+                tree.delete(node.path)
 
     def on_nodeActive(self, node):
-        "Event handler: a node on the tree has been made active"
-        self.all_tests_tree.item(node.path, tags=[node.__class__.__name__, 'active'])
+        "Event handler: a node on the tree, and everything below it, has been made active"
         self.all_tests_tree.item(node.path, open=True)
+        self._refresh_active_rows(node)
 
     def on_nodeInactive(self, node):
-        "Event handler: a node on the tree has been made inactive"
-        self.all_tests_tree.item(node.path, tags=[node.__class__.__name__, 'inactive'])
+        "Event handler: a node on the tree, and everything below it, has been made inactive"
         self.all_tests_tree.item(node.path, open=False)
+        self._refresh_active_rows(node)
+
+    def on_nodeOpened(self, event):
+        "Event handler: an item on the tree has been expanded"
+        node = self.test_suite.get_node_from_label(event.widget.focus())
+        for child in node._child_nodes.values():
+            self._refresh_rows(child)
 
-    def on_nodeStatusUpdate(self, event, node):
-        """Event handler: a node on the tree has received a status update. 
-        Handles status_update"""
+    def _show_test_status(self, node):
+        "A test on the tree has a new result; show it on the trees"
         self.all_tests_tree.item(node.path, tags=['TestMethod', STATUS[node.status]['tag']])
 
         if node.status in TestMethod.FAILING_STATES:
@@ -795,97 +865,59 @@ class MainWindow(object):
         "Event handler: when the coverage checkbox has been toggled"
         self.test_suite.coverage = self.coverage.get() == '1'
 
-    def on_testProgress(self):
-        "Event handler: a periodic update to poll the runner for output, generating GUI updates"
-        if self.executor and self.executor.poll():
-            self.root.after(50, self.on_testProgress)
-            if self._need_update:
-                self.root.update()  # force update on rapid changes
-                self._need_update = False
-
-    def on_executorStatusUpdate(self, event, update):
-        """The executor has some progress to report.  Handles test_status_update"""
-        # Update the status line with output that isn't tied to a running test
-        self.run_status.set(update)
-
-    def on_executorTestStart(self, event, test_path):
-        """The executor has started running a new test.  Handles test_start"""
-        # Update status line, and set the tree item to active.
-        self.run_status.set('Running %s...' % test_path)
-        try:
-            self.all_tests_tree.item(test_path, tags=['TestMethod', 'active'])
-            self.current_test_tree.selection_set((test_path, ))  # select only current test
-            debug("Set selection to: %r", test_path)             # DEBUG
-            self._need_update = True  # request a display update
-        except TclError:
-            debug("INTERNAL ERROR trying to set tags on %r", test_path)
-
-    def on_testOutputUpdate(self, event, test_path, new_text, was_empty):
-        """A running test got output.  Handles test_output_update"""
-        current_tree = self.current_test_tree
-        if ((len(current_tree.selection()) != 1)
-            or (current_tree.selection()[0] != test_path)):  # do nothing if not selected
-            debug("test_output_update: not selected")        # DEBUG
+    def on_discoveryProgress(self):
+        "Event handler: a periodic update to add newly discovered tests to the tree"
+        if self.discovery.poll(limit=self.DISCOVERY_BATCH):
+            self.run_status.set('Discovering tests... collected %d' % self.discovery.count)
+            self.root.after(10, self.on_discoveryProgress)
             return
 
-        if was_empty:
-            # trigger selection event to refresh result page, displaying output box
-            # In this case, testMethod.output will be used, new_text is ignored
-            debug("test_output_update: re-selecting to show output")        # DEBUG
-            current_tree.selection_set(current_tree.selection())
-        else:
-            self.output.insert(END, new_text)  # insert new contents at end
-            # TODO: detect if user has changed position and don't scroll
-            self.output.see(END)               # scroll to bottom
-
-        self._need_update = True  # request a display update
-
-    def on_executorTestEnd(self, event, test_path, result, remaining_time):
-        """The executor has finished running a test. Handles test_end"""
-        # Update the progress meter
-        self.progress_value.set(self.progress_value.get() + 1)
-
-        self._set_run_summary(remaining_time)  # Update the run summary
-
-        if self.options and self.options.save:  # write output to a file
-            testMethod = self.test_suite.get_node_from_label(test_path)
-
-            if testMethod.output:
-                fpath = self.options.save
-                if '<TESTNAME>' in fpath:
-                    fpath = fpath.replace('<TESTNAME>', testMethod._name)
-                fpath = fix_file_path(fpath)  # handles DATETIME and slashes
-                add2 = os.path.exists(fpath)
-                debug("Writing output to %r", fpath)
-                with open(fpath, 'a') as fd:
-                    if add2:
-                        print("================", file=fd)  # TODO: insert result, time, etc
-                    fd.write(testMethod.output)
-
-        # If the test that just fininshed is the one (and only one)
-        # selected on the tree, update the display.
-        current_tree = self.current_test_tree
-        if len(current_tree.selection()) == 1:
-            # One test selected.
-            if current_tree.selection()[0] == test_path:
-                # If the test that just finished running is the selected
-                # test, force reset the selection, which will generate a
-                # selection event, forcing a refresh of the result page.
-                debug("on_executorTestEnd: re-selecting to show output")  # DEBUG
-                current_tree.selection_set(current_tree.selection())
-        else:
-            # No or Multiple tests selected
-            self.name.set('')
-            self.test_status.set('')
+        # Discovery is complete.
+        discovery = self.discovery
+        self.discovery = None
 
-            self.duration.set('')
-            self.description.delete('1.0', END)
+        if discovery.failed:
+            # Nothing could be loaded; offer to try again.
+            dialog = TestLoadErrorDialog(self.root, '\n'.join(discovery.errors))
+            if dialog.status == dialog.OK:
+                self.discover(self.test_suite.start_refresh(rediscover=True))
+            return
 
-            self._hide_test_output()
-            self._hide_test_errors()
+        if self.test_suite.errors:
+            dialog = IgnorableTestLoadErrorDialog(self.root, '\n'.join(self.test_suite.errors))
+            if dialog.status == dialog.CANCEL:
+                self.root.quit()
+                return
+
+        self._set_discovered()
+
+    def on_testProgress(self):
+        "Event handler: a periodic update to poll the runner for output, generating GUI updates"
+        if self.executor and self.executor.poll(limit=self.POLL_LINES):
+            self._show_progress(self.FRAME_BUDGET)
+
+            # Poll again straight away while there is work to do;
+            # back off while the tests are quiet.
+            queue_depth = self.executor.queue_depth
+            if queue_depth or self.executor.lines_read or self._progress is not None:
+                self._poll_interval = self.POLL_BUSY
+            else:
+                self._poll_interval = min(self._poll_interval * 2, self.POLL_IDLE)
+            debug("Poll: %d lines read, %d queued, next in %dms",
+                  self.executor.lines_read, queue_depth, self._poll_interval)
+            self.root.after(self._poll_interval, self.on_testProgress)
+
+    def on_executorBatch(self, event, batch):
+        """The executor has seen changes to the test run.  Handles test_batch"""
+        # Nothing is drawn yet; changes are shown in the next GUI update.
+        if self._progress is None:
+            self._progress = batch
+        else:
+            self._progress.merge(batch)
 
     def on_executorSuiteEnd(self, event, error=None):
         """The test suite finished running.  Handles suite_end"""
+        self._show_progress()  # Catch up with the last results
         # Display the final results
         self.run_status.set('Finished.')
 
@@ -901,7 +933,7 @@ class MainWindow(object):
             '%d %s' % (count, TestMethod.STATUS_LABELS[state])
             for state, count in sorted(self.executor.result_count.items()))
 
-        dialog(message=message or 'No tests were ran')
+        dialog(message=message or 'No tests were run')
 
         self._set_run_summary()  # Reset the run summary
 
@@ -917,6 +949,7 @@ class MainWindow(object):
 
     def on_executorSuiteError(self, event, error):
         """An error occurred running the test suite.  Handles suite_error"""
+        self._show_progress()  # Catch up with the last results
         # Display the error in a dialog
         self.run_status.set('Error running test suite.')
         FailedTestDialog(self.root, error)
@@ -938,7 +971,7 @@ class MainWindow(object):
             self.rerun_button.configure(state=DISABLED)
 
     def set_selected_button_state(self):
-        if self.executor and self.executor.is_running:
+        if self.discovery is not None or (self.executor and self.executor.is_running):
             self.run_selected_button.configure(state=DISABLED)
         elif self.current_test_tree.selection():
             self.run_selected_button.configure(state=NORMAL)
@@ -958,6 +991,10 @@ class MainWindow(object):
         If labels is provided, only tests with those labels will
             be executed
         """
+        if self.discovery is not None:
+            # The tree isn't complete yet.
+            return
+
         count, labels = self.test_suite.find_tests(active=active, status=status, labels=labels)
         #count, labels = self.test_suite.find_tests(active, status, labels)
         self.run_status.set('Running...')
@@ -972,10 +1009,23 @@ class MainWindow(object):
         self.progress_value.set(0)
 
         # Create the runner
-        self.executor = Executor(self.test_suite, count, labels)
+        workers = self.options.workers if self.options else 1
+        try:
+            self.executor = Executor(self.test_suite, count, labels, workers=workers)
+        except OSError as e:
+            # e.g., the command line was too long for the OS.
+            self.executor = None
+            self.run_status.set('Error running test suite.')
+            tkMessageBox.showerror(message='Unable to start the tests: %s' % e)
+            self.reset_button_states_on_end()
+            return
+
+        # Show how the tests were balanced across the workers.
+        self._set_run_summary()
 
         # Queue the first progress handling event
-        self.root.after(50, self.on_testProgress)
+        self._poll_interval = self.POLL_BUSY
+        self.root.after(self._poll_interval, self.on_testProgress)
 
     def stop(self):
         "Stop the test suite."
@@ -983,6 +1033,7 @@ class MainWindow(object):
             self.run_status.set('Stopping...')
 
             self.executor.terminate()
+            self._show_progress()
             self.executor = None
 
             self.run_status.set('Stopped.')
@@ -991,15 +1042,15 @@ class MainWindow(object):
 
     def _hide_test_output(self):
         "Hide the test output panel on the test results page"
+        self.output_pager.show(None)
         self.output_label.grid_remove()
         self.output.grid_remove()
         self.output_scrollbar.grid_remove()
         self.details_frame.rowconfigure(3, weight=0)
 
-    def _show_test_output(self, content):
+    def _show_test_output(self, testMethod):
         "Show the test output panel on the test results page"
-        self.output.delete('1.0', END)  # clear contents
-        self.output.insert('1.0', content)  # insert new contents
+        self.output_pager.show(testMethod)
 
         self.output_label.grid()  # enable in window?
         self.output.grid()
@@ -1021,6 +1072,140 @@ class MainWindow(object):
         self.error.grid()
         self.error_scrollbar.grid()
 
+    def _set_discovered(self):
+        "Discovery is complete; show the total, and allow tests to run."
+        count = self.test_suite.active_count
+        self.run_status.set('Collected %d tests.' % count)
+        self.run_summary.set('T:%s P:0 F:0 E:0 X:0 U:0 S:0' % count)
+
+        self.run_all_button.configure(state=NORMAL)
+        self.set_selected_button_state()
+
+        if is_debug():
+            count, labels = self.test_suite.find_tests(allow_all=True)
+            debug("Found %d tests:", count)
+            debug("%s", '\n'.join(labels))
+
+    def _node_tags(self, node):
+        "Return the tags for the tree row that shows a node."
+        if not node.active:
+            return [node.__class__.__name__, 'inactive']
+        if isinstance(node, TestMethod) and node.status != TestMethod.STATUS_UNKNOWN:
+            return ['TestMethod', STATUS[node.status]['tag']]
+        return [node.__class__.__name__, 'active']
+
+    def _refresh_active_rows(self, node):
+        """Bring the rows for a node whose active state changed up to date.
+
+        The parents of the node may have changed as well. Below the
+        node, only rows that can be seen are updated; the rows inside
+        a collapsed item are updated when it is opened.
+        """
+        parent = node._parent
+        while parent is not None and parent.path is not None:
+            self.all_tests_tree.item(parent.path, tags=self._node_tags(parent))
+            parent = parent._parent
+        self._refresh_rows(node)
+
+    def _refresh_rows(self, node):
+        "Update the row for a node, and every row below it that can be seen."
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            self.all_tests_tree.item(node.path, tags=self._node_tags(node))
+            if node.can_have_children() and self.all_tests_tree.item(node.path, 'open'):
+                pending.extend(node._child_nodes.values())
+
+    def _show_progress(self, budget=None):
+        """Show the changes to the test run that haven't been shown yet.
+
+        Only the latest state of each test is drawn. If `budget` is
+        given, rows are updated for at most that many seconds; the rest
+        wait for the next update.
+        """
+        progress = self._progress
+        if progress is None:
+            return
+        if budget is not None:
+            deadline = time.perf_counter() + budget
+
+        # Changes to the run as a whole are cheap; show them all.
+        if progress.status_update is not None:
+            self.run_status.set(progress.status_update)
+        if progress.last_started is not None:
+            self.run_status.set('Running %s...' % progress.last_started)
+
+        if progress.ended:
+            self.progress_value.set(self.progress_value.get() + len(progress.ended))
+            self._set_run_summary(progress.remaining_time)
+            if self.options and self.options.save:
+                for path in progress.ended:
+                    self._save_test_output(self.test_suite.get_node_from_label(path))
+
+        # Update the details of the selected test.
+        current_tree = self.current_test_tree
+        selection = current_tree.selection()
+        if progress.last_started in progress.running:
+            try:
+                current_tree.selection_set((progress.last_started, ))  # select only current test
+                debug("Set selection to: %r", progress.last_started)
+            except TclError:
+                debug("INTERNAL ERROR trying to select %r", progress.last_started)
+        elif len(selection) == 1:
+            path = selection[0]
+            shown = self.output_pager.test
+            if path in progress.ended or (path in progress.output and (shown is None or shown.path != path)):
+                # Reset the selection, which will generate a selection
+                # event, forcing a refresh of the result page.
+                debug("_show_progress: re-selecting to show output")
+                current_tree.selection_set(selection)
+            elif path in progress.output:
+                self.output_pager.update()
+        elif progress.ended:
+            # No or Multiple tests selected
+            self.name.set('')
+            self.test_status.set('')
+
+            self.duration.set('')
+            self.description.delete('1.0', END)
+
+            self._hide_test_output()
+            self._hide_test_errors()
+
+        progress.status_update = progress.last_started = progress.remaining_time = None
+        progress.ended = []
+        progress.output = set()
+
+        # Update the rows of the tests, until the time runs out.
+        tests = progress.tests
+        for path in list(tests):
+            if budget is not None and time.perf_counter() > deadline:
+                debug("%d test rows left for the next update", len(tests))
+                return
+            node = tests.pop(path)
+            if path in progress.running:
+                try:
+                    self.all_tests_tree.item(path, tags=['TestMethod', 'active'])
+                except TclError:
+                    debug("INTERNAL ERROR trying to set tags on %r", path)
+            else:
+                self._show_test_status(node)
+        self._progress = None
+
+    def _save_test_output(self, testMethod):
+        "Write the output of a test to the file given by --save"
+        if testMethod.output_length:
+            fpath = self.options.save
+            if '<TESTNAME>' in fpath:
+                fpath = fpath.replace('<TESTNAME>', testMethod._name)
+            fpath = fix_file_path(fpath)  # handles DATETIME and slashes
+            add2 = os.path.exists(fpath)
+            debug("Writing output to %r", fpath)
+            with open(fpath, 'a') as fd:
+                if add2:
+                    print("================", file=fd)  # TODO: insert result, time, etc
+                fd.write(testMethod.output)
+
     def _set_run_summary(self, remaining_time=None):
         """Update run summary with latest details."""
         format_string = \
@@ -1035,13 +1220,192 @@ class MainWindow(object):
             'skip': self.executor.result_count.get(TestMethod.STATUS_SKIP, 0),
         }
 
+        planned = self.executor.planned_durations
+        if len(planned) > 1:
+            # The status line shows the running tests; keep the plan here.
+            format_string += ', %(workers)d workers ~%(planned)s planned'
+            data['workers'] = len(planned)
+            data['planned'] = format_time(max(planned))
+
         if remaining_time is not None:
             format_string += ', ~%(remaining)s remaining'
             data['remaining'] = remaining_time
 
+        queue_depth = self.executor.queue_depth
+        if queue_depth:
+            # The display is behind the tests.
+            format_string += ', %(queued)d lines queued'
+            data['queued'] = queue_depth
+
         self.run_summary.set(format_string % data)
 
 
+class OutputPager(object):
+    """Shows a window onto the output of a test in a Text widget.
+
+    Test output can be far too big to put in a Text widget in one go.
+    The pager loads the end of the output first, and loads more a page
+    at a time as the widget is scrolled to the top or bottom of what
+    is loaded. Pages at the other end are dropped to keep the widget
+    small. Searches read the test's output, not the widget.
+
+    `loaded` is (start, end): the character offsets of the output in
+    the widget.
+    """
+    PAGE_SIZE = 64 * 1024       # Characters loaded at a time
+    MAX_LOADED = 4 * PAGE_SIZE  # Characters kept in the widget
+
+    def __init__(self, text, scrollbar):
+        self.text = text
+        self.scrollbar = scrollbar
+        self.test = None            # TestMethod whose output is shown
+        self.loaded = (0, 0)
+        self.search_text = None     # Last text searched for
+        self._search_from = 0       # Offset to search from next
+        self._length = 0            # Length of the output when it was last checked
+        self._scroll_pending = False
+
+        self.text.config(yscrollcommand=self.on_scroll)
+        self.text.tag_configure('found', background='yellow')
+
+    def show(self, test):
+        "Show the end of the output of a test."
+        self.test = test
+        self._search_from = 0
+        self.text.delete('1.0', END)
+        if test is None:
+            self.loaded = (0, 0)
+            return
+
+        length = test.output_length
+        start = self._line_start(length - self.PAGE_SIZE)
+        self.text.insert('1.0', test.read_output(start, length))
+        self.loaded = (start, length)
+        self._length = length
+        self.text.see(END)
+
+    def update(self):
+        "The test being shown may have more output; add it if the end is loaded."
+        if self.test is None:
+            return
+        start, end = self.loaded
+        length = self.test.output_length
+        if length < end:
+            # The output has been replaced.
+            self.show(self.test)
+            return
+
+        if end >= self._length and length > end:
+            at_bottom = self.text.yview()[1] >= 1.0
+            self.text.insert(END, self.test.read_output(end, length))
+            self.loaded = (start, length)
+            if length - start > self.MAX_LOADED:
+                self._drop_top()
+            if at_bottom:
+                self.text.see(END)
+        # Otherwise the end isn't loaded; it will be when scrolled to.
+        self._length = length
+
+    def on_scroll(self, first, last):
+        "The widget has scrolled; load more output if an end has been reached."
+        self.scrollbar.set(first, last)
+        if self.test is None or self._scroll_pending:
+            return
+        start, end = self.loaded
+        if (float(first) <= 0.0 and start > 0) or (float(last) >= 1.0 and end < self.test.output_length):
+            # Don't change the widget while it is telling us about a change.
+            self._scroll_pending = True
+            self.text.after_idle(self._load_more)
+
+    def _load_more(self):
+        self._scroll_pending = False
+        if self.test is None:
+            return
+        first, last = self.text.yview()
+        start, end = self.loaded
+        if first <= 0.0 and start > 0:
+            self._load_earlier()
+        elif last >= 1.0 and end < self.test.output_length:
+            self._load_later()
+
+    def _load_earlier(self):
+        "Load the page before the loaded output, keeping the view where it is."
+        start, end = self.loaded
+        new_start = self._line_start(start - self.PAGE_SIZE)
+        page = self.test.read_output(new_start, start)
+        self.text.insert('1.0', page)
+        self.loaded = (new_start, end)
+        # Keep the line that was at the top of the view there.
+        self.text.yview('%d.0' % (page.count('\n') + 1))
+        if end - new_start > self.MAX_LOADED:
+            self._drop_bottom()
+
+    def _load_later(self):
+        "Load the page after the loaded output."
+        start, end = self.loaded
+        new_end = min(end + self.PAGE_SIZE, self.test.output_length)
+        self.text.insert(END, self.test.read_output(end, new_end))
+        self.loaded = (start, new_end)
+        if new_end - start > self.MAX_LOADED:
+            self._drop_top()
+
+    def _drop_top(self):
+        "Remove a page's worth of lines from the top of the widget."
+        start, end = self.loaded
+        cut = self.text.index('1.0 + %d chars linestart' % self.PAGE_SIZE)
+        dropped = len(self.text.get('1.0', cut))
+        self.text.delete('1.0', cut)
+        self.loaded = (start + dropped, end)
+
+    def _drop_bottom(self):
+        "Remove a page's worth of lines from the bottom of the widget."
+        start, end = self.loaded
+        cut = self.text.index('end - %d chars linestart' % self.PAGE_SIZE)
+        dropped = len(self.text.get(cut, 'end - 1 char'))
+        self.text.delete(cut, END)
+        self.loaded = (start, end - dropped)
+
+    def _line_start(self, offset):
+        "Return the offset of the start of the first line at or after `offset`."
+        if offset <= 0:
+            return 0
+        newline = self.test.find_output('\n', offset - 1)
+        if newline < 0 or newline - offset > self.PAGE_SIZE:
+            # No line break nearby; start mid-line.
+            return offset
+        return newline + 1
+
+    def find_next(self):
+        """Find the next occurrence of search_text, wrapping around at the end.
+
+        Returns True if it was found.
+        """
+        if self.test is None:
+            return False
+        found = self.test.find_output(self.search_text, self._search_from)
+        if found < 0 and self._search_from > 0:
+            found = self.test.find_output(self.search_text, 0)
+        if found < 0:
+            return False
+
+        self._search_from = found + 1
+        start, end = self.loaded
+        if not (start <= found and found + len(self.search_text) <= end):
+            # Load the output around the match.
+            start = self._line_start(found - self.PAGE_SIZE // 2)
+            end = min(start + 2 * self.PAGE_SIZE, self.test.output_length)
+            end = max(end, found + len(self.search_text))
+            self.text.delete('1.0', END)
+            self.text.insert('1.0', self.test.read_output(start, end))
+            self.loaded = (start, end)
+
+        index = '1.0 + %d chars' % (found - start)
+        self.text.tag_remove('found', '1.0', END)
+        self.text.tag_add('found', index, '%s + %d chars' % (index, len(self.search_text)))
+        self.text.see(index)
+        return True
+
+
 class StackTraceDialog(Toplevel):
     OK = 1
     CANCEL = 2
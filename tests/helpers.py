@@ -0,0 +1,42 @@
+"""Helpers shared by the tests of each test system."""
+import time
+
+from cricket.executor import Executor
+
+
+class ExecutorRun:
+    "The events an Executor emitted while run_executor() polled it."
+    def __init__(self):
+        self.started = []       # Paths of the tests started, in order
+        self.ended = []         # Paths of the test results, in order
+        self.batched = []       # Paths of the test results, as reported in batches
+        self.suite_ends = []    # The error output of each suite end
+        self.suite_errors = []  # The error output of each suite error
+
+
+def run_executor(testcase, executor, limit=None, timeout=60):
+    """Poll an executor until it has finished running its tests.
+
+    Fails `testcase` if the executor doesn't finish within `timeout`
+    seconds, or doesn't end the suite exactly once.
+
+    Returns an ExecutorRun of the events that were emitted.
+    """
+    run = ExecutorRun()
+    Executor.bind('test_start', lambda event, test_path: run.started.append(test_path))
+    Executor.bind('test_end', lambda event, test_path, result, remaining_time: run.ended.append(test_path))
+    Executor.bind('test_batch', lambda event, batch: run.batched.extend(batch.ended))
+    Executor.bind('suite_end', lambda event, error=None: run.suite_ends.append(error))
+    Executor.bind('suite_error', lambda event, error: run.suite_errors.append(error))
+    try:
+        deadline = time.time() + timeout
+        while executor.poll(limit=limit):
+            testcase.assertLess(time.time(), deadline, "Executor never finished")
+            time.sleep(0.01)
+    finally:
+        executor.terminate()
+        Executor._events.pop(Executor, None)
+
+    testcase.assertEqual(run.suite_errors, [])
+    testcase.assertEqual(len(run.suite_ends), 1)
+    return run
@@ -0,0 +1,188 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from cricket.cache import DiscoveryCache, find_files
+from cricket.unittest.model import UnittestTestSuite
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DIR = os.path.join(ROOT_DIR, 'sample', 'unittest')
+
+NEW_TEST_FILE = '''
+from unittest import TestCase
+
+
+class NewTests(TestCase):
+    def test_new(self):
+        pass
+'''
+
+
+class DiscoveryCacheTests(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, path, content=''):
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_no_cache(self):
+        "A missing cache can't be loaded"
+        self.assertFalse(DiscoveryCache('UnittestTestSuite').load())
+
+    def test_round_trip(self):
+        "The cache can be saved and loaded again"
+        self.write('test_thing.py')
+        cache = DiscoveryCache('UnittestTestSuite')
+        cache.update('test_thing.py', ['test_thing.Tests.test_a'])
+        cache.save()
+
+        cache = DiscoveryCache('UnittestTestSuite')
+        self.assertTrue(cache.load())
+        self.assertEqual(cache.tests(), ['test_thing.Tests.test_a'])
+        self.assertEqual(cache.changed_files(['test_thing.py']), ([], []))
+
+    def test_other_test_system(self):
+        "A cache written for a different test system is ignored"
+        cache = DiscoveryCache('UnittestTestSuite')
+        cache.save()
+        self.assertFalse(DiscoveryCache('PyTestTestSuite').load())
+
+    def test_changed_files(self):
+        "New, modified and deleted files are all detected"
+        self.write('test_same.py')
+        self.write('test_modified.py')
+        self.write('test_deleted.py')
+        cache = DiscoveryCache('UnittestTestSuite')
+        for path in ('test_same.py', 'test_modified.py', 'test_deleted.py'):
+            cache.update(path, [])
+
+        self.write('test_modified.py', 'more content')
+        self.write('test_new.py')
+        os.remove('test_deleted.py')
+
+        changed, removed = cache.changed_files(['test_same.py', 'test_modified.py', 'test_new.py'])
+        self.assertEqual(sorted(changed), ['test_modified.py', 'test_new.py'])
+        self.assertEqual(removed, ['test_deleted.py'])
+
+    def test_config_changed(self):
+        "Any change to the set of configuration files is detected"
+        self.write('conftest.py')
+        cache = DiscoveryCache('PyTestTestSuite')
+        cache.update_config(['conftest.py'])
+        self.assertFalse(cache.config_changed(['conftest.py']))
+
+        self.write('conftest.py', 'import pytest')
+        self.assertTrue(cache.config_changed(['conftest.py']))
+        self.assertTrue(cache.config_changed([]))
+
+    def test_mark_stale(self):
+        "A file marked as stale is collected again, and keeps its tests"
+        self.write('test_thing.py')
+        cache = DiscoveryCache('UnittestTestSuite')
+        cache.update('test_thing.py', ['test_thing.Tests.test_a'])
+        cache.mark_stale('test_thing.py')
+
+        self.assertEqual(cache.changed_files(['test_thing.py']), (['test_thing.py'], []))
+        self.assertEqual(cache.tests(), ['test_thing.Tests.test_a'])
+
+    def test_find_files(self):
+        "Hidden and build directories are skipped"
+        self.write(os.path.join('tests', 'test_a.py'))
+        self.write(os.path.join('tests', 'helpers.py'))
+        self.write(os.path.join('.tox', 'test_b.py'))
+        self.write(os.path.join('build', 'test_c.py'))
+
+        self.assertEqual(find_files(('test*.py', )), [os.path.join('tests', 'test_a.py')])
+
+
+class CachedRefreshTests(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        self.project = os.path.join(self.tmpdir, 'project')
+        shutil.copytree(SAMPLE_DIR, self.project)
+        os.chdir(self.project)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def refresh(self):
+        suite = UnittestTestSuite()
+        suite.discovery_cache = DiscoveryCache('UnittestTestSuite')
+        with mock.patch.object(UnittestTestSuite, 'discover',
+                               autospec=True, side_effect=UnittestTestSuite.discover) as discover:
+            suite.refresh()
+        count, tests = suite.find_tests(allow_all=True)
+        return suite, sorted(tests), [call[0][1:] for call in discover.call_args_list]
+
+    def test_unchanged(self):
+        "If nothing has changed, the tree is built without running discovery"
+        suite, tests, discovered = self.refresh()
+        self.assertEqual(discovered, [()])
+        self.assertEqual(len(tests), 27)
+
+        suite, cached_tests, discovered = self.refresh()
+        self.assertEqual(discovered, [])
+        self.assertEqual(cached_tests, tests)
+
+    def test_changed(self):
+        "Only modified and new files are collected again"
+        suite, tests, discovered = self.refresh()
+
+        with open(os.path.join('tests', 'submodule', 'test_nesting.py'), 'w') as f:
+            f.write(NEW_TEST_FILE.replace('NewTests', 'NestedTests'))
+        with open(os.path.join('tests', 'test_new.py'), 'w') as f:
+            f.write(NEW_TEST_FILE)
+        os.remove(os.path.join('tests', 'test_unusual.py'))
+
+        suite, new_tests, discovered = self.refresh()
+        self.assertEqual(len(discovered), 1)
+        self.assertEqual(sorted(discovered[0][0]), [
+            'tests.submodule.test_nesting',
+            'tests.test_new',
+        ])
+
+        self.assertEqual(sorted(set(tests) - set(new_tests)), [
+            'tests.submodule.test_nesting.NestedTests.test_stuff',
+            'tests.submodule.test_nesting.NestedTests.test_things',
+            'tests.submodule.test_nesting.OtherNestedTests.test_stuff',
+            'tests.submodule.test_nesting.OtherNestedTests.test_things',
+        ] + [
+            test_id for test_id in tests if test_id.startswith('tests.test_unusual.')
+        ])
+        self.assertEqual(sorted(set(new_tests) - set(tests)), [
+            'tests.submodule.test_nesting.NestedTests.test_new',
+            'tests.test_new.NewTests.test_new',
+        ])
+
+        # The cache now reflects the changes.
+        suite, cached_tests, discovered = self.refresh()
+        self.assertEqual(discovered, [])
+        self.assertEqual(cached_tests, new_tests)
+
+    def test_discovery_error(self):
+        "A file that fails to be collected is collected again on the next startup"
+        self.refresh()
+
+        with open(os.path.join('tests', 'test_broken.py'), 'w') as f:
+            f.write('def (:\n')
+
+        for attempt in range(2):
+            suite, tests, discovered = self.refresh()
+            self.assertEqual(discovered, [(['tests.test_broken'], )])
+            self.assertTrue(suite.errors)
+            self.assertEqual(len(tests), 27)
@@ -2,12 +2,21 @@ from __future__ import print_function
 
 import json
 import os
+import argparse
+import shutil
 import subprocess
+import tempfile
 import unittest
+from unittest import mock
 
-from cricket.django.model import DjangoTestSuite
+from cricket.django.model import (
+    MIGRATIONS_PATH, DjangoTestSuite, migrations_hash, read_migrations_hashes, write_migrations_hash,
+)
+from cricket.executor import Executor
 from cricket.model import TestModule, TestCase, TestMethod
 
+from .helpers import run_executor
+
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.join(__file__)))
 SAMPLE_DIR = os.path.join(ROOT_DIR, 'sample', 'django')
@@ -266,6 +275,157 @@ class ExecutorTests(unittest.TestCase):
         self.assertEqual(results, {'OK': 5})
 
 
+class ParallelExecutorTests(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        os.chdir(SAMPLE_DIR)
+
+        self.suite = DjangoTestSuite()
+        self.suite.refresh()
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+
+    def execute(self, workers):
+        count, labels = self.suite.find_tests(labels=None)
+        executor = Executor(self.suite, count, labels, workers=workers)
+
+        run_executor(self, executor)
+        return executor
+
+    def test_forked_workers(self):
+        "Workers forked with their own test databases get the same results as one process"
+        forked = self.execute(workers=3)
+        self.assertEqual(len(forked.workers), 3)
+        self.assertEqual(len({worker.proc.pid for worker in forked.workers}), 1)
+
+        serial = self.execute(workers=1)
+        self.assertEqual(forked.result_count, serial.result_count)
+        self.assertEqual(forked.completed_count, serial.completed_count)
+
+    def test_no_pool(self):
+        "Without a pool, the tests run in one process rather than several sharing a database"
+        with mock.patch.object(self.suite, 'pool_commandline', return_value=None):
+            executor = self.execute(workers=3)
+        self.assertEqual(len(executor.workers), 1)
+        self.assertEqual(len(executor.planned_durations), 1)
+        self.assertEqual(executor.result_count, self.execute(workers=1).result_count)
+
+
+class KeepDBTests(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self.project = tempfile.mkdtemp()
+        os.chdir(self.project)
+        os.makedirs(os.path.join('app', 'migrations'))
+        for path in ('manage.py', os.path.join('app', 'models.py')):
+            with open(path, 'w') as f:
+                f.write('')
+        self.write_migration('0001_initial.py', 'operations = []')
+
+        self.suite = DjangoTestSuite(argparse.Namespace(settings=None, keepdb=True))
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self.project)
+
+    def write_migration(self, name, content):
+        with open(os.path.join('app', 'migrations', name), 'w') as f:
+            f.write(content)
+
+    def keepdb_arguments(self, clones=0):
+        "Return the options execute_commandline() (or pool_commandline(), with clones) adds for the database."
+        if clones:
+            command = self.suite.pool_commandline([['app']] * clones)
+        else:
+            command = self.suite.execute_commandline(['app'])
+        return [
+            arg for arg in command
+            if arg in ('--keepdb', '--rebuild-db') or arg.startswith('--migrations-hash=')
+        ]
+
+    def rebuilt(self, clones=0):
+        "Record the databases as rebuilt, as the test runner does once they are set up."
+        write_migrations_hash(migrations_hash(), clones=clones)
+
+    def test_off(self):
+        "The database isn't kept unless asked"
+        self.suite.keepdb = False
+        self.assertEqual(self.keepdb_arguments(), [])
+
+    def test_unchanged(self):
+        "The database is built once, then kept while the migrations are the same"
+        rebuild = ['--keepdb', '--rebuild-db', '--migrations-hash=%s' % migrations_hash()]
+        self.assertEqual(self.keepdb_arguments(), rebuild)
+
+        # Until the runner has set up the database, it is rebuilt again.
+        self.assertEqual(self.keepdb_arguments(), rebuild)
+        self.rebuilt()
+        self.assertEqual(self.keepdb_arguments(), ['--keepdb'])
+
+        # Other source files don't matter.
+        with open(os.path.join('app', 'models.py'), 'w') as f:
+            f.write('# changed')
+        self.assertEqual(self.keepdb_arguments(), ['--keepdb'])
+
+    def test_migration_changed(self):
+        "A new or edited migration rebuilds the database"
+        self.rebuilt()
+
+        self.write_migration('0002_more.py', 'operations = []')
+        self.assertEqual(self.keepdb_arguments()[:2], ['--keepdb', '--rebuild-db'])
+        self.rebuilt()
+        self.assertEqual(self.keepdb_arguments(), ['--keepdb'])
+
+        self.write_migration('0001_initial.py', 'operations = [None]')
+        self.assertEqual(self.keepdb_arguments()[:2], ['--keepdb', '--rebuild-db'])
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "needs fork")
+    def test_clones(self):
+        "The clones for parallel workers are rebuilt unless they were built with the same migrations"
+        self.rebuilt()
+        self.assertEqual(self.keepdb_arguments(clones=2)[:2], ['--keepdb', '--rebuild-db'])
+        self.rebuilt(clones=2)
+        self.assertEqual(self.keepdb_arguments(clones=2), ['--keepdb'])
+        self.assertEqual(self.keepdb_arguments(clones=3)[:2], ['--keepdb', '--rebuild-db'])
+
+        # Rebuilding just the test database leaves the clones out of date.
+        self.write_migration('0002_more.py', 'operations = []')
+        self.rebuilt()
+        self.assertEqual(self.keepdb_arguments(), ['--keepdb'])
+        self.assertEqual(self.keepdb_arguments(clones=2)[:2], ['--keepdb', '--rebuild-db'])
+
+
+class KeepDBRunTests(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        os.chdir(SAMPLE_DIR)
+
+        self.suite = DjangoTestSuite(argparse.Namespace(settings=None, keepdb=True))
+        self.suite.refresh()
+
+    def tearDown(self):
+        if os.path.exists(MIGRATIONS_PATH):
+            os.remove(MIGRATIONS_PATH)
+        os.chdir(self._cwd)
+
+    def execute(self, workers):
+        count, labels = self.suite.find_tests(labels=None)
+        run_executor(self, Executor(self.suite, count, labels, workers=workers))
+
+    def test_recorded(self):
+        "The runner records the migrations the databases were built with, once they are set up"
+        self.execute(workers=1)
+        self.assertEqual(read_migrations_hashes(), {'serial': migrations_hash()})
+
+        self.execute(workers=2)
+        self.assertEqual(read_migrations_hashes(), {
+            'serial': migrations_hash(),
+            'clone-1': migrations_hash(),
+            'clone-2': migrations_hash(),
+        })
+
+
 class SuiteSplitTests(unittest.TestCase):
     def test_split_minimal(self):
         suite = DjangoTestSuite()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cricket.history import TestHistory
+from cricket.model import TestMethod
+
+
+class TestHistoryTests(unittest.TestCase):
+    def setUp(self):
+        self.history = TestHistory(':memory:')
+
+    def tearDown(self):
+        self.history.close()
+
+    def test_empty(self):
+        "A new history knows nothing"
+        self.assertEqual(self.history.median_durations(), {})
+        self.assertIsNone(self.history.median_duration('tests.TestCase.test_method'))
+
+    def test_median(self):
+        "The expected duration of a test is the median of its recorded durations"
+        for duration in (1.0, 9.0, 2.0):
+            self.history.record('tests.TestCase.test_slow', TestMethod.STATUS_PASS, duration)
+        self.history.record('tests.TestCase.test_fast', TestMethod.STATUS_FAIL, 0.5)
+        self.history.commit()
+
+        self.assertEqual(self.history.median_durations(), {
+            'tests.TestCase.test_slow': 2.0,
+            'tests.TestCase.test_fast': 0.5,
+        })
+
+    def test_uncommitted(self):
+        "Results are only used once they have been committed"
+        self.history.median_durations()
+        self.history.record('tests.TestCase.test_method', TestMethod.STATUS_PASS, 1.0)
+        self.assertEqual(self.history.median_durations(), {})
+
+        self.history.commit()
+        self.assertEqual(self.history.median_durations(), {'tests.TestCase.test_method': 1.0})
+
+    def test_results(self):
+        "Status, duration and timestamp are kept, most recent first"
+        self.history.record('tests.TestCase.test_method', TestMethod.STATUS_FAIL, 1.0, 100.0)
+        self.history.record('tests.TestCase.test_method', TestMethod.STATUS_PASS, 2.0, 200.0)
+        self.history.commit()
+
+        self.assertEqual(self.history.results('tests.TestCase.test_method'), [
+            (TestMethod.STATUS_PASS, 2.0, 200.0),
+            (TestMethod.STATUS_FAIL, 1.0, 100.0),
+        ])
+
+    def test_old_results_discarded(self):
+        "Only the most recent results are kept for each test"
+        for timestamp in range(TestHistory.KEEP_RESULTS + 5):
+            self.history.record('tests.TestCase.test_method', TestMethod.STATUS_PASS,
+                                float(timestamp), float(timestamp))
+        self.history.record('tests.TestCase.test_other', TestMethod.STATUS_PASS, 1.0)
+        self.history.commit()
+
+        results = self.history.results('tests.TestCase.test_method')
+        self.assertEqual(len(results), TestHistory.KEEP_RESULTS)
+        self.assertEqual(results[-1][2], 5.0)
+        self.assertEqual(len(self.history.results('tests.TestCase.test_other')), 1)
+
+    def test_persistent(self):
+        "The history survives being closed and reopened"
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, '.cricket', 'history.sqlite3')
+            history = TestHistory(path)
+            history.record('tests.TestCase.test_method', TestMethod.STATUS_PASS, 3.0)
+            history.close()
+
+            history = TestHistory(path)
+            self.assertEqual(history.median_durations(), {'tests.TestCase.test_method': 3.0})
+            history.close()
+        finally:
+            shutil.rmtree(tmpdir)
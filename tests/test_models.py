@@ -1,7 +1,8 @@
 from __future__ import print_function
 
 from cricket.compat import unittest
-from cricket.model import TestModule, TestCase
+from cricket.events import EventSource
+from cricket.model import TestModule, TestCase, TestMethod
 
 # Use Unittest as a template for TestSuite behavior.
 from cricket.unittest.model import UnittestTestSuite as TestSuite
@@ -86,6 +87,92 @@ class TestTestSuite(unittest.TestCase):
             }))
 
 
+    def test_children_sorted(self):
+        "Children are kept in label order, however they are inserted"
+        project = TestSuite()
+        for test_id in [
+                'tests.TestCase.test_c',
+                'tests.TestCase.test_a',
+                'tests.TestCase.test_d',
+                'tests.TestCase.test_b',
+            ]:
+            project.put_test(test_id)
+
+        node = project['tests']['TestCase']
+        self.assertEqual(node._child_labels, ['test_a', 'test_b', 'test_c', 'test_d'])
+        self.assertEqual([node[i].name for i in range(len(node))],
+                         ['test_a', 'test_b', 'test_c', 'test_d'])
+
+        del node['test_b']
+        self.assertEqual(node._child_labels, ['test_a', 'test_c', 'test_d'])
+
+        # Deleting a missing child leaves the others alone.
+        for label in ['test_b', 'test_aa', 'test_z']:
+            with self.assertRaises(KeyError):
+                del node[label]
+        self.assertEqual(node._child_labels, ['test_a', 'test_c', 'test_d'])
+        self.assertEqual(sorted(node._child_nodes), ['test_a', 'test_c', 'test_d'])
+
+    def test_build_from_ids(self):
+        "Bulk building creates the same tree as inserting tests one at a time"
+        test_ids = [
+            'tests.FunkyTestCase.test_something_unnecessary',
+            'more_tests.JankyTestCase.test_things',
+            'more_tests.FunkyTestCase.test_this_doesnt_make_sense',
+            'more_tests.FunkyTestCase.test_this_does_make_sense',
+            'deep_tests.package.DeepTestCase.test_doo_hickey',
+            'deep_tests.package_b.DeepTestCase.test_doo_hickey',
+            'deep_tests.package.DeepTestCase.test_doo_hickey',
+        ]
+        one_at_a_time = TestSuite()
+        for test_id in test_ids:
+            one_at_a_time.put_test(test_id)
+
+        bulk = TestSuite()
+        self.assertEqual(bulk.build_from_ids(test_ids[:3]), 3)
+        self.assertEqual(bulk.build_from_ids(test_ids), 7)
+
+        self.assertEqual(self._full_tree(bulk), self._full_tree(one_at_a_time))
+        self.assertEqual(bulk._child_labels, ['deep_tests', 'more_tests', 'tests'])
+        self.assertEqual(bulk['deep_tests']._child_labels, ['package', 'package_b'])
+        self.assertEqual(
+            bulk['deep_tests']['package']['DeepTestCase']['test_doo_hickey'].path,
+            'deep_tests.package.DeepTestCase.test_doo_hickey'
+        )
+        self.assertEqual(bulk.find_tests(active=False)[0], 6)
+
+
+    def test_node_index(self):
+        "Every node can be looked up by path, until it is deleted"
+        project = TestSuite()
+        project.build_from_ids([
+            'tests.FunkyTestCase.test_something_unnecessary',
+            'deep_tests.package.DeepTestCase.test_doo_hickey',
+        ])
+        method = project['deep_tests']['package']['DeepTestCase']['test_doo_hickey']
+        self.assertIs(
+            project.get_node_from_label('deep_tests.package.DeepTestCase.test_doo_hickey'),
+            method
+        )
+        self.assertIs(project.get_node_from_label('deep_tests.package'),
+                      project['deep_tests']['package'])
+        self.assertIs(project.put_test('deep_tests.package.DeepTestCase.test_doo_hickey'),
+                      method)
+
+        project.del_test('deep_tests.package.DeepTestCase.test_doo_hickey')
+        for label in [
+                'deep_tests.package.DeepTestCase.test_doo_hickey',
+                'deep_tests.package.DeepTestCase',
+            ]:
+            with self.assertRaises(KeyError):
+                project.get_node_from_label(label)
+        self.assertEqual(sorted(project._nodes), [
+            'tests',
+            'tests.FunkyTestCase',
+            'tests.FunkyTestCase.test_something_unnecessary',
+        ])
+
+
 class FindLabelTests(unittest.TestCase):
     "Check that naming tests by labels reduces to the right runtime list."
     def setUp(self):
@@ -853,3 +940,161 @@ class FindLabelTests(unittest.TestCase):
                 'app8.package2',
             ]),
             (6, ['app8']))
+
+    def test_collapse_labels(self):
+        "Tests that make up the whole of a module or class are run by its label"
+        self.assertEqual(self.project.collapse_labels([
+                'app2.TestCase2.test_method1',
+                'app2.TestCase2.test_method2',
+                'app4.tests1.TestCase.test_method',
+                'app4.tests2.TestCase1.test_method',
+                'app4.tests2.TestCase2.test_method1',
+                'app4.tests2.TestCase2.test_method2',
+                'app6.package2.tests2.TestCase2.test_method1',
+                'app9.tests.TestCase.test_unknown',
+            ]),
+            [
+                'app2.TestCase2',
+                'app4',
+                'app6.package2.tests2.TestCase2.test_method1',
+                'app9.tests.TestCase.test_unknown',
+            ])
+        self.assertEqual(self.project.collapse_labels([]), [])
+
+
+class CountTests(unittest.TestCase):
+    "Check that the counts held by each node follow changes to the tests below it."
+    def setUp(self):
+        self.project = TestSuite()
+        self.project.refresh([
+                'app1.TestCase.test_method',
+
+                'app2.TestCase1.test_method',
+                'app2.TestCase2.test_method1',
+                'app2.TestCase2.test_method2',
+
+                'app3.package.tests.TestCase.test_method1',
+                'app3.package.tests.TestCase.test_method2',
+            ])
+
+    def test_initial_counts(self):
+        "Every test starts active, with no status"
+        self.assertEqual(self.project.test_count, 6)
+        self.assertEqual(self.project.active_count, 6)
+        self.assertEqual(self.project['app2'].test_count, 3)
+        self.assertEqual(self.project['app2']['TestCase2'].active_count, 2)
+        self.assertEqual(self.project.status_count([TestMethod.STATUS_PASS]), 0)
+
+    def test_method_active(self):
+        "Deactivating a method updates every parent"
+        method = self.project.get_node_from_label('app2.TestCase2.test_method1')
+        method.set_active(False)
+        self.assertEqual(self.project.active_count, 5)
+        self.assertEqual(self.project['app2'].active_count, 2)
+        self.assertTrue(self.project['app2']['TestCase2'].active)
+
+        self.project.get_node_from_label('app2.TestCase2.test_method2').toggle_active()
+        self.assertEqual(self.project['app2']['TestCase2'].active_count, 0)
+        self.assertFalse(self.project['app2']['TestCase2'].active)
+        self.assertTrue(self.project['app2'].active)
+        self.assertEqual(self.project.find_tests(), (4, ['app1', 'app2.TestCase1', 'app3']))
+
+        method.set_active(True)
+        self.assertTrue(self.project['app2']['TestCase2'].active)
+        self.assertEqual(self.project.active_count, 5)
+
+    def test_module_active(self):
+        "Deactivating a module deactivates everything in it"
+        self.project['app3'].set_active(False)
+        self.assertEqual(self.project.active_count, 4)
+        self.assertEqual(self.project['app3']['package'].active_count, 0)
+        self.assertFalse(self.project['app3']['package']['tests']['TestCase'].active)
+        self.assertFalse(
+            self.project.get_node_from_label('app3.package.tests.TestCase.test_method2').active)
+        self.assertEqual(self.project.find_tests(), (4, ['app1', 'app2']))
+
+        # Activating a partially active module activates all of it
+        self.project.get_node_from_label('app3.package.tests.TestCase.test_method1').set_active(True)
+        self.assertEqual(self.project['app3'].active_count, 1)
+        self.project['app3'].set_active(True)
+        self.assertEqual(self.project['app3'].active_count, 2)
+        self.assertEqual(self.project.active_count, 6)
+        self.assertEqual(self.project.find_tests(), (6, None))
+
+    def test_status(self):
+        "Results are counted by status"
+        for label, status in [
+                ('app1.TestCase.test_method', TestMethod.STATUS_PASS),
+                ('app2.TestCase2.test_method1', TestMethod.STATUS_FAIL),
+                ('app2.TestCase2.test_method2', TestMethod.STATUS_PASS),
+            ]:
+            self.project.get_node_from_label(label).set_result(
+                description='', status=status, output='', error='', duration=0.1)
+
+        self.assertEqual(self.project.status_count([TestMethod.STATUS_PASS]), 2)
+        self.assertEqual(self.project['app2'].status_count(TestMethod.FAILING_STATES), 1)
+        self.assertEqual(
+            self.project.find_tests(status=set(TestMethod.FAILING_STATES)),
+            (1, ['app2.TestCase2.test_method1'])
+        )
+
+        # A new result replaces the old one
+        self.project.get_node_from_label('app2.TestCase2.test_method1').set_result(
+            description='', status=TestMethod.STATUS_PASS, output='', error='', duration=0.1)
+        self.assertEqual(self.project['app2'].status_count(TestMethod.FAILING_STATES), 0)
+        self.assertEqual(self.project.status_count([TestMethod.STATUS_PASS]), 3)
+        self.assertEqual(self.project.find_tests(status=set(TestMethod.FAILING_STATES)), (0, []))
+
+    def test_delete(self):
+        "Deleting tests removes them from the counts"
+        self.project.get_node_from_label('app2.TestCase1.test_method').set_result(
+            description='', status=TestMethod.STATUS_ERROR, output='', error='', duration=0.1)
+        self.project.get_node_from_label('app2.TestCase2.test_method1').set_active(False)
+
+        self.project.del_test('app2.TestCase1.test_method')
+        self.project.del_test('app2.TestCase2.test_method1')
+        self.assertEqual(self.project.test_count, 4)
+        self.assertEqual(self.project.active_count, 4)
+        self.assertEqual(self.project['app2'].test_count, 1)
+        self.assertEqual(self.project.status_count([TestMethod.STATUS_ERROR]), 0)
+
+
+class ActiveEventTests(unittest.TestCase):
+    "Check that changing the active state of a subtree is reported once."
+    def setUp(self):
+        self._events = {
+            cls: {event: list(handlers) for event, handlers in events.items()}
+            for cls, events in EventSource._events.items()
+        }
+        self.received = []
+        for NodeClass in (TestModule, TestCase, TestMethod):
+            NodeClass.bind('active', lambda node: self.received.append(('active', node.path)))
+            NodeClass.bind('inactive', lambda node: self.received.append(('inactive', node.path)))
+
+        self.project = TestSuite()
+        self.project.refresh([
+                'app1.TestCase.test_method',
+                'app2.TestCase1.test_method',
+                'app2.TestCase2.test_method1',
+                'app2.TestCase2.test_method2',
+            ])
+
+    def tearDown(self):
+        EventSource._events.clear()
+        EventSource._events.update(self._events)
+
+    def test_module(self):
+        "One event covers the module and everything in it"
+        self.project['app2'].set_active(False)
+        self.assertEqual(self.received, [('inactive', 'app2')])
+
+        self.project['app2'].set_active(False)
+        self.assertEqual(self.received, [('inactive', 'app2')])
+
+        self.project['app2'].toggle_active()
+        self.assertEqual(self.received, [('inactive', 'app2'), ('active', 'app2')])
+
+    def test_method(self):
+        "Methods report their own changes"
+        self.project.get_node_from_label('app2.TestCase2.test_method1').set_active(False)
+        self.assertEqual(self.received, [('inactive', 'app2.TestCase2.test_method1')])
@@ -0,0 +1,152 @@
+import unittest
+
+from cricket.model import TestMethod
+from cricket.output import OutputBuffer, OutputStore
+
+
+class OutputBufferTests(unittest.TestCase):
+    def test_empty(self):
+        buffer = OutputBuffer()
+        self.assertEqual(len(buffer), 0)
+        self.assertFalse(buffer)
+        self.assertEqual(buffer.getvalue(), '')
+        self.assertEqual(buffer.read(), '')
+        self.assertEqual(buffer.tail(10), '')
+
+    def test_add_lines(self):
+        buffer = OutputBuffer()
+        buffer.add_lines(['first'])
+        buffer.add_lines(['second', 'third'])
+        self.assertEqual(buffer.getvalue(), 'first\nsecond\nthird')
+        self.assertEqual(len(buffer), len('first\nsecond\nthird'))
+
+        # Reading again, and adding after reading, still works
+        self.assertEqual(str(buffer), 'first\nsecond\nthird')
+        buffer.add_lines(['fourth'])
+        self.assertEqual(buffer.getvalue(), 'first\nsecond\nthird\nfourth')
+
+    def test_read(self):
+        buffer = OutputBuffer()
+        for chunk in ['abc', 'defg', 'h', 'ijklm']:
+            buffer.append(chunk)
+        text = 'abcdefghijklm'
+
+        for start in range(len(text) + 1):
+            for end in range(start, len(text) + 2):
+                self.assertEqual(buffer.read(start, end), text[start:end], (start, end))
+        self.assertEqual(buffer.read(5), text[5:])
+        self.assertEqual(buffer.read(-3, 2), 'ab')
+
+    def test_tail(self):
+        buffer = OutputBuffer('abc')
+        buffer.append('defg')
+        self.assertEqual(buffer.tail(2), 'fg')
+        self.assertEqual(buffer.tail(5), 'cdefg')
+        self.assertEqual(buffer.tail(100), 'abcdefg')
+
+    def test_find(self):
+        buffer = OutputBuffer()
+        for chunk in ['one two ', 'three fo', 'ur five two']:
+            buffer.append(chunk)
+        self.assertEqual(buffer.find('two'), 4)
+        self.assertEqual(buffer.find('two', 5), 24)
+        self.assertEqual(buffer.find('four'), 14)
+        self.assertEqual(buffer.find('four', block_size=3), 14)
+        self.assertEqual(buffer.find('six'), -1)
+        self.assertEqual(buffer.find('two', 25), -1)
+        self.assertEqual(buffer.find(''), -1)
+
+    def test_clear(self):
+        buffer = OutputBuffer('abc')
+        buffer.clear()
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.getvalue(), '')
+
+
+class OutputStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.store = OutputStore(spill_size=100, memory_limit=250)
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_small_output(self):
+        "Small outputs stay in memory"
+        buffer = OutputBuffer('x' * 50, store=self.store)
+        self.assertEqual(buffer.memory, 50)
+        self.assertEqual(self.store.memory, 50)
+        self.assertEqual(self.store.size, 0)
+
+    def test_spill(self):
+        "Large outputs are moved to disk, and can still be read"
+        buffer = OutputBuffer(store=self.store)
+        lines = ['line %d \N{SNOWMAN}' % i for i in range(100)]
+        for line in lines:
+            buffer.add_lines([line])
+        text = '\n'.join(lines)
+
+        self.assertLess(buffer.memory, 100)
+        self.assertEqual(self.store.memory, buffer.memory)
+        self.assertGreater(self.store.size, 0)
+        self.assertEqual(len(buffer), len(text))
+        self.assertEqual(buffer.getvalue(), text)
+        self.assertEqual(buffer.tail(30), text[-30:])
+        for start, end in [(0, 10), (95, 205), (150, 160), (len(text) - 50, len(text))]:
+            self.assertEqual(buffer.read(start, end), text[start:end])
+        self.assertEqual(buffer.find('line 97', block_size=64), text.find('line 97'))
+
+        buffer.clear()
+        self.assertEqual(buffer.getvalue(), '')
+        self.assertEqual(self.store.memory, 0)
+
+    def test_evict_passing_first(self):
+        "Under the memory limit, outputs of passing tests are moved first"
+        failing = OutputBuffer('f' * 90, store=self.store)
+        passing = OutputBuffer('p' * 80, store=self.store)
+        passing.evict_first = True
+        other = OutputBuffer('o' * 70, store=self.store)
+        self.assertEqual(self.store.memory, 240)
+
+        other.append('o' * 20)
+        self.assertEqual(passing.memory, 0)
+        self.assertEqual(failing.memory, 90)
+        self.assertEqual(other.memory, 90)
+        self.assertEqual(self.store.memory, 180)
+        self.assertEqual(passing.getvalue(), 'p' * 80)
+
+
+class TestMethodOutputTests(unittest.TestCase):
+    def test_output(self):
+        method = TestMethod(None, 'tests.TestCase.test_method', 'test_method')
+        self.assertEqual(method.output, '')
+        self.assertEqual(method.output_length, 0)
+
+        for i in range(1000):
+            method.add_output(['line %d' % i])
+        method.set_result(
+            description='', status=TestMethod.STATUS_PASS,
+            output='extra\nlines', error='', duration=0.1
+        )
+
+        expected = '\n'.join(['line %d' % i for i in range(1000)] + ['extra', 'lines'])
+        self.assertEqual(method.output, expected)
+        self.assertEqual(method.output_length, len(expected))
+        self.assertEqual(method.output_tail(11), 'extra\nlines')
+        self.assertEqual(method.read_output(5, 13), '0\nline 1')
+
+    def test_output_store(self):
+        class Source:
+            output_store = OutputStore(spill_size=100)
+
+        method = TestMethod(Source, 'tests.TestCase.test_method', 'test_method')
+        try:
+            method.set_result(
+                description='', status=TestMethod.STATUS_PASS,
+                output='o' * 200, error='e' * 200, duration=0.1
+            )
+            self.assertEqual(Source.output_store.memory, 0)
+            self.assertEqual(method.output, 'o' * 200)
+            self.assertEqual(method.error, 'e' * 200)
+            self.assertTrue(method._output.evict_first)
+        finally:
+            Source.output_store.close()
@@ -2,12 +2,17 @@ from __future__ import print_function
 
 import json
 import os, sys
+import shutil
 import subprocess
+import tempfile
 import unittest
 
+from cricket.executor import Executor, TestServer
 from cricket.pytest.model import PyTestTestSuite
 from cricket.model import TestModule, TestCase, TestMethod
 
+from .helpers import run_executor
+
 try:
     import pytest_cricket
 except ImportError:
@@ -22,6 +27,7 @@ except ImportError:
             os.environ['PYTHONPATH'] = os.pathsep.join(sys.path)  # export
             #print("PYTHONPATH=", sys.path)                        # DEBUG
             break
+    import pytest_cricket
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.join(__file__)))
 SAMPLE_DIR = os.path.join(ROOT_DIR, 'sample', 'pytest')
@@ -256,6 +262,171 @@ class ExecutorTests(unittest.TestCase):
         self.assertEqual(results, {'OK': 3})
 
 
+class TestServerTests(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        os.chdir(SAMPLE_DIR)
+
+        self.suite = PyTestTestSuite()
+        self.suite.refresh()
+        self.suite.test_server = TestServer(
+            self.suite.serve_commandline(), ('*.py', ) + self.suite.CONFIG_FILE_PATTERNS)
+
+    def tearDown(self):
+        self.suite.test_server.stop()
+        os.chdir(self._cwd)
+
+    def execute(self, *labels):
+        count, labels = self.suite.find_tests(labels=list(labels))
+        executor = Executor(self.suite, count, labels)
+
+        return run_executor(self, executor).ended
+
+    def test_reused(self):
+        "The same process runs each set of tests"
+        ran = self.execute('tests/submodule/test_nesting.py')
+        self.assertEqual(ran, [
+            'tests/submodule/test_nesting.py::test_stuff',
+            'tests/submodule/test_nesting.py::test_things',
+        ])
+        pid = self.suite.test_server.proc.pid
+
+        ran = self.execute('tests/submodule/test_more_nesting.py::test_things')
+        self.assertEqual(ran, ['tests/submodule/test_more_nesting.py::test_things'])
+        self.assertEqual(self.suite.test_server.proc.pid, pid)
+        self.assertEqual(self.suite.test_server.starts, 1)
+
+    def test_restarted_on_change(self):
+        "A new process is started once a source file has changed"
+        self.execute('tests/submodule/test_nesting.py::test_stuff')
+
+        path = os.path.join('tests', 'submodule', 'test_nesting.py')
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        try:
+            ran = self.execute('tests/submodule/test_nesting.py::test_stuff')
+        finally:
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        self.assertEqual(ran, ['tests/submodule/test_nesting.py::test_stuff'])
+        self.assertEqual(self.suite.test_server.starts, 2)
+
+    def test_restarted_on_new_file(self):
+        "A new process is started once a source file has been added"
+        self.execute('tests/submodule/test_nesting.py::test_stuff')
+
+        path = os.path.join('tests', 'submodule', 'added.py')
+        with open(path, 'w') as f:
+            f.write('VALUE = 1\n')
+        try:
+            ran = self.execute('tests/submodule/test_nesting.py::test_stuff')
+        finally:
+            os.remove(path)
+
+        self.assertEqual(ran, ['tests/submodule/test_nesting.py::test_stuff'])
+        self.assertEqual(self.suite.test_server.starts, 2)
+
+    def test_options(self):
+        "The process is given the same pytest options as a single run"
+        self.suite.cli_args = {'log-cli-level': 'INFO', 'junit-xml': ''}
+        options = self.suite.execute_commandline([])[len(self.suite._pytest_exec) + 2:]
+        self.assertEqual(options, ['--log-cli-level', 'INFO'])
+        self.assertEqual(self.suite.serve_commandline()[-2:], options)
+
+    def test_restarted_after_exit(self):
+        "A new process is started if the last one has gone"
+        self.execute('tests/submodule/test_nesting.py::test_stuff')
+        self.suite.test_server.stop()
+
+        ran = self.execute('tests/submodule/test_nesting.py::test_things')
+        self.assertEqual(ran, ['tests/submodule/test_nesting.py::test_things'])
+        self.assertEqual(self.suite.test_server.starts, 2)
+
+    def test_select_items(self):
+        "Labels select the items in and under them, in collection order"
+        class Item:
+            def __init__(self, nodeid):
+                self.nodeid = nodeid
+
+        items = [Item(nodeid) for nodeid in (
+            'tests/a/test_x.py::test_one',
+            'tests/a/test_x.py::Case::test_two',
+            'tests/ab/test_y.py::test_three',
+            'test_root.py::test_four',
+        )]
+
+        def select(*labels):
+            return [item.nodeid for item in pytest_cricket.select_items(items, labels)]
+
+        self.assertEqual(len(select()), 4)
+        self.assertEqual(select('test_root.py::test_four', 'tests/a'), [
+            'tests/a/test_x.py::test_one',
+            'tests/a/test_x.py::Case::test_two',
+            'test_root.py::test_four',
+        ])
+        self.assertEqual(select('tests/a/test_x.py::Case'), ['tests/a/test_x.py::Case::test_two'])
+        self.assertEqual(select('tests/a/test_x.py::test_o'), [])
+
+
+class OutputTests(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self.project = tempfile.mkdtemp()
+        os.chdir(self.project)
+        with open('test_many.py', 'w') as f:
+            f.write(
+                'import logging\n'
+                'import pytest\n'
+                '\n'
+                '@pytest.mark.parametrize("n", range(200))\n'
+                'def test_log(n):\n'
+                '    print("before %d" % n)\n'
+                '    logging.warning("log %d", n)\n'
+                '    print("after %d" % n)\n'
+            )
+
+        self.suite = PyTestTestSuite()
+        self.suite.cli_args = {'log-cli-level': 'WARNING'}
+        self.suite.refresh()
+
+    def tearDown(self):
+        if self.suite.test_server is not None:
+            self.suite.test_server.stop()
+        os.chdir(self._cwd)
+        shutil.rmtree(self.project)
+
+    def execute(self):
+        count, labels = self.suite.find_tests(labels=None)
+        executor = Executor(self.suite, count, labels)
+        run_executor(self, executor)
+        self.assertTrue(all(worker.framed for worker in executor.workers))
+
+        for n in range(200):
+            output = self.suite.get_node_from_label('test_many.py::test_log[%d]' % n).output
+            lines = [line for line in output.split('\n') if '%d' % n in line.split()]
+            self.assertEqual(len(lines), 3, output)
+            self.assertEqual(lines[0], 'before %d' % n)
+            self.assertIn('log %d' % n, lines[1])
+            self.assertEqual(lines[2], 'after %d' % n)
+
+    def test_framed_output(self):
+        "Printed and live logged output goes with the test that wrote it"
+        self.execute()
+
+    def test_server_output(self):
+        "Output goes with the test that wrote it, run after run, in a test server"
+        server = TestServer(self.suite.serve_commandline(), ('*.py', ))
+        self.suite.test_server = server
+        self.execute()
+
+        # Start again from a new tree, as output is added to each run's.
+        self.suite = PyTestTestSuite()
+        self.suite.refresh()
+        self.suite.test_server = server
+        self.execute()
+        self.assertEqual(server.starts, 1)
+
+
 class SuiteSplitTests(unittest.TestCase):
     def test_split_root(self):
         suite = PyTestTestSuite()
@@ -325,6 +496,119 @@ class SuiteSplitTests(unittest.TestCase):
         )
 
 
+class SuiteShardGroupTests(unittest.TestCase):
+    def test_shares_fixtures(self):
+        "Module and class scoped fixtures, in the module or a conftest.py above it, are shared"
+        suite = PyTestTestSuite()
+        project = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(project)
+        try:
+            os.makedirs(os.path.join('tests', 'plain'))
+            os.makedirs(os.path.join('tests', 'shared'))
+            with open(os.path.join('tests', 'plain', 'test_plain.py'), 'w') as f:
+                f.write('def test_stuff():\n    pass\n')
+            with open(os.path.join('tests', 'test_module.py'), 'w') as f:
+                f.write('@pytest.fixture(scope="module")\ndef thing():\n    pass\n')
+            with open(os.path.join('tests', 'shared', 'test_shared.py'), 'w') as f:
+                f.write('def test_stuff(thing):\n    pass\n')
+            with open(os.path.join('tests', 'shared', 'conftest.py'), 'w') as f:
+                f.write("@pytest.fixture(scope='class')\ndef thing():\n    pass\n")
+
+            self.assertFalse(suite.shares_fixtures('tests/plain/test_plain.py::test_stuff'))
+            self.assertTrue(suite.shares_fixtures('tests/test_module.py::test_stuff'))
+            self.assertTrue(suite.shares_fixtures('tests/shared/test_shared.py::test_stuff'))
+
+            with open('conftest.py', 'w') as f:
+                f.write('def setup_module(module):\n    pass\n')
+            self.assertTrue(suite.shares_fixtures('tests/plain/test_plain.py::test_stuff'))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(project)
+
+    def test_group_root(self):
+        suite = PyTestTestSuite()
+        self.assertEqual(suite.shard_group('tests.py::test_stuff'), 'tests.py')
+
+    def test_group_long(self):
+        suite = PyTestTestSuite()
+        self.assertEqual(
+            suite.shard_group('tests/submodule/test_nesting.py::TestClass::test_stuff'),
+            'tests/submodule/test_nesting.py'
+        )
+
+
+class SuiteTestFileTests(unittest.TestCase):
+    def test_test_file(self):
+        suite = PyTestTestSuite()
+        self.assertEqual(
+            suite.test_file('tests/submodule/test_nesting.py::TestClass::test_stuff'),
+            os.path.join('tests', 'submodule', 'test_nesting.py')
+        )
+
+    def test_file_label(self):
+        suite = PyTestTestSuite()
+        self.assertEqual(
+            suite.file_label(os.path.join('tests', 'submodule', 'test_nesting.py')),
+            'tests/submodule/test_nesting.py'
+        )
+
+
+class SuiteSuffixTests(unittest.TestCase):
+    def setUp(self):
+        self.suite = PyTestTestSuite()
+        self.suite.build_from_ids([
+            'tests/test_gui.py::test_good',
+            'tests/test_gui.py::TestGUI::test_good',
+            'tests/submodule/test_gui.py::TestGUI::test_bad',
+            'other/test_gui.py::TestGUI::test_bad',
+        ])
+
+    def test_unique(self):
+        self.assertEqual(
+            self.suite.find_tests_suffix('test_gui.py::test_good'),
+            ['tests/test_gui.py::test_good']
+        )
+        self.assertEqual(
+            self.suite.find_tests_suffix('submodule/test_gui.py::TestGUI::test_bad'),
+            ['tests/submodule/test_gui.py::TestGUI::test_bad']
+        )
+
+    def test_ambiguous(self):
+        self.assertEqual(
+            self.suite.find_tests_suffix('test_gui.py::TestGUI::test_bad'),
+            [
+                'other/test_gui.py::TestGUI::test_bad',
+                'tests/submodule/test_gui.py::TestGUI::test_bad',
+            ]
+        )
+
+    def test_missing(self):
+        self.assertEqual(self.suite.find_tests_suffix('gui.py::test_good'), [])
+        self.assertEqual(self.suite.find_tests_suffix('test_gui.py::test_bad'), [])
+
+    def test_deleted(self):
+        self.suite.find_tests_suffix('test_good')
+        self.suite.del_test('other/test_gui.py::TestGUI::test_bad')
+        self.assertEqual(
+            self.suite.find_tests_suffix('test_gui.py::TestGUI::test_bad'),
+            ['tests/submodule/test_gui.py::TestGUI::test_bad']
+        )
+        self.assertEqual(len(self.suite._suffixes), 3)
+
+    def test_added(self):
+        self.suite.find_tests_suffix('test_good')
+        self.suite.put_test('other/test_gui.py::test_good')
+        self.assertEqual(
+            self.suite.find_tests_suffix('test_gui.py::test_good'),
+            ['other/test_gui.py::test_good', 'tests/test_gui.py::test_good']
+        )
+        self.assertEqual(
+            self.suite.find_tests_suffix('other/test_gui.py::test_good'),
+            ['other/test_gui.py::test_good']
+        )
+
+
 class SuiteJoinTests(unittest.TestCase):
     def test_join_method_unittest(self):
         suite = PyTestTestSuite()
@@ -1,13 +1,25 @@
 from __future__ import print_function
 
+import io
 import json
 import os
+import shutil
 import subprocess
+import sys
+import tempfile
+import time
 import unittest
 
+from cricket.executor import Executor
+from cricket.headless import HeadlessRunner
+from cricket.history import TestHistory
+from cricket.unittest.discoverer import consume
+from cricket.unittest.executor import group_tests, unroll_test_suite
 from cricket.unittest.model import UnittestTestSuite
 from cricket.model import TestModule, TestCase, TestMethod
 
+from .helpers import run_executor
+
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.join(__file__)))
 SAMPLE_DIR = os.path.join(ROOT_DIR, 'sample', 'unittest')
@@ -75,6 +87,73 @@ class DiscoveryTests(unittest.TestCase):
         )
 
 
+    def test_streaming_discovery(self):
+        suite = UnittestTestSuite()
+        discovery = suite.discover()
+        counts = []
+        while discovery.poll(limit=10):
+            counts.append(discovery.count)
+            time.sleep(0.01)
+
+        self.assertTrue(discovery.finished)
+        self.assertFalse(discovery.failed)
+        self.assertEqual(discovery.errors, [])
+        self.assertEqual(discovery.count, 27)
+        # No poll added more than the limit.
+        self.assertTrue(all(b - a <= 10 for a, b in zip([0] + counts, counts)))
+
+        count, labels = suite.find_tests(allow_all=True)
+        self.assertEqual(count, 27)
+        self.assertEqual(set(labels), set(discovery.found))
+
+    def test_discover_labels(self):
+        suite = UnittestTestSuite()
+        discovery = suite.discover(['tests.submodule.test_nesting'])
+        discovery.wait()
+
+        self.assertEqual(
+            sorted(discovery.found),
+            [
+                'tests.submodule.test_nesting.NestedTests.test_stuff',
+                'tests.submodule.test_nesting.NestedTests.test_things',
+                'tests.submodule.test_nesting.OtherNestedTests.test_stuff',
+                'tests.submodule.test_nesting.OtherNestedTests.test_things',
+            ]
+        )
+
+    def test_consume(self):
+        "Nested suites are walked in order"
+        First, Second = fixture_cases([])
+        suite = unittest.TestSuite([
+            unittest.TestSuite([unittest.TestSuite([First('test_b')]), Second('test_a')]),
+            unittest.TestSuite(),
+            First('test_a'),
+        ])
+
+        self.assertEqual(
+            [test._testMethodName for test in consume(suite)],
+            ['test_b', 'test_a', 'test_a'],
+        )
+
+    def test_import_times(self):
+        "The time taken to import each module can be reported"
+        suite = UnittestTestSuite()
+        runner = subprocess.Popen(
+            suite.discover_commandline() + ['--import-times', 'tests.submodule.test_nesting'],
+            stdin=None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=False,
+        )
+        output, error = runner.communicate()
+
+        self.assertEqual(len(output.decode('utf-8').splitlines()), 4)
+        self.assertEqual(
+            [line.split()[-1] for line in error.decode('utf-8').splitlines()],
+            ['tests.submodule.test_nesting'],
+        )
+
+
 class ExecutorTests(unittest.TestCase):
     def setUp(self):
         self._cwd = os.getcwd()
@@ -250,6 +329,263 @@ class ExecutorTests(unittest.TestCase):
         self.assertEqual(results, {'OK': 3})
 
 
+class ParallelExecutorTests(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        os.chdir(SAMPLE_DIR)
+
+        self.suite = UnittestTestSuite()
+        self.suite.refresh()
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+
+    def execute(self, labels, workers, limit=None, framed=True):
+        count, labels = self.suite.find_tests(labels=labels)
+        executor = Executor(self.suite, count, labels, workers=workers, framed=framed)
+
+        run = run_executor(self, executor, limit=limit)
+        self.batched = run.batched
+        return executor, run.started
+
+    def test_split_tests(self):
+        "Tests are balanced across shards, splitting modules that don't share fixtures"
+        executor = Executor.__new__(Executor)
+        executor.test_suite = self.suite
+
+        count, tests = self.suite.find_tests(allow_all=True)
+        durations = {
+            path: 10.0 if 'test_slow' in path else 1.0
+            for path in tests
+        }
+        shards, planned = executor.split_tests(tests, 3, durations)
+
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(sorted(sum(shards, [])), sorted(tests))
+        self.assertLessEqual(max(planned), 40.0)
+        for shard in shards:
+            self.assertEqual(shard, [path for path in tests if path in shard])
+
+        # The slow tests are all in one module, but it has no shared fixtures.
+        slow = [shard for shard in shards if any('test_slow' in path for path in shard)]
+        self.assertEqual(len(slow), 3)
+
+        self.assertEqual(executor.split_tests(tests, 1, durations)[0], [tests])
+        self.assertEqual(executor.split_tests([], 4, {}), ([[]], [0.0]))
+
+    def test_split_tests_fixtures(self):
+        "A module with shared fixtures is kept together, unless it is more than a worker's share"
+        executor = Executor.__new__(Executor)
+        executor.test_suite = self.suite
+        self.suite.shares_fixtures = lambda test_id: True
+
+        count, tests = self.suite.find_tests(allow_all=True)
+        unusual = [path for path in tests if path.startswith('tests.test_unusual.')]
+        shards, planned = executor.split_tests(tests, 2, {})
+        self.assertEqual(sorted(planned), [13.0, 14.0])
+        shard = [shard for shard in shards if unusual[0] in shard][0]
+        self.assertEqual([path for path in shard if path in unusual], unusual)
+
+        # Too slow for one worker; each piece still runs a part of the module in order.
+        durations = {
+            path: 10.0 if 'test_slow' in path else 1.0
+            for path in tests
+        }
+        shards, planned = executor.split_tests(tests, 3, durations)
+        slow = [shard for shard in shards if any('test_slow' in path for path in shard)]
+        self.assertGreater(len(slow), 1)
+        self.assertEqual(sorted(sum(shards, [])), sorted(tests))
+
+    def test_run_all_parallel(self):
+        "Results from every worker are merged into one run"
+        executor, started = self.execute(None, workers=3)
+
+        self.assertEqual(len(executor.workers), 3)
+        self.assertEqual(executor.total_count, 27)
+        self.assertEqual(len(started), 27)
+        self.assertEqual(executor.completed_count, 32)  # subtests report separately
+        self.assertEqual(len(self.batched), 32)
+        self.assertEqual(executor.any_failed, 7)
+        self.assertEqual(executor.result_count, {
+            TestMethod.STATUS_PASS: 23,
+            TestMethod.STATUS_FAIL: 5,
+            TestMethod.STATUS_ERROR: 1,
+            TestMethod.STATUS_EXPECTED_FAIL: 1,
+            TestMethod.STATUS_UNEXPECTED_SUCCESS: 1,
+            TestMethod.STATUS_SKIP: 1,
+        })
+
+    def test_result_protocols(self):
+        "Results are the same on a pipe of their own, or mixed in with stdout"
+        framed, started = self.execute(None, workers=2)
+        self.assertTrue(all(worker.framed for worker in framed.workers))
+
+        lines, started = self.execute(None, workers=2, framed=False)
+        self.assertFalse(any(worker.framed for worker in lines.workers))
+
+        self.assertEqual(framed.result_count, lines.result_count)
+        self.assertEqual(framed.completed_count, lines.completed_count)
+
+    def test_forked_workers(self):
+        "Workers forked from one process get the same results as separate processes"
+        forked, started = self.execute(None, workers=3)
+        self.assertEqual(len({worker.proc.pid for worker in forked.workers}), 1)
+
+        self.suite.pool_commandline = lambda shards: None
+        separate, started = self.execute(None, workers=3)
+        self.assertEqual(len({worker.proc.pid for worker in separate.workers}), 3)
+
+        self.assertEqual(forked.result_count, separate.result_count)
+        self.assertEqual(forked.completed_count, separate.completed_count)
+
+        # Modules that are all in one shard are named by their label.
+        labels = sum((worker.proc.args[3:] for worker in separate.workers), [])
+        self.assertLess(len(labels), separate.total_count)
+        self.assertIn('tests.test_outcomes', labels)
+        self.assertFalse(any(label.startswith('tests.test_outcomes.') for label in labels))
+
+    @unittest.skipUnless(shutil.which('pgrep'), "needs pgrep")
+    def test_forked_workers_stopped(self):
+        "Stopping the pool, even while it forks, stops every worker"
+        def workers():
+            result = subprocess.run(
+                ['pgrep', '-f', 'cricket.unittest.executor --shard'], stdout=subprocess.PIPE)
+            return result.stdout.split()
+
+        for delay in (0.0, 0.5):
+            count, labels = self.suite.find_tests(labels=['tests.test_unusual'])
+            executor = Executor(self.suite, count, labels, workers=2)
+            time.sleep(delay)
+            executor.workers[0].proc.terminate()
+            executor.workers[0].proc.wait()
+            executor.terminate()
+
+            deadline = time.time() + 5
+            while workers() and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(workers(), [])
+
+    def test_poll_limit(self):
+        "Output left over by a limited poll is processed by the next one"
+        executor, started = self.execute(None, workers=2, limit=3)
+
+        self.assertEqual(len(started), 27)
+        self.assertEqual(executor.completed_count, 32)
+        self.assertEqual(len(self.batched), 32)
+        self.assertEqual(executor.queue_depth, 0)
+
+    def test_history_recorded(self):
+        "Every finished test is recorded in the suite's history"
+        self.suite.history = TestHistory(':memory:')
+        executor, started = self.execute(['tests.submodule', 'tests.test_unusual'], workers=2)
+
+        medians = self.suite.history.median_durations()
+        self.assertEqual(set(medians), set(started))
+        self.assertGreaterEqual(
+            medians['tests.test_unusual.UnusualTests.test_slow_0'], 0.2)
+
+        # With a complete history, the estimate is the slowest
+        # worker's share of the recorded durations.
+        count, labels = self.suite.find_tests(labels=['tests.test_unusual'])
+        executor = Executor(self.suite, count, labels, workers=2)
+        executor.terminate()
+        executor.start_time = 0.0
+        executor.completed_count = 1
+        self.assertAlmostEqual(
+            executor.estimate_remaining(1.0),
+            max(
+                sum(medians[path] for path in worker.pending)
+                for worker in executor.workers
+            )
+        )
+
+    def test_history_subtests(self):
+        "A test with subtests is recorded once, with its worst result"
+        self.suite.history = TestHistory(':memory:')
+        self.execute(['tests.test_outcomes.BadTests.test_subtests'], workers=1)
+
+        results = self.suite.history.results('tests.test_outcomes.BadTests.test_subtests')
+        self.assertEqual([status for status, duration, timestamp in results], [TestMethod.STATUS_FAIL])
+
+    def test_run_selected_parallel(self):
+        "Only the selected tests are divided between workers"
+        executor, started = self.execute(['tests.submodule'], workers=2)
+
+        self.assertEqual(len(executor.workers), 2)
+        self.assertEqual(sorted(started), [
+            'tests.submodule.subsubmodule.test_deep_nesting.DeepNestedTests.test_stuff',
+            'tests.submodule.subsubmodule.test_deep_nesting.DeepNestedTests.test_things',
+            'tests.submodule.test_more_nesting.MoreNestedTests.test_stuff',
+            'tests.submodule.test_more_nesting.MoreNestedTests.test_things',
+            'tests.submodule.test_nesting.NestedTests.test_stuff',
+            'tests.submodule.test_nesting.NestedTests.test_things',
+            'tests.submodule.test_nesting.OtherNestedTests.test_stuff',
+            'tests.submodule.test_nesting.OtherNestedTests.test_things',
+        ])
+        self.assertEqual(executor.result_count, {TestMethod.STATUS_PASS: 8})
+
+
+def fixture_cases(calls):
+    "Return two test case classes that record their tests and class fixtures in calls."
+    class First(unittest.TestCase):
+        @classmethod
+        def setUpClass(cls):
+            calls.append('First.setUpClass')
+
+        def test_a(self):
+            calls.append('First.test_a')
+
+        def test_b(self):
+            calls.append('First.test_b')
+
+    class Second(unittest.TestCase):
+        @classmethod
+        def setUpClass(cls):
+            calls.append('Second.setUpClass')
+
+        def test_a(self):
+            calls.append('Second.test_a')
+
+    return First, Second
+
+
+class UnrollTests(unittest.TestCase):
+    def test_unroll_order(self):
+        "Tests are flattened in the order they were found, once each"
+        First, Second = fixture_cases([])
+        suite = unittest.TestSuite([
+            unittest.TestSuite([First('test_b'), Second('test_a')]),
+            First('test_a'),
+            First('test_b'),
+        ])
+
+        self.assertEqual(
+            ['%s.%s' % (type(test).__name__, test._testMethodName) for test in unroll_test_suite(suite)],
+            ['First.test_b', 'Second.test_a', 'First.test_a'],
+        )
+
+    def test_unroll_seen(self):
+        "Tests already seen under another label are left out"
+        First, Second = fixture_cases([])
+        seen = set()
+        unroll_test_suite(unittest.TestSuite([First('test_a')]), seen)
+        flat = unroll_test_suite(unittest.TestSuite([First('test_a'), First('test_b')]), seen)
+
+        self.assertEqual([test._testMethodName for test in flat], ['test_b'])
+
+    def test_class_fixtures_once(self):
+        "Grouped tests set up each class once"
+        calls = []
+        First, Second = fixture_cases(calls)
+        tests = [First('test_a'), Second('test_a'), First('test_b')]
+
+        unittest.TestSuite(group_tests(tests)).run(unittest.TestResult())
+        self.assertEqual(calls, [
+            'First.setUpClass', 'First.test_a', 'First.test_b',
+            'Second.setUpClass', 'Second.test_a',
+        ])
+
+
 class SuiteSplitTests(unittest.TestCase):
     def test_split_minimal(self):
         suite = UnittestTestSuite()
@@ -281,6 +617,58 @@ class SuiteSplitTests(unittest.TestCase):
         )
 
 
+class SuiteShardGroupTests(unittest.TestCase):
+    def test_shares_fixtures(self):
+        "Modules with setUpModule or setUpClass share fixtures between their tests"
+        suite = UnittestTestSuite()
+        project = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(project)
+        try:
+            with open('test_plain.py', 'w') as f:
+                f.write('class PlainTests(TestCase):\n    def test_stuff(self):\n        pass\n')
+            with open('test_fixtures.py', 'w') as f:
+                f.write('class FixtureTests(TestCase):\n    @classmethod\n    def setUpClass(cls):\n        pass\n')
+
+            self.assertFalse(suite.shares_fixtures('test_plain.PlainTests.test_stuff'))
+            self.assertTrue(suite.shares_fixtures('test_fixtures.FixtureTests.test_stuff'))
+            self.assertTrue(suite.shares_fixtures('test_missing.MissingTests.test_stuff'))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(project)
+
+    def test_group_minimal(self):
+        suite = UnittestTestSuite()
+        self.assertEqual(suite.shard_group('tests.TestClass.test_stuff'), 'tests')
+
+    def test_group_long(self):
+        suite = UnittestTestSuite()
+        self.assertEqual(
+            suite.shard_group('tests.submodule.test_nesting.NestedTests.test_stuff'),
+            'tests.submodule.test_nesting'
+        )
+
+
+class SuiteTestFileTests(unittest.TestCase):
+    def test_test_file(self):
+        suite = UnittestTestSuite()
+        self.assertEqual(
+            suite.test_file('tests.submodule.test_nesting.NestedTests.test_stuff'),
+            os.path.join('tests', 'submodule', 'test_nesting.py')
+        )
+
+    def test_file_label(self):
+        suite = UnittestTestSuite()
+        self.assertEqual(
+            suite.file_label(os.path.join('tests', 'submodule', 'test_nesting.py')),
+            'tests.submodule.test_nesting'
+        )
+        self.assertEqual(
+            suite.file_label(os.path.join('tests', 'submodule', '__init__.py')),
+            'tests.submodule'
+        )
+
+
 class SuiteJoinTests(unittest.TestCase):
     def test_join_method(self):
         suite = UnittestTestSuite()
@@ -305,3 +693,72 @@ class SuiteJoinTests(unittest.TestCase):
             suite.join_path((parent, 'module'), None),
             'tests.module'
         )
+
+
+class HeadlessTests(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        os.chdir(SAMPLE_DIR)
+        self.suite = UnittestTestSuite()
+        self.stream = io.StringIO()
+
+    def tearDown(self):
+        Executor._events.pop(Executor, None)
+        os.chdir(self._cwd)
+
+    def test_ndjson(self):
+        "Every event is a line of JSON"
+        runner = HeadlessRunner(self.suite, mode='ndjson', workers=2, stream=self.stream)
+        self.assertTrue(runner.discover(self.suite.start_refresh()))
+        status = runner.run(['tests.submodule', 'tests.test_outcomes.BadTests.test_error_item'])
+        self.assertEqual(status, 1)
+
+        events = [json.loads(line) for line in self.stream.getvalue().splitlines()]
+        self.assertEqual(events[0], dict(events[0], event='discovered', count=27))
+        self.assertEqual(events[1], dict(events[1], event='suite_start', count=9, workers=2))
+        ends = [event for event in events if event['event'] == 'test_end']
+        self.assertEqual(len(ends), 9)
+        self.assertEqual(
+            [event['status'] for event in ends if event['status'] != 'pass'], ['error'])
+        self.assertEqual(events[-1], dict(events[-1], event='summary', results={'pass': 8, 'error': 1}))
+
+    def test_progress(self):
+        "Progress is a character per result, then a summary"
+        runner = HeadlessRunner(self.suite, stream=self.stream)
+        runner.discover(self.suite.start_refresh())
+        self.assertEqual(runner.run(['tests.submodule']), 0)
+
+        output = self.stream.getvalue()
+        self.assertIn('\n........\n', output)
+        self.assertIn('8 passed in ', output)
+
+    def test_run_labels(self):
+        "The test process is given collapsed labels, and none at all to run every test"
+        runner = HeadlessRunner(self.suite, stream=self.stream)
+        runner.discover(self.suite.start_refresh())
+        self.assertEqual(runner.run(), 1)
+        self.assertEqual(runner.executor.workers[0].proc.args[3:], [])
+        self.assertIn('27 tests', self.stream.getvalue())
+
+        self.assertEqual(runner.run(['tests.submodule.test_nesting.NestedTests.test_stuff',
+                                     'tests.submodule.test_nesting.NestedTests.test_things']), 0)
+        self.assertEqual(
+            runner.executor.workers[0].proc.args[3:], ['tests.submodule.test_nesting.NestedTests'])
+
+    def test_ndjson_debug(self):
+        "Debug output doesn't get mixed in with NDJSON"
+        existed = os.path.exists('.cricket')
+        try:
+            result = subprocess.run(
+                [sys.executable, '-m', 'cricket.unittest', '--headless=ndjson', '--debug',
+                 '--no-history', '-l', 'tests.submodule.test_nesting'],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60,
+            )
+        finally:
+            if not existed:
+                shutil.rmtree('.cricket', ignore_errors=True)
+
+        self.assertEqual(result.returncode, 0)
+        events = [json.loads(line) for line in result.stdout.decode('utf-8').splitlines()]
+        self.assertEqual(events[-1]['event'], 'summary')
+        self.assertIn('emit', result.stderr.decode('utf-8'))
@@ -1,6 +1,16 @@
+from argparse import ArgumentTypeError
+import os
+import subprocess
+import sys
 import unittest
-from cricket.executor import parse_status_and_error
+from cricket.events import LineStream, PipeReader
+from cricket.executor import (
+    ProgressBatch, balance_shards, parse_status_and_error, parse_workers, split_group
+)
 from cricket.model import TestMethod
+from cricket.protocol import (
+    END_TEST_RESULTS, OUTPUT, START_TEST_RESULTS, FramedResultWriter, FrameStream, OutputStream
+)
 
 
 class TestErrorAndStatus(unittest.TestCase):
@@ -51,3 +61,244 @@ class TestErrorAndStatus(unittest.TestCase):
                     'output': '',
                 })
                 self.assertIsNone(error)
+
+
+class TestParseWorkers(unittest.TestCase):
+    def test_number(self):
+        self.assertEqual(parse_workers('1'), 1)
+        self.assertEqual(parse_workers('12'), 12)
+
+    def test_auto(self):
+        self.assertEqual(parse_workers('auto'), os.cpu_count() or 1)
+
+    def test_invalid(self):
+        for value in ('0', '-2', 'lots'):
+            with self.subTest('workers ' + value):
+                with self.assertRaises(ArgumentTypeError):
+                    parse_workers(value)
+
+
+class TestBalanceShards(unittest.TestCase):
+    def test_longest_first(self):
+        "The most expensive groups are spread out first"
+        shards, loads = balance_shards([
+            (1.0, ['a']),
+            (5.0, ['b']),
+            (3.0, ['c']),
+            (3.0, ['d']),
+            (2.0, ['e']),
+        ], 2)
+        self.assertEqual(shards, [['b', 'e'], ['a', 'c', 'd']])
+        self.assertEqual(loads, [7.0, 7.0])
+
+    def test_groups_kept_together(self):
+        "The tests in a group always end up in the same shard, in order"
+        shards, loads = balance_shards([
+            (4.0, ['a1', 'a2', 'a3']),
+            (1.0, ['b1']),
+            (1.0, ['c1']),
+        ], 3)
+        self.assertEqual(shards, [['a1', 'a2', 'a3'], ['b1'], ['c1']])
+        self.assertEqual(loads, [4.0, 1.0, 1.0])
+
+    def test_more_workers_than_groups(self):
+        "No empty shards are created"
+        shards, loads = balance_shards([(1.0, ['a']), (2.0, ['b'])], 8)
+        self.assertEqual(shards, [['b'], ['a']])
+        self.assertEqual(loads, [2.0, 1.0])
+
+        self.assertEqual(balance_shards([], 8), ([], []))
+
+
+class TestSplitGroup(unittest.TestCase):
+    def test_small_group(self):
+        "A group that costs no more than the size is left whole"
+        self.assertEqual(split_group(['a', 'b'], [1.0, 2.0], 3.0), [(3.0, ['a', 'b'])])
+        self.assertEqual(split_group(['a'], [0.0], 0.0), [(0.0, ['a'])])
+
+    def test_split(self):
+        "A big group is split into consecutive chunks of about the same cost"
+        paths = ['a', 'b', 'c', 'd', 'e', 'f', 'g']
+        self.assertEqual(split_group(paths, [1.0] * 7, 3.0), [
+            (3.0, ['a', 'b', 'c']),
+            (3.0, ['d', 'e', 'f']),
+            (1.0, ['g']),
+        ])
+        self.assertEqual(split_group(paths, [4.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0], 5.0), [
+            (5.0, ['a', 'b']),
+            (5.0, ['c', 'd', 'e', 'f', 'g']),
+        ])
+
+
+class ProgressBatchTests(unittest.TestCase):
+    def setUp(self):
+        self.first = TestMethod(None, 'tests.Case.test_first', 'test_first')
+        self.second = TestMethod(None, 'tests.Case.test_second', 'test_second')
+
+    def test_empty(self):
+        self.assertFalse(ProgressBatch())
+
+    def test_latest_state(self):
+        "Only the latest state of each test is kept"
+        batch = ProgressBatch()
+        batch.test_start(self.first)
+        batch.output.add(self.first.path)
+        batch.test_end(self.first, '1s')
+        batch.test_start(self.second)
+
+        self.assertTrue(batch)
+        self.assertEqual(list(batch.tests), [self.first.path, self.second.path])
+        self.assertEqual(batch.running, {self.second.path})
+        self.assertEqual(batch.ended, [self.first.path])
+        self.assertEqual(batch.last_started, self.second.path)
+        self.assertEqual(batch.remaining_time, '1s')
+
+    def test_merge(self):
+        "A later batch overrides the state of an earlier one"
+        batch = ProgressBatch()
+        batch.test_start(self.first)
+        batch.test_start(self.second)
+        batch.status_update = 'collecting'
+
+        later = ProgressBatch()
+        later.test_end(self.first, '2s')
+        batch.merge(later)
+
+        self.assertEqual(list(batch.tests), [self.second.path, self.first.path])
+        self.assertEqual(batch.running, {self.second.path})
+        self.assertEqual(batch.ended, [self.first.path])
+        self.assertEqual(batch.last_started, self.second.path)
+        self.assertEqual(batch.status_update, 'collecting')
+        self.assertEqual(batch.remaining_time, '2s')
+
+
+class LineStreamTests(unittest.TestCase):
+    def test_lines(self):
+        stream = LineStream(None)
+        stream.feed(b'first\r\nsec')
+        self.assertEqual(stream.take(), ['first'])
+        stream.feed(b'ond\nthird  \nfourth\n')
+        self.assertEqual(len(stream), 3)
+        self.assertEqual(stream.take(limit=2), ['second', 'third'])
+        self.assertEqual(stream.take(), ['fourth'])
+        self.assertEqual(stream.take(), [])
+
+    def test_split_character(self):
+        "A character split between reads is decoded once it is complete"
+        data = '\N{SNOWMAN} snow\n'.encode('utf-8')
+        stream = LineStream(None)
+        stream.feed(data[:1])
+        stream.feed(data[1:])
+        self.assertEqual(stream.take(), ['\N{SNOWMAN} snow'])
+
+    def test_end(self):
+        "A line with no newline is complete at the end of the pipe"
+        stream = LineStream(None)
+        stream.feed(b'last')
+        self.assertEqual(stream.take(), [])
+        self.assertFalse(stream.closed)
+        stream.feed(b'')
+        self.assertEqual(stream.take(), ['last'])
+        self.assertTrue(stream.closed)
+
+
+class PipeReaderTests(unittest.TestCase):
+    def test_read(self):
+        read_fd, write_fd = os.pipe()
+        reader = PipeReader()
+        try:
+            stream = reader.register(os.fdopen(read_fd, 'rb', buffering=0))
+            reader.read()
+            self.assertEqual(stream.take(), [])
+
+            os.write(write_fd, b'one\ntwo\nthr')
+            reader.read(timeout=5)
+            self.assertEqual(stream.take(), ['one', 'two'])
+
+            os.write(write_fd, b'ee')
+            os.close(write_fd)
+            while not stream.closed:
+                reader.read(timeout=5)
+            self.assertEqual(stream.take(), ['three'])
+        finally:
+            reader.close()
+
+    def test_close_threaded(self):
+        "Closing a reader that uses threads closes its pipes, and stops the threads"
+        reader = PipeReader(threaded=True)
+        pipes = []
+        for i in range(2):
+            read_fd, write_fd = os.pipe()
+            pipes.append(os.fdopen(read_fd, 'rb', buffering=0))
+            stream = reader.register(pipes[-1])
+            os.write(write_fd, b'output\n')
+            os.close(write_fd)
+        threads = [thread for thread, stream in reader._threads]
+
+        reader.close()
+        self.assertTrue(all(pipe.closed for pipe in pipes))
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        self.assertEqual(reader._threads, [])
+
+
+class FrameStreamTests(unittest.TestCase):
+    def test_frames(self):
+        "Frames are parsed however the data is split between reads"
+        read_fd, write_fd = os.pipe()
+        writer = FramedResultWriter(write_fd)
+        writer.marker(START_TEST_RESULTS)
+        writer.record({'path': 'tests.Case.test_one', 'output': '\x03 {not json}\n'})
+        writer.marker(END_TEST_RESULTS)
+        writer.file.close()
+        with os.fdopen(read_fd, 'rb') as pipe:
+            data = pipe.read()
+
+        stream = FrameStream(None)
+        for i in range(len(data)):
+            stream.feed(data[i:i + 1])
+        stream.feed(b'')
+        self.assertTrue(stream.closed)
+        self.assertEqual(len(stream), 3)
+        self.assertEqual(stream.take(limit=1), [(START_TEST_RESULTS, None)])
+        self.assertEqual(stream.take(), [
+            (None, {'path': 'tests.Case.test_one', 'output': '\x03 {not json}\n'}),
+            (END_TEST_RESULTS, None),
+        ])
+
+    def test_output(self):
+        "Output is sent in whole lines, before the results written after it"
+        read_fd, write_fd = os.pipe()
+        writer = FramedResultWriter(write_fd)
+        out = OutputStream(writer)
+        print('one', file=out)
+        out.write('two\nthr')
+        out.write('ee')
+        writer.record({'path': 'tests.Case.test_one'})
+        out.write('four')
+        writer.marker(END_TEST_RESULTS)
+        writer.file.close()
+        with os.fdopen(read_fd, 'rb') as pipe:
+            data = pipe.read()
+
+        stream = FrameStream(None)
+        stream.feed(data)
+        self.assertEqual(stream.take(), [
+            (OUTPUT, 'one\n'),
+            (OUTPUT, 'two\n'),
+            (OUTPUT, 'three\n'),
+            (None, {'path': 'tests.Case.test_one'}),
+            (OUTPUT, 'four\n'),
+            (END_TEST_RESULTS, None),
+        ])
+
+
+class LazyImportTests(unittest.TestCase):
+    def test_main_imports(self):
+        "Starting up doesn't load the GUI, or unittest, until they are needed"
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys; import cricket.main, cricket.unittest.__main__; '
+            'print(sorted({"tkinter", "cricket.view", "unittest"} & set(sys.modules)))'
+        ], cwd=root)
+        self.assertEqual(output.decode('utf-8').strip(), '[]')